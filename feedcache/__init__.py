@@ -38,6 +38,7 @@ __module_id__ = "$Id$"
 # Import local modules
 #
 from .cache import Cache
+from .asynccache import AsyncCache
 
 #
 # Module
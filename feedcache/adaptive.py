@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Estimate how long feed data can be cached from how often it changes.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+class ChangeHistory:
+    """Record of recent requests for a feed, noting whether the server
+    returned new data (a 200) or reported no change (a 304).
+    """
+
+    def __init__(self, size=20):
+        """
+        Arguments:
+
+          size=20 -- The number of observations to keep.
+
+        """
+        self.observations = collections.deque(maxlen=size)
+        return
+
+    def add(self, when, changed):
+        "Record whether the feed had changed at time when."
+        self.observations.append((when, changed))
+        return
+
+    def estimate_ttl(self, min_ttl, max_ttl):
+        """Return a time-to-live for the feed between min_ttl and
+        max_ttl, or None if there are not enough observations.
+
+        The mean interval between changes is estimated from the
+        history, and half of that interval is used so a change is
+        noticed reasonably soon after it happens.  A feed which has
+        not changed at all during the history is given a time-to-live
+        as long as the history covers, so it is checked less and less
+        often.
+        """
+        if len(self.observations) < 2:
+            return None
+        first_time = self.observations[0][0]
+        last_time = self.observations[-1][0]
+        span = last_time - first_time
+        # The first observation starts the history, so whether it
+        # was a change does not tell us anything about the interval.
+        changes = sum(1 for when, changed in list(self.observations)[1:]
+                      if changed)
+        if changes:
+            ttl = span / changes / 2
+        else:
+            ttl = span
+        return max(min_ttl, min(ttl, max_ttl))
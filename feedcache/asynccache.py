@@ -0,0 +1,381 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Cache variant for use with asyncio.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import asyncio
+import http.client
+import logging
+import ssl
+import time
+import urllib.parse
+
+#
+# Import local modules
+#
+from .cache import Cache
+from .timeouts import DeadlineExceeded
+from .transport import MAX_REDIRECTS, REDIRECT_CODES, \
+    _error_result, _parse_response
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.asynccache')
+
+
+class _TimeoutReader:
+    """Wrap a StreamReader so each read raises TimeoutError if no
+    data arrives within timeout seconds.
+    """
+
+    def __init__(self, reader, timeout):
+        self.reader = reader
+        self.timeout = timeout
+        return
+
+    async def _wait(self, aw):
+        try:
+            return await asyncio.wait_for(aw, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('read timed out')
+
+    def readline(self):
+        return self._wait(self.reader.readline())
+
+    def readexactly(self, n):
+        return self._wait(self.reader.readexactly(n))
+
+    async def read(self):
+        "Read to the end of the stream."
+        chunks = []
+        while True:
+            chunk = await self._wait(self.reader.read(65536))
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+
+def _parse_status_line(status_line):
+    "Return the status code from an HTTP status line."
+    if not status_line:
+        raise http.client.RemoteDisconnected(
+            'Remote end closed connection without response')
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise http.client.BadStatusLine(status_line)
+    try:
+        return int(parts[1])
+    except ValueError:
+        raise http.client.BadStatusLine(status_line)
+
+
+async def _read_body(reader, status, headers):
+    "Read the body of a response from reader."
+    if status in (204, 304) or 100 <= status < 200:
+        return b''
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        chunks = []
+        while True:
+            size_line = await reader.readline()
+            size = int(size_line.split(b';', 1)[0].strip() or b'0', 16)
+            if size == 0:
+                # Skip any trailer headers.
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readline()
+        return b''.join(chunks)
+    if 'content-length' in headers:
+        return await reader.readexactly(int(headers['content-length']))
+    return await reader.read()
+
+
+async def _http_get(url, request_headers, connect_timeout=None,
+                    read_timeout=None):
+    """Perform a GET request for url using asyncio streams.
+
+    Returns a tuple containing the status, the URL of the data after
+    any redirects, the response headers with lower-case names, and the
+    body.  As with feed parser, when redirects are followed the status
+    is the redirect code and not the status of the final response.
+
+    connect_timeout and read_timeout, when given, limit the time
+    spent connecting and waiting for each read.
+    """
+    redirect_status = None
+    for attempt in range(MAX_REDIRECTS + 1):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'https':
+            port = parts.port or 443
+            ssl_context = ssl.create_default_context()
+        else:
+            port = parts.port or 80
+            ssl_context = None
+        path = parts.path or '/'
+        if parts.query:
+            path += '?' + parts.query
+
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(parts.hostname, port,
+                                        ssl=ssl_context),
+                connect_timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError('connect timed out')
+        if read_timeout is not None:
+            reader = _TimeoutReader(reader, read_timeout)
+        try:
+            lines = ['GET %s HTTP/1.1' % path,
+                     'Host: %s' % parts.netloc,
+                     'Connection: close',
+                     ]
+            lines.extend('%s: %s' % item for item in request_headers.items())
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            await writer.drain()
+
+            status = _parse_status_line(await reader.readline())
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, sep, value = line.decode('latin-1').partition(':')
+                name = name.strip().lower()
+                value = value.strip()
+                if name in headers:
+                    headers[name] += ', ' + value
+                else:
+                    headers[name] = value
+            body = await _read_body(reader, status, headers)
+        finally:
+            writer.close()
+
+        if status in REDIRECT_CODES and 'location' in headers:
+            redirect_status = status
+            url = urllib.parse.urljoin(url, headers['location'])
+            logger.debug('redirected to %s', url)
+            continue
+        return (redirect_status or status, url, headers, body)
+
+    raise IOError('Too many redirects for %s' % url)
+
+
+class AsyncCache(Cache):
+    """Cache whose fetch() is a coroutine.
+
+    Network requests are made with asyncio streams, and parsing is
+    handed to an executor so it does not block the event loop.  The
+    rules for deciding when to use the cached data and when to update
+    the storage are the same as for Cache.fetch().
+    """
+
+    def __init__(self, storage, timeToLiveSeconds=300, userAgent='feedcache',
+                 staleIfErrorSeconds=0, failureBackoffSeconds=0,
+                 maxFailureBackoffSeconds=3600, executor=None,
+                 rateLimiter=None, circuitBreaker=None,
+                 connectTimeoutSeconds=None, readTimeoutSeconds=None,
+                 fetchDeadlineSeconds=None):
+        """
+        Arguments:
+
+          storage -- Backing store for the cache, as for Cache.  The
+          storage is used directly from the event loop, so it should
+          be fast (in-memory, or wrapped in a write-behind buffer).
+
+          timeToLiveSeconds=300 -- The length of time content should
+          live in the cache before an update is attempted.
+
+          userAgent='feedcache' -- User agent string to be used when
+          fetching feed contents.
+
+          staleIfErrorSeconds=0 -- For this long after the
+          time-to-live has passed, return the cached content if the
+          server cannot be reached or reports a server error.
+
+          failureBackoffSeconds=0 -- Initial delay before retrying a
+          feed which failed.
+
+          maxFailureBackoffSeconds=3600 -- Upper limit for the delay
+          between attempts to fetch a failing feed.
+
+          executor=None -- concurrent.futures executor used to parse
+          the feed data.  The loop's default executor is used if no
+          value is given.
+
+          rateLimiter=None -- A feedcache.ratelimit.RateLimiter
+          which every request sent to a server has to pass.  Requests
+          wait for it by sleeping on the event loop.
+
+          circuitBreaker=None -- A
+          feedcache.circuitbreaker.CircuitBreaker, used as for Cache.
+
+          connectTimeoutSeconds=None, readTimeoutSeconds=None,
+          fetchDeadlineSeconds=None -- Limits on the time spent
+          connecting, waiting for each read, and on the whole
+          request, as for Cache.
+
+        """
+        Cache.__init__(self, storage,
+                       timeToLiveSeconds=timeToLiveSeconds,
+                       userAgent=userAgent,
+                       staleIfErrorSeconds=staleIfErrorSeconds,
+                       failureBackoffSeconds=failureBackoffSeconds,
+                       maxFailureBackoffSeconds=maxFailureBackoffSeconds,
+                       rateLimiter=rateLimiter,
+                       circuitBreaker=circuitBreaker,
+                       connectTimeoutSeconds=connectTimeoutSeconds,
+                       readTimeoutSeconds=readTimeoutSeconds,
+                       fetchDeadlineSeconds=fetchDeadlineSeconds,
+                       )
+        self.executor = executor
+        return
+
+    async def _http_get(self, url, request_headers):
+        "Call _http_get() with the cache's timeouts."
+        request = _http_get(url, request_headers,
+                            connect_timeout=self.connect_timeout,
+                            read_timeout=self.read_timeout)
+        if self.fetch_deadline is None:
+            return await request
+        loop = asyncio.get_running_loop()
+        expires = loop.time() + self.fetch_deadline
+        try:
+            return await asyncio.wait_for(request, self.fetch_deadline)
+        except asyncio.TimeoutError:
+            # The connect and read timeouts raise the same exception.
+            if loop.time() < expires:
+                raise
+            raise DeadlineExceeded('fetch deadline passed')
+
+    async def _acquire_async(self, url):
+        """Wait for the rate limiter to allow a request for url,
+        without blocking the event loop.  Return the host to pass to
+        _release(), or None if there is no rate limiter.
+        """
+        if self.rate_limiter is None:
+            return None
+        host = urllib.parse.urlsplit(url).netloc
+        while True:
+            delay = self.rate_limiter.try_acquire(host)
+            if delay == 0:
+                return host
+            # There is no way to be told when a connection closes
+            # from here, so poll for that.
+            await asyncio.sleep(0.05 if delay is None else delay)
+
+    async def gather(self, urls, limit=100, force_update=False):
+        """Fetch all of the urls, with at most limit requests in
+        flight at one time, and return a list of the results in the
+        same order as urls.
+        """
+        semaphore = asyncio.Semaphore(limit)
+
+        async def bounded_fetch(url):
+            async with semaphore:
+                return await self.fetch(url, force_update=force_update)
+
+        return await asyncio.gather(*[bounded_fetch(url) for url in urls])
+
+    async def fetch(self, url, force_update=False, offline=False):
+        """Return the feed at url.
+
+        The arguments and caching behavior are the same as for
+        Cache.fetch().
+        """
+        logger.debug('url="%s"' % url)
+
+        key = url
+        modified = None
+        etag = None
+        now = time.time()
+
+        entry = self._lookup(key)
+        cached_time = entry.cached_time
+
+        if offline:
+            logger.debug('offline mode')
+            return entry.content
+
+        if not force_update and self._is_backing_off(key, now):
+            logger.debug('backing off after failures')
+            self._count('backoff')
+            return entry.content
+
+        logger.debug('cache modified time: %s' % str(cached_time))
+        if cached_time is not None and not force_update:
+            if self._is_fresh(key, cached_time, now, entry):
+                logger.debug('cache contents still valid')
+                return entry.content
+            etag = entry.etag
+            modified = entry.modified
+            logger.debug('cached etag=%s' % etag)
+            logger.debug('cached modified=%s' % str(modified))
+        else:
+            logger.debug('nothing in the cache, or forcing update')
+
+        request_headers = self._request_headers(etag, modified)
+
+        if not self._circuit_allows(url):
+            return entry.content
+
+        try:
+            host = await self._acquire_async(url)
+            logger.debug('fetching...')
+            self._count('network_requests')
+            try:
+                try:
+                    status, href, headers, body = await self._http_get(
+                        url, request_headers)
+                finally:
+                    self._release(host)
+            except (OSError, ValueError, asyncio.IncompleteReadError,
+                    http.client.HTTPException) as err:
+                # Report the error the way feed parser does, so the
+                # result is handled like any other failed request.
+                logger.warning('Error fetching %s: %s', url, err)
+                parsed_result = _error_result(err)
+            else:
+                loop = asyncio.get_running_loop()
+                parsed_result = await loop.run_in_executor(
+                    self.executor, _parse_response, href, status, headers,
+                    body)
+        except BaseException:
+            # Cancelled, or failed without a result to judge the host
+            # by, so let another request probe it.
+            self._cancel_host_request(url)
+            raise
+
+        return self._process_result(url, key, now, entry, parsed_result)
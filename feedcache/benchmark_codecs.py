@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Compare the codecs used to store parsed feeds.
+
+Run with::
+
+  python -m feedcache.benchmark_codecs [entries] [rounds]
+
+A feed with the given number of entries, each with an HTML summary
+and content, is parsed once.  The size of the stored data and the
+time taken to encode and decode it are printed for each codec, with
+and without compression.
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import random
+import sys
+import time
+
+import feedparser
+
+#
+# Import local modules
+#
+from .codec import CompressedCodec, JSONCodec, MarshalCodec, PickleCodec
+
+#
+# Module
+#
+
+ENTRY = """
+  <entry>
+    <title>Entry %(n)d</title>
+    <link href="http://www.example.com/%(n)d" rel="alternate"></link>
+    <id>http://www.example.com/%(n)d</id>
+    <updated>2006-10-14T11:00:36Z</updated>
+    <author><name>author %(n)d</name></author>
+    <category term="news"/>
+    <summary type="html">%(html)s</summary>
+    <content type="html">%(html)s</content>
+  </entry>"""
+
+
+WORDS = ('feed cache entry server request update news article story '
+         'report today people world time year city team game data music '
+         'market price season report policy school health water energy '
+         'science online history family').split()
+
+
+def make_html(rand):
+    "Return a few escaped HTML paragraphs of random words."
+    return ''.join('&lt;p&gt;%s.&lt;/p&gt;' % ' '.join(
+        rand.choice(WORDS) for i in range(40)) for j in range(5))
+
+
+def make_feed(entries):
+    "Return the text of an Atom feed with the given number of entries."
+    rand = random.Random(entries)
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<feed xmlns="http://www.w3.org/2005/Atom">\n'
+            '  <title>Benchmark</title>\n'
+            '  <updated>2006-10-14T11:00:36Z</updated>\n'
+            + ''.join(ENTRY % {'n': n, 'html': make_html(rand)}
+                      for n in range(entries))
+            + '\n</feed>')
+
+
+def main(entries=50, rounds=200):
+    feed = feedparser.parse(make_feed(entries))
+    print('%d entries, %d rounds' % (entries, rounds))
+    for name, codec in (
+            ('pickle', PickleCodec()),
+            ('marshal', MarshalCodec()),
+            ('json', JSONCodec()),
+            ('pickle+zlib', CompressedCodec(PickleCodec(), 'zlib')),
+            ('marshal+zlib', CompressedCodec(MarshalCodec(), 'zlib')),
+            ('pickle+lzma', CompressedCodec(PickleCodec(), 'lzma')),
+            ):
+        start = time.perf_counter()
+        for i in range(rounds):
+            data = codec.dumps(feed)
+        dumps = (time.perf_counter() - start) / rounds
+        start = time.perf_counter()
+        for i in range(rounds):
+            codec.loads(data)
+        loads = (time.perf_counter() - start) / rounds
+        print('%-13s %8d bytes  dumps %7.3fms  loads %7.3fms' % (
+            name, len(data), dumps * 1000, loads * 1000))
+    return
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
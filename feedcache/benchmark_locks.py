@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Compare the contention of the cache storage lock wrappers.
+
+Run with::
+
+  python -m feedcache.benchmark_locks [threads] [seconds]
+
+Each thread reads and writes random keys of a storage whose reads and
+writes take a little time, as loading and saving a pickled feed would.
+The number of operations completed with each lock wrapper is printed.
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import random
+import sys
+import threading
+import time
+
+#
+# Import local modules
+#
+from .cachestoragelock import (CacheStorageLock,
+                               ReadWriteCacheStorageLock,
+                               StripedCacheStorageLock,
+                               )
+
+#
+# Module
+#
+
+NUM_KEYS = 1000
+READ_DELAY = 0.0005
+WRITE_DELAY = 0.005
+WRITE_FRACTION = 0.1
+
+
+class SlowStorage(dict):
+    "Dictionary which takes a while to read and write values."
+
+    def __getitem__(self, key):
+        time.sleep(READ_DELAY)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        time.sleep(WRITE_DELAY)
+        dict.__setitem__(self, key, value)
+
+
+def run(wrapper, num_threads, seconds):
+    """Return the number of operations done on wrapper by num_threads
+    threads in the given number of seconds.
+    """
+    storage = SlowStorage(('key%d' % i, (0, None)) for i in range(NUM_KEYS))
+    locked = wrapper(storage)
+    counts = [0] * num_threads
+    stop = time.time() + seconds
+
+    def worker(n):
+        rand = random.Random(n)
+        while time.time() < stop:
+            key = 'key%d' % rand.randrange(NUM_KEYS)
+            if rand.random() < WRITE_FRACTION:
+                locked[key] = (time.time(), None)
+            else:
+                locked.get(key)
+            counts[n] += 1
+        return
+
+    threads = [threading.Thread(target=worker, args=(n,))
+               for n in range(num_threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts)
+
+
+def main(num_threads=32, seconds=3):
+    print('%d threads, %s seconds each' % (num_threads, seconds))
+    for wrapper in (CacheStorageLock,
+                    StripedCacheStorageLock,
+                    ReadWriteCacheStorageLock,
+                    ):
+        ops = run(wrapper, num_threads, seconds)
+        print('%-28s %8d ops  %10.1f ops/sec' % (wrapper.__name__, ops,
+                                                  ops / seconds))
+    return
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Compare shelve and SQLite cache storage.
+
+Run with::
+
+  python -m feedcache.benchmark_sqlite [entries]
+
+The storage is filled with entries holding a small parsed feed, half
+of them already expired.  The time taken for the cache's hit path
+(checking an entry is fresh and returning its feed), for rewriting
+every entry, and for purging the expired half is printed for each
+storage.
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import os
+import shelve
+import shutil
+import sys
+import tempfile
+import time
+
+#
+# Import local modules
+#
+from .cache import Cache
+from .cachestoragelock import CacheStorageLock
+from .sqlitestorage import SQLiteStorage
+
+#
+# Module
+#
+
+TIME_TO_LIVE = 300
+
+
+def make_feed(n):
+    "Return a dictionary shaped like a small parsed feed."
+    return {'etag': '"%d"' % n,
+            'modified': 'Sat, 01 Jan 2000 00:00:00 GMT',
+            'feed': {'title': 'Feed %d' % n, 'link': 'http://example.com/'},
+            'entries': [{'title': 'Entry %d' % i,
+                         'summary': 'Some text ' * 20,
+                         }
+                        for i in range(10)],
+            }
+
+
+def run(name, storage, entries):
+    now = time.time()
+    start = time.perf_counter()
+    for n in range(entries):
+        age = TIME_TO_LIVE * 2 if n % 2 else 0
+        storage['http://example.com/%d' % n] = (now - age, make_feed(n))
+    write = time.perf_counter() - start
+
+    cache = Cache(storage, timeToLiveSeconds=TIME_TO_LIVE)
+    start = time.perf_counter()
+    for n in range(0, entries, 2):
+        cache.fetch('http://example.com/%d' % n)
+    hits = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cache.purge(TIME_TO_LIVE)
+    purge = time.perf_counter() - start
+
+    print('%-8s write %7.3fs  hits %7.3fs  purge %7.3fs  left %d' % (
+        name, write, hits, purge, len(storage)))
+    return
+
+
+def main(entries=2000):
+    print('%d entries' % entries)
+    dirname = tempfile.mkdtemp('benchmark_sqlite')
+    try:
+        shelf = CacheStorageLock(
+            shelve.open(os.path.join(dirname, 'cache.shelf')))
+        run('shelve', shelf, entries)
+        shelf.close()
+        storage = SQLiteStorage(os.path.join(dirname, 'cache.db'))
+        run('sqlite', storage, entries)
+        storage.close()
+    finally:
+        shutil.rmtree(dirname)
+    return
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Compare fetching feeds with and without connection reuse.
+
+Run with::
+
+  python -m feedcache.benchmark_transport [feeds]
+
+A local keep-alive test server is started, and each of the feeds is
+fetched from it once by feed parser's own client, which opens a new
+connection for every request, and once through a
+PooledHTTPTransport.  Both are run one request at a time and with
+fetch_many().  The time taken and the number of connections opened
+are printed.
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import sys
+import threading
+import time
+
+#
+# Import local modules
+#
+from .cache import Cache
+from .test_server import KeepAliveHTTPHandler, KeepAliveHTTPServer
+from .transport import PooledHTTPTransport
+
+#
+# Module
+#
+
+URL = 'http://localhost:9999/feed%d'
+
+
+class QuietHandler(KeepAliveHTTPHandler):
+
+    def log_message(self, *args):
+        return
+
+
+def run(name, server, feeds, workers, transport=None):
+    cache = Cache({}, timeToLiveSeconds=0, transport=transport)
+    urls = [URL % n for n in range(feeds)]
+    before = server.getNumRequests()
+    start = time.perf_counter()
+    if workers == 1:
+        for url in urls:
+            cache.fetch(url)
+    else:
+        for url, feed_data in cache.fetch_many(urls, max_workers=workers):
+            pass
+    elapsed = time.perf_counter() - start
+    assert server.getNumRequests() - before == feeds
+    if transport is None:
+        # feed parser sends "Connection: close" with every request.
+        connections = feeds
+    else:
+        connections = transport.get_stats()['connections_opened']
+        transport.close()
+    print('%-8s workers %2d  %7.3fs  %6.2f ms/feed  connections %d' % (
+        name, workers, elapsed, elapsed * 1000 / feeds, connections))
+    return
+
+
+def main(feeds=500):
+    print('%d feeds' % feeds)
+    server = KeepAliveHTTPServer(handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        for workers in (1, 4):
+            run('urllib', server, feeds, workers)
+            run('pooled', server, feeds, workers,
+                PooledHTTPTransport(maxIdlePerHost=workers))
+    finally:
+        server.stop()
+        thread.join()
+        server.server_close()
+    return
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
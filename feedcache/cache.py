@@ -34,12 +34,25 @@ __module_id__ = "$Id$"
 #
 import feedparser
 
+import collections
+import copy
+from concurrent import futures
+import heapq
+import http.client
 import logging
+import threading
 import time
+import urllib.parse
 
 #
 # Import local modules
 #
+from .adaptive import ChangeHistory
+from . import freshness
+from .lru import LRUCache
+from .ratelimit import RateLimited
+from .timeouts import FetchTimeouts, is_timeout
+from .transport import _error_result, _format_modified, _parse_response
 
 
 #
@@ -48,6 +61,131 @@ import time
 
 logger = logging.getLogger('feedcache.cache')
 
+# Number of keys read or removed from the storage at a time while
+# purging.
+PURGE_BATCH_SIZE = 100
+
+# Seconds between the scans purge_step() makes for keys written to
+# the storage without going through the cache.
+INDEX_RESCAN_SECONDS = 3600
+
+
+class _Flight:
+    """A request in progress, shared by every caller fetching the
+    same key at the same time.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        return
+
+
+# Marker for feed content which has not been loaded from the storage.
+_NOT_LOADED = object()
+
+
+class _StoredFeed:
+    """The data found in the storage for a feed.
+
+    If the storage can return the metadata for a feed separately (see
+    feedcache.splitstorage), the parsed feed is only loaded from the
+    storage when the content attribute is used.  Feeds loaded from the
+    storage are added to memory, if it is given.  If value is given,
+    it is the (cached_time, content) pair to use instead of reading
+    the storage.
+    """
+
+    def __init__(self, storage, key, memory=None, value=None):
+        self.storage = storage
+        self.key = key
+        self.memory = memory
+        self._metadata = None
+        get_metadata = getattr(storage, 'get_metadata', None)
+        if value is not None:
+            self.cached_time, self._content = value
+        elif get_metadata is None:
+            self.cached_time, self._content = storage.get(key, (None, None))
+            self._remember()
+        else:
+            self._metadata = get_metadata(key) or {}
+            self.cached_time = self._metadata.get('cached_time')
+            self._content = _NOT_LOADED if self._metadata else None
+        return
+
+    def _remember(self):
+        if self.memory is not None and self.cached_time is not None:
+            self.memory.put(self.key, (self.cached_time, self._content))
+        return
+
+    @property
+    def content(self):
+        "The parsed feed, or None if nothing is stored."
+        if self._content is _NOT_LOADED:
+            try:
+                self._content = self.storage.get_body(self.key)
+            except KeyError:
+                # Removed since the metadata was read, for example
+                # by a purge, so treat it as a miss.
+                logger.debug('%s removed before its body was read',
+                             self.key)
+                self._content = None
+            else:
+                self._remember()
+        return self._content
+
+    def _get(self, name):
+        if self._metadata is not None:
+            return self._metadata.get(name)
+        return self.content.get(name)
+
+    @property
+    def etag(self):
+        return self._get('etag')
+
+    @property
+    def lifetime(self):
+        """Seconds the cache headers saved with the feed allow it to
+        be cached, or None.  Storages with metadata records keep the
+        value there, so the feed is not loaded to find it.
+        """
+        if self._metadata is not None:
+            return self._metadata.get('lifetime')
+        if self.content is None:
+            return None
+        return freshness.stored_lifetime(self.content, self.cached_time)
+
+    @property
+    def modified(self):
+        return self._get('modified')
+
+
+class FailureRecord:
+    """Details of the recent failed attempts to fetch a feed.
+
+      status -- HTTP status of the last failure, or None if the
+      server could not be reached.
+
+      error -- The exception reported for the last failure, if any.
+
+      count -- Number of failures in a row.
+
+      next_attempt -- Time before which the server should not be
+      contacted again for this feed.
+    """
+
+    def __init__(self):
+        self.status = None
+        self.error = None
+        self.count = 0
+        self.next_attempt = 0
+        return
+
+    def __repr__(self):
+        return '<FailureRecord status=%s count=%d next_attempt=%s>' % \
+            (self.status, self.count, self.next_attempt)
+
 
 class Cache:
     """A class to wrap Mark Pilgrim's Universal Feed Parser module
@@ -57,13 +195,28 @@ class Cache:
     caching.
     """
 
-    def __init__(self, storage, timeToLiveSeconds=300, userAgent='feedcache'):
+    def __init__(self, storage, timeToLiveSeconds=300, userAgent='feedcache',
+                 staleWhileRevalidateSeconds=0, staleIfErrorSeconds=0,
+                 revalidateWorkers=4, failureBackoffSeconds=0, maxFailureBackoffSeconds=3600,
+                 adaptiveTimeToLive=False, minTimeToLiveSeconds=60,
+                 maxTimeToLiveSeconds=86400, honorCacheHeaders=False,
+                 memoryCacheEntries=0, memoryCacheBytes=None,
+                 rateLimiter=None, connectTimeoutSeconds=None,
+                 readTimeoutSeconds=None, fetchDeadlineSeconds=None,
+                 circuitBreaker=None, transport=None):
         """
         Arguments:
 
           storage -- Backing store for the cache.  It should follow
           the dictionary API, with URLs used as keys.  It should
-          persist data.
+          persist data.  If it also has get_metadata() and get_body()
+          methods (see feedcache.splitstorage.SplitStorage), the
+          parsed feed is only loaded when it is returned.  If it has
+          a purge_before() method (see
+          feedcache.sqlitestorage.SQLiteStorage), purging is left
+          to the storage.  If it has a touch(key, cached_time)
+          method, that is used to update the time after a 304
+          response instead of storing the feed again.
 
           timeToLiveSeconds=300 -- The length of time content should
           live in the cache before an update is attempted.
@@ -71,10 +224,254 @@ class Cache:
           userAgent='feedcache' -- User agent string to be used when
           fetching feed contents.
 
+          staleWhileRevalidateSeconds=0 -- For this long after the
+          time-to-live has passed, return the cached content right
+          away and update it in a background thread.
+
+          revalidateWorkers=4 -- The most background threads used
+          at a time for those updates.  Further updates wait for a
+          free thread.  Call close() to stop the threads.
+
+          staleIfErrorSeconds=0 -- For this long after the
+          time-to-live has passed, return the cached content if the
+          server cannot be reached or reports a server error.
+
+          failureBackoffSeconds=0 -- After a failed attempt to fetch a
+          feed, wait this long before contacting the server for it
+          again, doubling the delay for each failure in a row.  In the
+          meantime fetch() returns the last good content, or None.
+
+          maxFailureBackoffSeconds=3600 -- Upper limit for the delay
+          between attempts to fetch a failing feed.
+
+          adaptiveTimeToLive=False -- When True, use a separate
+          time-to-live for each feed, based on how often the server
+          reports new data for it.  timeToLiveSeconds is used until
+          there is enough history for the feed.
+
+          minTimeToLiveSeconds=60 -- Lower limit for the adaptive
+          time-to-live.
+
+          maxTimeToLiveSeconds=86400 -- Upper limit for the adaptive
+          time-to-live.
+
+          honorCacheHeaders=False -- When True, use the Cache-Control
+          (s-maxage or max-age) or Expires headers sent by the server
+          to decide how long each response may be cached, and do not
+          contact a server which sent Retry-After with a 429 or 503
+          status until the time it asked for.  The values are kept
+          between minTimeToLiveSeconds and maxTimeToLiveSeconds.
+          Responses without those headers use the normal time-to-live.
+          The lifetime is saved with the feed, in the metadata record
+          for storages which have one, so it survives a restart.  The
+          Retry-After times, like the other failure records, are only
+          kept in memory.
+
+          memoryCacheEntries=0 -- When set, keep up to this many
+          parsed feeds in memory in front of the storage, so they do
+          not have to be loaded from it again.  Writes go to both the
+          memory and the storage, so the memory tier assumes this
+          cache is the only writer for the storage.
+
+          memoryCacheBytes=None -- When set, also limit the memory
+          tier to about this many bytes.
+
+          rateLimiter=None -- A feedcache.ratelimit.RateLimiter
+          which every request sent to a server has to pass.  It may
+          be shared by several caches.
+
+          connectTimeoutSeconds=None -- When set, give up on a server
+          which does not accept a connection in this long.
+
+          readTimeoutSeconds=None -- When set, give up on a server
+          which stops sending data for this long.
+
+          fetchDeadlineSeconds=None -- When set, give up on any
+          request which takes longer than this overall, including
+          redirects.  This stops servers which send data slowly
+          enough to get past the read timeout.
+
+          Requests which time out are treated like any other failed
+          request, so staleIfErrorSeconds and failureBackoffSeconds
+          apply to them.
+
+          circuitBreaker=None -- A
+          feedcache.circuitbreaker.CircuitBreaker told about the
+          outcome of every request.  While it refuses requests to a
+          host, feeds from that host are answered from the cache (or
+          with None) without contacting the server.  Connection
+          errors, timeouts and server errors count as failures.
+
+          transport=None -- An object used to send the HTTP requests
+          (see feedcache.transport), such as a PooledHTTPTransport
+          to reuse connections.  The response body is handed to feed
+          parser.  By default feed parser fetches the URL itself.
+
         """
         self.storage = storage
         self.time_to_live = timeToLiveSeconds
         self.user_agent = userAgent
+        self.stale_while_revalidate = staleWhileRevalidateSeconds
+        self.stale_if_error = staleIfErrorSeconds
+        self.revalidate_workers = revalidateWorkers
+        self.failure_backoff = failureBackoffSeconds
+        self.max_failure_backoff = maxFailureBackoffSeconds
+        self.adaptive_time_to_live = adaptiveTimeToLive
+        self.min_time_to_live = minTimeToLiveSeconds
+        self.max_time_to_live = maxTimeToLiveSeconds
+        self.honor_cache_headers = honorCacheHeaders
+        if memoryCacheEntries:
+            self.memory = LRUCache(maxEntries=memoryCacheEntries,
+                                   maxBytes=memoryCacheBytes)
+        else:
+            self.memory = None
+        self.rate_limiter = rateLimiter
+        self.connect_timeout = connectTimeoutSeconds
+        self.read_timeout = readTimeoutSeconds
+        self.fetch_deadline = fetchDeadlineSeconds
+        self.circuit_breaker = circuitBreaker
+        self.transport = transport
+        # Per-feed FailureRecord and ChangeHistory instances, by
+        # storage key.
+        self._failures = {}
+        self._history = {}
+        self._state_lock = threading.Lock()
+        # Keys being updated by background threads, and the thread
+        # pool running the updates (started when first needed).
+        self._background = set()
+        self._executor = None
+        # Index of (cached_time, key) pairs used to find expired
+        # entries without reading every value in the storage.  It is
+        # built from the storage the first time it is needed, and
+        # entries are ignored if the key was stored again since
+        # (_index_times holds the latest time for each key).  Other
+        # writers may add keys without going through this cache, so
+        # purge() and, every INDEX_RESCAN_SECONDS, purge_step() scan
+        # the keys for ones the index has not seen.
+        self._index = []
+        self._index_times = {}
+        self._index_unscanned = None
+        self._index_built = False
+        self._index_scanned_at = None
+        self._index_lock = threading.Lock()
+        # Requests in progress, by storage key.
+        self._in_flight = {}
+        self._flight_lock = threading.Lock()
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        return
+
+    def close(self):
+        """Wait for the background updates to finish and stop their
+        threads.  The storage is left open.
+        """
+        with self._flight_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        return
+
+    def _count(self, name, amount=1):
+        "Increment the named counter in the stats."
+        with self._stats_lock:
+            self.stats[name] += amount
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the cache.
+
+          network_requests -- Requests sent to a server.
+
+          coalesced -- Calls to fetch() which waited for a request
+          already in progress for the same URL instead of sending
+          their own.
+
+          stale_while_revalidate -- Expired content returned while
+          it was updated in the background.
+
+          stale_if_error -- Expired content returned because the
+          server failed.
+
+          failures -- Failed attempts to fetch a feed.
+
+          timeouts -- Failures caused by a timeout or the fetch
+          deadline.
+
+          circuit_open -- Requests not sent because the circuit
+          breaker was refusing requests to the host.
+
+          backoff -- Calls to fetch() answered without contacting the
+          server because the feed failed recently.
+
+          memory_hits, memory_misses -- Lookups answered, or not, by
+          the in-memory tier.
+
+          storage_hits, storage_misses -- Lookups which found, or did
+          not find, data in the storage.
+
+          skipped -- Feeds fetch_many() answered from the cache
+          because its budget ran out.
+
+          rate_limited -- Calls to fetch() with block=False turned
+          away by the rate limiter.
+
+          memory_hit_rate, storage_hit_rate -- The fraction of the
+          lookups made in each tier which were hits.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        for tier in ('memory', 'storage'):
+            hits = stats.get(tier + '_hits', 0)
+            lookups = hits + stats.get(tier + '_misses', 0)
+            if lookups:
+                stats[tier + '_hit_rate'] = hits / lookups
+        return stats
+
+    def _lookup(self, key):
+        """Return a _StoredFeed for key, checking the memory tier
+        before the storage.
+        """
+        if self.memory is not None:
+            value = self.memory.get(key)
+            if value is not None:
+                self._count('memory_hits')
+                return _StoredFeed(self.storage, key, value=value)
+            self._count('memory_misses')
+        entry = _StoredFeed(self.storage, key, self.memory)
+        if entry.cached_time is not None:
+            self._count('storage_hits')
+        else:
+            self._count('storage_misses')
+        return entry
+
+    def _store(self, key, cached_time, content):
+        "Save content for key in the storage and the memory tier."
+        self.storage[key] = (cached_time, content)
+        self._index_add(key, cached_time)
+        if self.memory is not None:
+            self.memory.put(key, (cached_time, content))
+        return
+
+    def _touch(self, key, cached_time, content):
+        """Record that the content stored for key is still current as
+        of cached_time.  Storages with a touch() method only update
+        the time; others get the whole value again.
+        """
+        touch = getattr(self.storage, 'touch', None)
+        touched = False
+        if touch is not None:
+            try:
+                touch(key, cached_time)
+                touched = True
+            except KeyError:
+                # The entry was removed since it was read.
+                pass
+        if not touched:
+            self.storage[key] = (cached_time, content)
+        self._index_add(key, cached_time)
+        if self.memory is not None:
+            self.memory.put(key, (cached_time, content))
         return
 
     def purge(self, olderThanSeconds):
@@ -83,22 +480,510 @@ class Cache:
         """
         if olderThanSeconds is None:
             logger.debug('purging the entire cache')
-            for key in list(self.storage.keys()):
-                del self.storage[key]
+            keys = list(self.storage.keys())
+            for i in range(0, len(keys), PURGE_BATCH_SIZE):
+                self._delete(keys[i:i + PURGE_BATCH_SIZE])
+            if self.memory is not None:
+                self.memory.clear()
+            with self._index_lock:
+                self._index = []
+                self._index_times = {}
+                self._index_unscanned = None
+                self._index_built = True
+                self._index_scanned_at = None
         else:
-            now = time.time()
-            # Iterate over the keys and load each item one at a time
-            # to avoid having the entire cache loaded into memory
-            # at one time.
-            for url in list(self.storage.keys()):
-                (cached_time, cached_data) = self.storage[url]
-                age = now - cached_time
-                if age >= olderThanSeconds:
-                    logger.debug('removing %s with age %d', url, age)
-                    del self.storage[url]
-        return
-
-    def fetch(self, url, force_update=False, offline=False):
+            self._purge_expired(time.time() - olderThanSeconds, None)
+        return
+
+    def purge_step(self, olderThanSeconds, budgetSeconds=0.05):
+        """Remove some of the cached data older than olderThanSeconds,
+        stopping after about budgetSeconds.  Returns True when there
+        is nothing left to remove.
+
+        This is meant to be called repeatedly, for example from a
+        background thread, so a large cache can be purged without
+        holding up calls to fetch().  Data written to the storage
+        without going through this cache is only looked for every
+        INDEX_RESCAN_SECONDS.
+        """
+        return self._purge_expired(time.time() - olderThanSeconds,
+                                   time.time() + budgetSeconds)
+
+    def _purge_indexed_storage(self, purge_before, cutoff, deadline):
+        """Remove data stored at or before cutoff from storage which
+        keeps its own index of the times.  Returns False if the
+        deadline passed before everything was removed.
+        """
+        if self.memory is not None:
+            self.memory.discard_matching(
+                lambda key, value: value[0] <= cutoff)
+        if deadline is None:
+            removed = purge_before(cutoff)
+            logger.debug('removed %d entries', removed)
+            return True
+        while True:
+            removed = purge_before(cutoff, PURGE_BATCH_SIZE)
+            logger.debug('removed %d entries', removed)
+            if removed < PURGE_BATCH_SIZE:
+                return True
+            if time.time() >= deadline:
+                return False
+
+    def _index_add(self, key, cached_time):
+        "Record that key was stored at cached_time."
+        with self._index_lock:
+            if self._index_built:
+                self._index_times[key] = cached_time
+                heapq.heappush(self._index, (cached_time, key))
+                # Entries for keys stored again are only removed when
+                # they reach the front of the heap, so rebuild it if
+                # they start to take up too much room.
+                if len(self._index) > 2 * len(self._index_times) + 1000:
+                    self._index = [(t, k)
+                                   for k, t in self._index_times.items()]
+                    heapq.heapify(self._index)
+        return
+
+    def _stored_times(self, keys):
+        """Return a dictionary mapping the keys which are in the storage
+        to the times their data was stored.
+        """
+        get_many = getattr(self.storage, 'get_many', None)
+        if get_many is not None and not hasattr(self.storage, 'get_metadata'):
+            # Read the whole batch with one call to the storage.
+            return dict((key, value[0])
+                        for key, value in get_many(keys).items())
+        times = {}
+        for key in keys:
+            # Only the metadata is read, if the storage supports it.
+            cached_time = _StoredFeed(self.storage, key).cached_time
+            if cached_time is not None:
+                times[key] = cached_time
+        return times
+
+    def _delete(self, keys):
+        "Remove keys from the storage and the memory tier."
+        if self.memory is not None:
+            for key in keys:
+                self.memory.discard(key)
+        delete_many = getattr(self.storage, 'delete_many', None)
+        if delete_many is not None:
+            delete_many(keys)
+        else:
+            for key in keys:
+                try:
+                    del self.storage[key]
+                except KeyError:
+                    pass
+        return
+
+    def _build_index(self, deadline):
+        """Add the keys in the storage which the expiration index has
+        not seen to the index.  Without a deadline the storage is
+        always scanned, otherwise only if the last scan finished
+        INDEX_RESCAN_SECONDS ago.  Returns False if the deadline
+        passed first.
+        """
+        with self._index_lock:
+            scanning = self._index_unscanned is not None
+            if not scanning:
+                if (deadline is not None
+                        and self._index_scanned_at is not None
+                        and time.time() < (self._index_scanned_at
+                                           + INDEX_RESCAN_SECONDS)):
+                    return True
+                # Writes through the cache are indexed from now on.
+                self._index_built = True
+        if not scanning:
+            logger.debug('scanning storage for the expiration index')
+            # List the keys without the lock, so fetches storing new
+            # data are not held up.
+            keys = list(self.storage.keys())
+            with self._index_lock:
+                if self._index_unscanned is None:
+                    self._index_unscanned = keys
+            if deadline is not None and time.time() >= deadline:
+                return False
+        while True:
+            with self._index_lock:
+                if not self._index_unscanned:
+                    self._index_unscanned = None
+                    self._index_scanned_at = time.time()
+                    return True
+                batch = []
+                while self._index_unscanned and len(batch) < PURGE_BATCH_SIZE:
+                    key = self._index_unscanned.pop()
+                    # Skip keys the index already has.
+                    if key not in self._index_times:
+                        batch.append(key)
+            for key, cached_time in self._stored_times(batch).items():
+                self._index_add(key, cached_time)
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+    def _purge_expired(self, cutoff, deadline):
+        """Remove data stored at or before cutoff.  Returns False if
+        the deadline passed before everything was removed.
+        """
+        purge_before = getattr(self.storage, 'purge_before', None)
+        if purge_before is not None:
+            return self._purge_indexed_storage(purge_before, cutoff, deadline)
+        if not self._build_index(deadline):
+            return False
+        while True:
+            with self._index_lock:
+                batch = []
+                while (self._index and self._index[0][0] <= cutoff
+                       and len(batch) < PURGE_BATCH_SIZE):
+                    cached_time, key = heapq.heappop(self._index)
+                    if self._index_times.get(key) != cached_time:
+                        # The key was stored again later.
+                        continue
+                    del self._index_times[key]
+                    batch.append(key)
+            if not batch:
+                with self._index_lock:
+                    if not self._index or self._index[0][0] > cutoff:
+                        return True
+                continue
+            # Check the storage, in case the value was changed
+            # without going through the cache.
+            expired = []
+            for key, stored_time in self._stored_times(batch).items():
+                if stored_time > cutoff:
+                    self._index_add(key, stored_time)
+                else:
+                    logger.debug('removing %s stored at %s', key, stored_time)
+                    expired.append(key)
+            self._delete(expired)
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+    def get_ttl(self, url):
+        """Return the time-to-live used for the data cached for url.
+        """
+        if self.adaptive_time_to_live:
+            with self._state_lock:
+                history = self._history.get(url)
+                if history is not None:
+                    ttl = history.estimate_ttl(self.min_time_to_live,
+                                               self.max_time_to_live)
+                    if ttl is not None:
+                        return ttl
+        return self.time_to_live
+
+    def get_expiration(self, url):
+        """Return the time when the data cached for url expires, or
+        None if nothing is cached or there is no time-to-live.
+        """
+        entry = _StoredFeed(self.storage, url)
+        if entry.cached_time is None:
+            return None
+        return self._expiration(url, entry.cached_time, entry)
+
+    def get_history(self, url):
+        """Return a list of (time, changed) pairs for the recent
+        requests for url, where changed is True when the server
+        returned new data and False when it reported no change.
+        """
+        with self._state_lock:
+            history = self._history.get(url)
+            return list(history.observations) if history is not None else []
+
+    def _record_change(self, key, now, changed):
+        "Add a request for key to its change history."
+        with self._state_lock:
+            history = self._history.get(key)
+            if history is None:
+                history = self._history[key] = ChangeHistory()
+            history.add(now, changed)
+        return
+
+    def _clamp_ttl(self, seconds):
+        "Return seconds kept within the configured time-to-live limits."
+        return max(self.min_time_to_live, min(seconds, self.max_time_to_live))
+
+    def _merge_cache_headers(self, content, cached_time, headers, now):
+        """Return a copy of content, stored at cached_time, with the
+        cache headers from the 304 response headers received at now.
+        Returns None if the new headers do not change the lifetime, so
+        the stored feed only needs to be touched.
+        """
+        if not self.honor_cache_headers:
+            return None
+        if 'cache-control' not in headers and 'expires' not in headers:
+            return None
+        merged = copy.copy(content)
+        merged['headers'] = dict(content.get('headers') or {})
+        merged['headers'].update((name, headers[name])
+                                 for name in ('cache-control', 'expires',
+                                              'date')
+                                 if name in headers)
+        if (freshness.stored_lifetime(merged, now)
+                == freshness.stored_lifetime(content, cached_time)):
+            return None
+        return merged
+
+    def _expiration(self, key, cached_time, entry=None):
+        """Return the time when the data cached for key at cached_time
+        expires, or None if there is no time-to-live.  entry is the
+        _StoredFeed read for key, if the caller has one.
+        """
+        if self.honor_cache_headers:
+            if entry is None:
+                entry = _StoredFeed(self.storage, key, self.memory)
+            lifetime = entry.lifetime
+            if lifetime is not None:
+                return cached_time + self._clamp_ttl(lifetime)
+        ttl = self.get_ttl(key)
+        if not ttl:
+            return None
+        return cached_time + ttl
+
+    def _is_fresh(self, key, cached_time, now, entry=None):
+        """Return True if data cached for key at cached_time is still
+        within the time-to-live.
+        """
+        if cached_time is None:
+            return False
+        expiration = self._expiration(key, cached_time, entry)
+        if expiration is None:
+            logger.debug('no TTL value')
+            return False
+        if now > expiration:
+            logger.debug('cache contents older than TTL')
+            return False
+        return True
+
+    def get_failure(self, url):
+        """Return a FailureRecord describing the recent failures to
+        fetch url, or None if the last attempt succeeded.
+        """
+        with self._state_lock:
+            record = self._failures.get(url)
+            return copy.copy(record) if record is not None else None
+
+    def _is_backing_off(self, key, now):
+        """Return True if the server should not be contacted for key
+        because of recent failures.
+        """
+        with self._state_lock:
+            record = self._failures.get(key)
+            return record is not None and now < record.next_attempt
+
+    def _record_failure(self, key, now, status, error, retry_at=None):
+        """Remember a failed attempt to fetch key and set the next
+        attempt time.  retry_at is the time the server asked us to
+        wait for, if any.
+        """
+        self._count('failures')
+        if is_timeout(error):
+            self._count('timeouts')
+        with self._state_lock:
+            record = self._failures.get(key)
+            if record is None:
+                record = self._failures[key] = FailureRecord()
+            record.status = status
+            record.error = error
+            record.count += 1
+            if self.failure_backoff:
+                delay = min(self.failure_backoff * 2 ** (record.count - 1),
+                            self.max_failure_backoff)
+                record.next_attempt = now + delay
+                logger.debug('backing off %s for %s seconds', key, delay)
+            if retry_at is not None:
+                retry_at = min(retry_at, now + self.max_time_to_live)
+                record.next_attempt = max(record.next_attempt, retry_at)
+                logger.debug('server asked to wait until %s for %s',
+                             retry_at, key)
+        return
+
+    def _record_success(self, key):
+        "Forget about earlier failures to fetch key."
+        with self._state_lock:
+            self._failures.pop(key, None)
+        return
+
+    def _is_within_stale_window(self, key, cached_time, now, window,
+                                entry=None):
+        """Return True if data cached for key at cached_time has not
+        been expired for more than window seconds.
+        """
+        if cached_time is None or not window:
+            return False
+        expiration = (self._expiration(key, cached_time, entry)
+                      or cached_time)
+        return now <= expiration + window
+
+    def fetch_many(self, urls, max_workers=10, per_host_limit=None,
+                   force_update=False, budget=None, skipped=None):
+        """Fetch several feeds concurrently, generating (url, result)
+        pairs as each one finishes.
+
+        urls - Iterable of feed URLs.
+
+        max_workers=10 - The size of the thread pool used for network
+                         requests.
+
+        per_host_limit=None - When set, the maximum number of requests
+                              in flight to any one host at a time.
+
+        force_update=False - Passed through to fetch().
+
+        budget=None - When set, the number of seconds to spend on the
+                      whole batch.  Requests not started by then are
+                      answered from the cache instead.  Requests in
+                      progress are allowed to finish, so use
+                      fetchDeadlineSeconds to bound them.
+
+        skipped=None - A list to which the URLs answered from the
+                       cache because the budget ran out are added.
+
+        Feeds whose cached data is still within the time-to-live are
+        answered from the storage right away, without using a worker
+        thread.  The others are fetched with fetch(), so the usual
+        conditional GET and storage rules apply.  Results are produced
+        in completion order, not the order of urls.  Exceptions raised
+        by fetch() are propagated to the caller.
+
+        Requests turned away by the rate limiter are queued again
+        until it has room for them, rather than holding a worker
+        thread while they wait.
+        """
+        now = time.time()
+        hits = []
+        # Requests waiting for a free slot on their host, and the
+        # number of requests in flight for each host.
+        waiting = {}
+        active = {}
+        # Requests refused by the rate limiter, as a heap of
+        # (retry_time, seq, url, host), and those waiting for another
+        # request to the host to finish.
+        delayed = []
+        blocked = []
+        seq = 0
+        stop_time = None
+        if budget is not None:
+            stop_time = now + budget
+        out_of_time = False
+        with futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            running = {}
+
+            def start(url, host):
+                f = executor.submit(self.fetch, url,
+                                    force_update=force_update, block=False)
+                running[f] = (url, host)
+
+            def submit(url, host):
+                active[host] = active.get(host, 0) + 1
+                start(url, host)
+
+            for url in urls:
+                if not force_update:
+                    entry = self._lookup(url)
+                    if self._is_fresh(url, entry.cached_time, now, entry):
+                        hits.append((url, entry.content))
+                        continue
+                host = urllib.parse.urlsplit(url).netloc
+                if per_host_limit and active.get(host, 0) >= per_host_limit:
+                    waiting.setdefault(host, collections.deque()).append(url)
+                else:
+                    submit(url, host)
+
+            logger.debug('fetch_many: %d from cache, %d to fetch',
+                         len(hits), len(running)
+                         + sum(len(v) for v in waiting.values()))
+            for hit in hits:
+                yield hit
+
+            while running or delayed or blocked:
+                timeout = None
+                if delayed:
+                    timeout = max(0, delayed[0][0] - time.time())
+                elif blocked and not running:
+                    # The connections are held by someone else, so
+                    # there is nothing to wait for here.
+                    timeout = 0.05
+                if stop_time is not None:
+                    time_left = max(0, stop_time - time.time())
+                    if timeout is None or time_left < timeout:
+                        timeout = time_left
+                idle = not running
+                if idle:
+                    time.sleep(timeout)
+                    done = ()
+                else:
+                    done, not_done = futures.wait(
+                        running, timeout=timeout,
+                        return_when=futures.FIRST_COMPLETED)
+                if stop_time is not None and time.time() >= stop_time:
+                    # Out of time, so answer everything which has not
+                    # been sent yet from the cache.
+                    stop_time = None
+                    out_of_time = True
+                    left = [url for retry_time, _, url, host in delayed]
+                    left.extend(url for url, host in blocked)
+                    for queued in waiting.values():
+                        left.extend(queued)
+                    del delayed[:]
+                    del blocked[:]
+                    waiting.clear()
+                    for f, (url, host) in list(running.items()):
+                        if f.cancel():
+                            del running[f]
+                            left.append(url)
+                    logger.debug('fetch_many: out of time, skipping %d',
+                                 len(left))
+                    for url in left:
+                        yield url, self._skip(url, skipped)
+                elif idle:
+                    for url, host in blocked:
+                        start(url, host)
+                    del blocked[:]
+                while delayed and delayed[0][0] <= time.time():
+                    retry_time, _, url, host = heapq.heappop(delayed)
+                    start(url, host)
+                for f in done:
+                    url, host = running.pop(f)
+                    err = f.exception()
+                    if isinstance(err, RateLimited):
+                        if out_of_time:
+                            yield url, self._skip(url, skipped)
+                            continue
+                        # Keep the host's slot for this request and
+                        # try it again later.
+                        if err.delay is None:
+                            blocked.append((url, host))
+                        else:
+                            seq += 1
+                            heapq.heappush(
+                                delayed,
+                                (time.time() + err.delay, seq, url, host))
+                        continue
+                    active[host] -= 1
+                    # A connection was closed, so requests waiting
+                    # for one may be able to go now.
+                    for url_host in blocked:
+                        start(*url_host)
+                    del blocked[:]
+                    # Hand the host's slot to the next queued request
+                    # before giving the result to the caller.
+                    queued = waiting.get(host)
+                    if queued:
+                        submit(queued.popleft(), host)
+                    yield url, f.result()
+        return
+
+    def _skip(self, url, skipped):
+        """Return the cached content for url, which fetch_many() ran
+        out of time to fetch, adding url to skipped.
+        """
+        self._count('skipped')
+        if skipped is not None:
+            skipped.append(url)
+        return self._lookup(url).content
+
+    def fetch(self, url, force_update=False, offline=False, block=True):
         """Return the feed at url.
 
         url - The URL of the feed.
@@ -112,6 +997,11 @@ class Cache:
                                  cache and never access the remote
                                  URL.
 
+        block=True - When False, raise
+                     feedcache.ratelimit.RateLimited instead of
+                     waiting if the rate limiter has no room for a
+                     request to the feed's host.
+
         If there is data for that feed in the cache already, check
         the expiration date before accessing the server.  If the
         cached data has not expired, return it without accessing the
@@ -136,65 +1026,322 @@ class Cache:
         etag = None
         now = time.time()
 
-        cached_time, cached_content = self.storage.get(key, (None, None))
+        # Only the metadata is read here, if the storage supports
+        # it.  The parsed feed is loaded when it is returned.
+        entry = self._lookup(key)
+        cached_time = entry.cached_time
 
         # Offline mode support (no networked requests)
         # so return whatever we found in the storage.
         # If there is nothing in the storage, we'll be returning None.
         if offline:
             logger.debug('offline mode')
-            return cached_content
+            return entry.content
+
+        # Do not contact a server which failed recently.
+        if not force_update and self._is_backing_off(key, now):
+            logger.debug('backing off after failures')
+            self._count('backoff')
+            return entry.content
 
         # Does the storage contain a version of the data
         # which is older than the time-to-live?
         logger.debug('cache modified time: %s' % str(cached_time))
         if cached_time is not None and not force_update:
-            if self.time_to_live:
-                age = now - cached_time
-                if age <= self.time_to_live:
-                    logger.debug('cache contents still valid')
-                    return cached_content
-                else:
-                    logger.debug('cache contents older than TTL')
-            else:
-                logger.debug('no TTL value')
+            if self._is_fresh(key, cached_time, now, entry):
+                logger.debug('cache contents still valid')
+                return entry.content
 
             # The cache is out of date, but we have
             # something.  Try to use the etag and modified_time
             # values from the cached content.
-            etag = cached_content.get('etag')
-            modified = cached_content.get('modified')
+            etag = entry.etag
+            modified = entry.modified
             logger.debug('cached etag=%s' % etag)
             logger.debug('cached modified=%s' % str(modified))
+
+            if self._is_within_stale_window(key, cached_time, now,
+                                            self.stale_while_revalidate,
+                                            entry):
+                logger.debug('returning stale contents while updating')
+                self._count('stale_while_revalidate')
+                self._revalidate_in_background(url, key, now, entry,
+                                               etag, modified)
+                return entry.content
         else:
             logger.debug('nothing in the cache, or forcing update')
 
-        # We know we need to fetch, so go ahead and do it.
+        # We know we need to fetch, so go ahead and do it, unless
+        # another thread is already fetching the same data.
+        try:
+            return self._coalesce(key, self._revalidate,
+                                  url, key, now, entry, etag, modified,
+                                  block)
+        except RateLimited:
+            if not block:
+                raise
+            # We shared a request which was not allowed to wait for
+            # the rate limiter, so make one which is.
+            return self._coalesce(key, self._revalidate,
+                                  url, key, now, entry, etag, modified)
+
+    def _revalidate_in_background(self, url, key, *args):
+        """Queue an update of the cached data for url in the
+        background thread pool, unless one is already queued or
+        running.
+        """
+        def run():
+            try:
+                self._coalesce(key, self._revalidate, url, key, *args)
+            except Exception:
+                logger.exception('Error updating %s in the background', url)
+            finally:
+                with self._flight_lock:
+                    self._background.discard(key)
+            return
+
+        # Submit while holding the lock, so close() cannot shut the
+        # pool down in between.
+        with self._flight_lock:
+            if key in self._background or key in self._in_flight:
+                return
+            self._background.add(key)
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self.revalidate_workers,
+                    thread_name_prefix='feedcache-revalidate')
+            self._executor.submit(run)
+        return
+
+    def _coalesce(self, key, func, *args):
+        """Call func(*args), unless a call for key is already in
+        progress in another thread.  In that case wait for it to
+        finish and share its result.
+        """
+        with self._flight_lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._in_flight[key] = _Flight()
+
+        if not leader:
+            logger.debug('waiting for request in progress for %s', key)
+            self._count('coalesced')
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args)
+        except Exception as err:
+            flight.error = err
+            raise
+        finally:
+            with self._flight_lock:
+                del self._in_flight[key]
+            flight.done.set()
+        return flight.result
+
+    def _acquire(self, url, block):
+        """Wait for the rate limiter to allow a request for url, or
+        raise RateLimited if block is False and it does not allow one
+        now.  Return the host to pass to _release(), or None if there
+        is no rate limiter.
+        """
+        if self.rate_limiter is None:
+            return None
+        host = urllib.parse.urlsplit(url).netloc
+        if block:
+            self.rate_limiter.acquire(host)
+        else:
+            delay = self.rate_limiter.try_acquire(host)
+            if delay != 0:
+                self._count('rate_limited')
+                raise RateLimited(host, delay)
+        return host
+
+    def _release(self, host):
+        "Tell the rate limiter a request returned by _acquire() is done."
+        if host is not None:
+            self.rate_limiter.release(host)
+        return
+
+    def _circuit_allows(self, url):
+        """Return True unless the circuit breaker is refusing requests
+        to the host for url.
+        """
+        if self.circuit_breaker is None:
+            return True
+        if self.circuit_breaker.allow(urllib.parse.urlsplit(url).netloc):
+            return True
+        logger.debug('circuit open for %s', url)
+        self._count('circuit_open')
+        return False
+
+    def _cancel_host_request(self, url):
+        """Tell the circuit breaker a request it allowed for url was
+        not sent, or was interrupted, so another may probe the host.
+        """
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.cancel(urllib.parse.urlsplit(url).netloc)
+        return
+
+    def _record_host_result(self, url, ok):
+        "Tell the circuit breaker whether a request for url worked."
+        if self.circuit_breaker is not None:
+            host = urllib.parse.urlsplit(url).netloc
+            if ok:
+                self.circuit_breaker.record_success(host)
+            else:
+                self.circuit_breaker.record_failure(host)
+        return
+
+    def _request_headers(self, etag, modified):
+        "Return the headers for a conditional GET request."
+        request_headers = {
+            'User-Agent': self.user_agent,
+            'Accept': feedparser.http.ACCEPT_HEADER,
+            'Accept-Encoding': 'gzip, deflate',
+            }
+        if etag:
+            request_headers['If-None-Match'] = etag
+        if modified:
+            request_headers['If-Modified-Since'] = _format_modified(modified)
+        return request_headers
+
+    def _transport_get(self, url, etag, modified, timeouts):
+        """Fetch url with the transport and return the parsed result,
+        in the same form as feed parser's.
+        """
+        try:
+            status, href, headers, body = self.transport.get(
+                url, self._request_headers(etag, modified), timeouts)
+        except (OSError, ValueError, http.client.HTTPException) as err:
+            logger.warning('Error fetching %s: %s', url, err)
+            return _error_result(err)
+        return _parse_response(href, status, headers, body)
+
+    def _revalidate(self, url, key, now, entry, etag, modified, block=True):
+        """Fetch url from the server, using etag and modified for a
+        conditional GET, and update the storage.
+        """
+        if not self._circuit_allows(url):
+            return entry.content
+        try:
+            host = self._acquire(url, block)
+        except BaseException:
+            self._cancel_host_request(url)
+            raise
         logger.debug('fetching...')
-        parsed_result = feedparser.parse(url,
-                                         agent=self.user_agent,
-                                         modified=modified,
-                                         etag=etag,
-                                         )
+        self._count('network_requests')
+        timeouts = handlers = None
+        if (self.connect_timeout or self.read_timeout
+                or self.fetch_deadline):
+            timeouts = FetchTimeouts(connectTimeout=self.connect_timeout,
+                                     readTimeout=self.read_timeout,
+                                     deadline=self.fetch_deadline)
+            handlers = timeouts.handlers()
+        try:
+            try:
+                if self.transport is None:
+                    parsed_result = feedparser.parse(url,
+                                                     agent=self.user_agent,
+                                                     modified=modified,
+                                                     etag=etag,
+                                                     handlers=handlers,
+                                                     )
+                else:
+                    parsed_result = self._transport_get(url, etag, modified,
+                                                        timeouts)
+                if timeouts is not None:
+                    # The response may have been cut off.
+                    timeouts.check()
+            except Exception:
+                if timeouts is not None:
+                    # Shutting the connection down at the deadline
+                    # can also show up as a connection error.
+                    timeouts.check()
+                raise
+            finally:
+                if timeouts is not None:
+                    timeouts.cancel()
+                self._release(host)
+        except BaseException as err:
+            if not isinstance(err, Exception):
+                # Interrupted, which says nothing about the host.
+                self._cancel_host_request(url)
+                raise
+            self._record_host_result(url, False)
+            self._record_failure(key, now, None, err)
+            if not self._is_within_stale_window(key, entry.cached_time, now,
+                                                self.stale_if_error, entry):
+                raise
+            logger.warning('Returning stale contents for %s after error: %s',
+                           url, err)
+            self._count('stale_if_error')
+            return entry.content
+
+        return self._process_result(url, key, now, entry, parsed_result)
 
+    def _process_result(self, url, key, now, entry, parsed_result):
+        """Update the storage based on the response in parsed_result and
+        return the data to give to the caller.
+        """
         status = parsed_result.get('status', None)
         logger.debug('HTTP status=%s' % status)
+        self._record_host_result(url, status is not None and status < 500)
+        error = parsed_result.get('bozo_exception')
+        headers = parsed_result.get('headers') or {}
+        if status is None or status >= 400 or (status == 200 and error):
+            retry_at = None
+            if self.honor_cache_headers and status in (429, 503):
+                retry_at = freshness.retry_after(headers, now)
+            self._record_failure(key, now, status, error, retry_at)
+        elif status in (200, 304):
+            self._record_success(key)
+            self._record_change(key, now, status == 200)
+
+        if ((status is None or status >= 500)
+                and self._is_within_stale_window(key, entry.cached_time, now,
+                                                 self.stale_if_error,
+                                                 entry)):
+            # The server could not be reached or failed, but
+            # what we have is recent enough to use anyway.
+            logger.warning('Returning stale contents for %s after status %s',
+                           url, status)
+            self._count('stale_if_error')
+            return entry.content
+
         if status == 304:
             # No new data, based on the etag or modified values.
             # We need to update the modified time in the
             # storage, though, so we know that what we have
             # stored is up to date.
-            self.storage[key] = (now, cached_content)
+            cached_content = entry.content
+            if cached_content is None:
+                # The stored feed was removed while we asked, so there
+                # is nothing to keep.  The next fetch gets it again.
+                logger.debug('%s removed during revalidation', url)
+            else:
+                merged = self._merge_cache_headers(
+                    cached_content, entry.cached_time, headers, now)
+                if merged is None:
+                    self._touch(key, now, cached_content)
+                else:
+                    # The server sent new cache headers, so save them
+                    # with the feed.
+                    self._store(key, now, merged)
+                    cached_content = merged
 
             # Return the data from the cache, since
             # the parsed data will be empty.
             parsed_result = cached_content
         elif status == 200:
             # There is new content, so store it unless there was an error.
-            error = parsed_result.get('bozo_exception')
             if not error:
                 logger.debug('Updating stored data for %s' % url)
-                self.storage[key] = (now, parsed_result)
+                self._store(key, now, parsed_result)
             else:
                 logger.warning('Not storing data with exception: %s',
                                error)
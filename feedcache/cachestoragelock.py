@@ -24,7 +24,7 @@
 #
 
 
-"""Lock wrapper for cache storage which do not permit multi-threaded access.
+"""Lock wrappers for cache storage which do not permit multi-threaded access.
 
 """
 
@@ -33,6 +33,8 @@ __module_id__ = "$Id$"
 #
 # Import system modules
 #
+import collections.abc
+import contextlib
 import threading
 
 #
@@ -44,8 +46,11 @@ import threading
 # Module
 #
 
-class CacheStorageLock:
+class CacheStorageLock(collections.abc.MutableMapping):
     """Lock wrapper for cache storage which do not permit multi-threaded access.
+
+    Implements the full mapping API, plus get_many(), set_many() and
+    delete_many() which hold the lock once for a whole batch of keys.
     """
 
     def __init__(self, shelf):
@@ -53,17 +58,237 @@ class CacheStorageLock:
         self.shelf = shelf
         return
 
+    def _reading(self, keys=None):
+        """Return a context manager which holds the lock for reading
+        keys (all keys if None).
+        """
+        return self.lock
+
+    def _writing(self, keys=None):
+        """Return a context manager which holds the lock for writing
+        keys (all keys if None).
+        """
+        return self.lock
+
     def __getitem__(self, key):
-        with self.lock:
+        with self._reading((key,)):
             return self.shelf[key]
 
     def get(self, key, default=None):
-        with self.lock:
+        with self._reading((key,)):
             try:
                 return self.shelf[key]
             except KeyError:
                 return default
 
     def __setitem__(self, key, value):
-        with self.lock:
+        with self._writing((key,)):
             self.shelf[key] = value
+
+    def __delitem__(self, key):
+        with self._writing((key,)):
+            del self.shelf[key]
+
+    def touch(self, key, cached_time):
+        """Change the time key was stored, using the touch() method of
+        the underlying storage if it has one.
+        """
+        with self._writing((key,)):
+            touch = getattr(self.shelf, 'touch', None)
+            if touch is not None:
+                touch(key, cached_time)
+            else:
+                content = self.shelf[key][1]
+                self.shelf[key] = (cached_time, content)
+        return
+
+    def __contains__(self, key):
+        with self._reading((key,)):
+            return key in self.shelf
+
+    def __len__(self):
+        with self._reading():
+            return len(self.shelf)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        "Return a list of the keys in the storage."
+        with self._reading():
+            return list(self.shelf.keys())
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the storage.
+        """
+        keys = list(keys)
+        values = {}
+        with self._reading(keys):
+            for key in keys:
+                try:
+                    values[key] = self.shelf[key]
+                except KeyError:
+                    pass
+        return values
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = list(items)
+        with self._writing([key for key, value in items]):
+            for key, value in items:
+                self.shelf[key] = value
+        return
+
+    def delete_many(self, keys):
+        "Remove keys from the storage, ignoring any which are not there."
+        keys = list(keys)
+        with self._writing(keys):
+            for key in keys:
+                try:
+                    del self.shelf[key]
+                except KeyError:
+                    pass
+        return
+
+    def close(self):
+        "Close the underlying storage, if it supports it."
+        close = getattr(self.shelf, 'close', None)
+        if close is not None:
+            with self._writing():
+                close()
+        return
+
+
+class _MultiLock:
+    "Context manager which holds several locks at once."
+
+    def __init__(self, locks):
+        self.locks = locks
+        return
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+        return False
+
+
+class StripedCacheStorageLock(CacheStorageLock):
+    """Lock wrapper which uses one of several locks for each key,
+    chosen by the hash of the key, so threads working with different
+    keys do not wait for each other.  Operations on several keys hold
+    the locks for all of them, and operations on the whole storage
+    hold every lock.
+
+    Only use this with storage which is safe to use from several
+    threads at once as long as they use different keys, such as a
+    dict or a directory of files.  A single shelf or dbm file needs
+    CacheStorageLock instead.
+    """
+
+    def __init__(self, shelf, stripes=16):
+        self.locks = [threading.Lock() for i in range(stripes)]
+        self.shelf = shelf
+        return
+
+    def _lock_for(self, key):
+        return self.locks[hash(key) % len(self.locks)]
+
+    def _reading(self, keys=None):
+        if keys is None:
+            return _MultiLock(self.locks)
+        if len(keys) == 1:
+            return self._lock_for(keys[0])
+        # Always take the locks in the same order to avoid deadlocks.
+        indexes = sorted(set(hash(key) % len(self.locks) for key in keys))
+        return _MultiLock([self.locks[i] for i in indexes])
+
+    _writing = _reading
+
+
+class ReadWriteLock:
+    """Lock which can be held by any number of readers or by one
+    writer.  Waiting writers are given preference over new readers so
+    they are not starved by a steady stream of reads.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+        return
+
+    def acquire_read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        return
+
+    def release_read(self):
+        with self._condition:
+            self._readers -= 1
+            if not self._readers:
+                self._condition.notify_all()
+        return
+
+    def acquire_write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        return
+
+    def release_write(self):
+        with self._condition:
+            self._writer = False
+            self._condition.notify_all()
+        return
+
+    @contextlib.contextmanager
+    def reading(self):
+        "Context manager holding the lock for reading."
+        self.acquire_read()
+        try:
+            yield self
+        finally:
+            self.release_read()
+
+    @contextlib.contextmanager
+    def writing(self):
+        "Context manager holding the lock for writing."
+        self.acquire_write()
+        try:
+            yield self
+        finally:
+            self.release_write()
+
+
+class ReadWriteCacheStorageLock(CacheStorageLock):
+    """Lock wrapper which lets any number of threads read from the
+    storage at the same time, while writes get exclusive access.
+
+    Only use this with storage which is safe to read from several
+    threads at once.
+    """
+
+    def __init__(self, shelf):
+        self.lock = ReadWriteLock()
+        self.shelf = shelf
+        return
+
+    def _reading(self, keys=None):
+        return self.lock.reading()
+
+    def _writing(self, keys=None):
+        return self.lock.writing()
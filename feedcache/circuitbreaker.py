@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Stop sending requests to hosts which keep failing.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import logging
+import threading
+import time
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.circuitbreaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# The stats counter for each change of state.
+_TRANSITIONS = {
+    OPEN: 'opened',
+    HALF_OPEN: 'half_opened',
+    CLOSED: 'closed',
+    }
+
+
+class _HostCircuit:
+    "The state of the circuit for one host."
+
+    def __init__(self):
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        return
+
+    def __repr__(self):
+        return '<_HostCircuit %s failures=%d>' % (self.state, self.failures)
+
+
+class CircuitBreaker:
+    """Track consecutive failures for each host, and refuse requests
+    to a host once it has failed too often.
+
+    A host's circuit starts closed, and requests are allowed.  After
+    failureThreshold failures in a row it opens, and requests are
+    refused.  When resetTimeoutSeconds have passed, the circuit is
+    half-open: one probe request is allowed, and the others are still
+    refused.  If the probe succeeds the circuit closes again,
+    otherwise it opens for another resetTimeoutSeconds.
+
+    Callers must report the outcome of every allowed request with
+    record_success() or record_failure(), or call cancel() if the
+    request was not sent after all.
+    """
+
+    def __init__(self, failureThreshold=5, resetTimeoutSeconds=60):
+        """
+        Arguments:
+
+          failureThreshold=5 -- Failures in a row which open the
+          circuit for a host.
+
+          resetTimeoutSeconds=60 -- Time to wait after opening the
+          circuit before letting a probe request through.
+
+        """
+        self.failure_threshold = failureThreshold
+        self.reset_timeout = resetTimeoutSeconds
+        # Only hosts which have failed since their last success are
+        # kept.
+        self._hosts = {}
+        self._lock = threading.Lock()
+        self.stats = collections.Counter()
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the breaker.
+
+          allowed -- Requests allowed.
+
+          rejected -- Requests refused because the circuit was open.
+
+          probes -- Requests allowed through a half-open circuit.
+
+          opened, half_opened, closed -- Changes of state.
+
+          open, half_open -- Hosts currently in each state.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            states = collections.Counter(
+                circuit.state for circuit in self._hosts.values())
+        stats['open'] = states[OPEN]
+        stats['half_open'] = states[HALF_OPEN]
+        return stats
+
+    def get_state(self, host):
+        "Return the state of the circuit for host."
+        with self._lock:
+            circuit = self._hosts.get(host)
+            return CLOSED if circuit is None else circuit.state
+
+    def get_states(self):
+        "Return a dictionary mapping the hosts not closed to their state."
+        with self._lock:
+            return dict((host, circuit.state)
+                        for host, circuit in self._hosts.items()
+                        if circuit.state != CLOSED)
+
+    def _change(self, host, circuit, state):
+        "Move circuit to state, with the lock held."
+        logger.info('circuit for %s: %s -> %s', host, circuit.state, state)
+        circuit.state = state
+        self.stats[_TRANSITIONS[state]] += 1
+        return
+
+    def allow(self, host):
+        "Return True if a request may be sent to host now."
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None or circuit.state == CLOSED:
+                self.stats['allowed'] += 1
+                return True
+            if (circuit.state == OPEN
+                    and time.time() >= circuit.opened_at + self.reset_timeout):
+                self._change(host, circuit, HALF_OPEN)
+            if circuit.state == HALF_OPEN and not circuit.probing:
+                circuit.probing = True
+                self.stats['allowed'] += 1
+                self.stats['probes'] += 1
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def cancel(self, host):
+        "Record that a request allowed by allow() was not sent."
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is not None:
+                circuit.probing = False
+        return
+
+    def record_success(self, host):
+        "Record that a request to host worked, closing its circuit."
+        with self._lock:
+            circuit = self._hosts.pop(host, None)
+            if circuit is not None and circuit.state != CLOSED:
+                self._change(host, circuit, CLOSED)
+        return
+
+    def record_failure(self, host):
+        "Record that a request to host failed or timed out."
+        with self._lock:
+            circuit = self._hosts.get(host)
+            if circuit is None:
+                circuit = self._hosts[host] = _HostCircuit()
+            circuit.failures += 1
+            circuit.probing = False
+            if (circuit.state == HALF_OPEN
+                    or (circuit.state == CLOSED
+                        and circuit.failures >= self.failure_threshold)):
+                circuit.opened_at = time.time()
+                self._change(host, circuit, OPEN)
+        return
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Codecs for storing parsed feeds.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import json
+import lzma
+import marshal
+import pickle
+import threading
+import time
+import zlib
+
+import feedparser
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+
+_SCALARS = frozenset([str, int, float, bool, type(None)])
+
+
+def _plain(value):
+    """Return a copy of value made only of dictionaries, lists,
+    strings, numbers and None.  Time tuples become lists, any other
+    object (such as a bozo_exception) becomes its string, and values
+    repeated in *_detail dictionaries are replaced with None.
+    """
+    if type(value) in _SCALARS:
+        return value
+    if isinstance(value, dict):
+        plain = {}
+        for key, item in value.items():
+            if type(key) is not str:
+                key = str(key)
+            if type(item) not in _SCALARS:
+                item = _plain(item)
+                if (type(item) is dict and key.endswith('_detail')
+                        and item.get('value') is not None
+                        and item['value'] == dict.get(value, key[:-7])):
+                    # feedparser repeats title, summary, etc. in the
+                    # *_detail dictionaries; keep only one copy.
+                    item['value'] = None
+            plain[key] = item
+        return plain
+    if isinstance(value, (list, tuple)):
+        # struct_time is a tuple, so it is flattened here too.
+        return [item if type(item) in _SCALARS else _plain(item)
+                for item in value]
+    if isinstance(value, bytes):
+        return value.decode('latin-1')
+    return str(value)
+
+
+def _finish(plain, rebuild_children=False):
+    """Turn a dictionary made by _plain() back into a FeedParserDict.
+    The *_parsed lists become time tuples, and the values replaced in
+    *_detail dictionaries are restored.  If rebuild_children is true,
+    the dictionaries and lists inside plain are rebuilt first;
+    otherwise they must already have been.
+    """
+    for key, item in plain.items():
+        kind = type(item)
+        if kind is list:
+            if len(item) == 9 and key.endswith('_parsed'):
+                plain[key] = time.struct_time(item)
+            elif rebuild_children:
+                plain[key] = _rebuild_list(item)
+        elif kind is dict or kind is feedparser.FeedParserDict:
+            if rebuild_children and kind is dict:
+                item = plain[key] = _finish(item, True)
+            if (key.endswith('_detail')
+                    and dict.get(item, 'value', 0) is None
+                    and key[:-7] in plain):
+                dict.__setitem__(item, 'value', plain[key[:-7]])
+    return feedparser.FeedParserDict(plain)
+
+
+def _rebuild(plain):
+    "Rebuild a value made by _plain()."
+    if type(plain) is dict:
+        return _finish(plain, True)
+    if type(plain) is list:
+        return _rebuild_list(plain)
+    return plain
+
+
+def _rebuild_list(plain):
+    "Rebuild the dictionaries and lists inside a list made by _plain()."
+    return [_finish(item, True) if type(item) is dict
+            else _rebuild_list(item) if type(item) is list
+            else item
+            for item in plain]
+
+
+class PickleCodec:
+    """Store the parsed feed exactly as it is, using pickle.
+
+    This is the default codec of the storage backends.
+    """
+
+    def dumps(self, content):
+        "Return content as bytes."
+        return pickle.dumps(content, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        "Return the content stored in data (bytes or a buffer)."
+        return pickle.loads(data)
+
+
+class MarshalCodec:
+    """Store a plain copy of the parsed feed, using marshal.
+
+    Loading gives back FeedParserDicts, with the *_parsed values as
+    time tuples.  Values which are not plain data (such as
+    bozo_exception) are stored as strings.  marshal's format may
+    change between Python versions, so use JSONCodec for data which
+    outlives an upgrade.
+    """
+
+    def dumps(self, content):
+        return marshal.dumps(_plain(content))
+
+    def loads(self, data):
+        return _rebuild(marshal.loads(data))
+
+
+class JSONCodec:
+    """Store a plain copy of the parsed feed as UTF-8 JSON.
+
+    Loading works the same way as for MarshalCodec, but the data is
+    portable and readable by other tools.
+    """
+
+    def dumps(self, content):
+        return json.dumps(_plain(content), ensure_ascii=False,
+                          separators=(',', ':')).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(bytes(data).decode('utf-8'), object_hook=_finish)
+
+
+class CompressedCodec:
+    """Compress the data made by another codec.
+
+    Values whose encoded size is below threshold are stored as they
+    are, since compressing them saves little and costs time on every
+    read.  Each stored value starts with one byte saying how it was
+    stored, so changing the method or the threshold does not make
+    existing data unreadable.
+
+    Pass an instance as the codec of a storage backend to compress
+    the feeds it stores, for example::
+
+      SQLiteStorage('cache.db', codec=CompressedCodec(method='lzma'))
+    """
+
+    METHODS = {
+        b'z': ('zlib', zlib.compress, zlib.decompress),
+        b'x': ('lzma', lzma.compress, lzma.decompress),
+        }
+    RAW = b'-'
+
+    def __init__(self, codec=None, method='zlib', level=None,
+                 threshold=1024):
+        """
+        Arguments:
+
+          codec=None -- Codec whose output is compressed.  Defaults
+          to PickleCodec.
+
+          method='zlib' -- 'zlib' (fast) or 'lzma' (smaller, slower).
+
+          level=None -- Compression level, or None for the default of
+          the method (zlib level, or lzma preset).
+
+          threshold=1024 -- Encoded size in bytes below which values
+          are stored uncompressed.
+
+        """
+        self.codec = codec if codec is not None else PickleCodec()
+        for tag, (name, compress, decompress) in self.METHODS.items():
+            if name == method:
+                self.tag = tag
+                self._compress = compress
+                break
+        else:
+            raise ValueError('unknown compression method %r' % method)
+        self.method = method
+        self.level = level
+        self.threshold = threshold
+        self.stats = collections.Counter()
+        self._stats_lock = threading.Lock()
+        return
+
+    def _count(self, **amounts):
+        with self._stats_lock:
+            self.stats.update(amounts)
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the codec.
+
+          compressed, stored_raw -- Values written compressed, and
+          written as they were because they were below the
+          threshold.
+
+          bytes_in, bytes_out -- Encoded size of the values written,
+          and the size actually stored.
+
+          compression_ratio -- bytes_in / bytes_out.
+
+          compress_seconds, decompress_seconds -- Time spent
+          compressing and decompressing.
+
+          decompressed -- Values read which had to be decompressed.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        if stats.get('bytes_out'):
+            stats['compression_ratio'] = stats['bytes_in'] / stats['bytes_out']
+        return stats
+
+    def dumps(self, content):
+        data = self.codec.dumps(content)
+        if len(data) < self.threshold:
+            self._count(stored_raw=1, bytes_in=len(data),
+                        bytes_out=len(data) + 1)
+            return self.RAW + data
+        start = time.perf_counter()
+        if self.level is None:
+            compressed = self._compress(data)
+        elif self.tag == b'x':
+            compressed = self._compress(data, preset=self.level)
+        else:
+            compressed = self._compress(data, self.level)
+        elapsed = time.perf_counter() - start
+        self._count(compressed=1, bytes_in=len(data),
+                    bytes_out=len(compressed) + 1, compress_seconds=elapsed)
+        return self.tag + compressed
+
+    def loads(self, data):
+        data = memoryview(data)
+        tag = bytes(data[:1])
+        if tag == self.RAW:
+            return self.codec.loads(data[1:])
+        try:
+            decompress = self.METHODS[tag][2]
+        except KeyError:
+            raise ValueError('unknown compression tag %r' % tag)
+        start = time.perf_counter()
+        decompressed = decompress(data[1:])
+        self._count(decompressed=1,
+                    decompress_seconds=time.perf_counter() - start)
+        return self.codec.loads(decompressed)
@@ -110,7 +110,13 @@ def main(urls=[]):
 def fetch_urls(storage, input_queue, output_queue):
     """Thread target for fetching feed data.
     """
-    c = cache.Cache(storage)
+    # Time out stalled servers so one of them cannot hold up the
+    # whole queue.
+    c = cache.Cache(storage,
+                    connectTimeoutSeconds=10,
+                    readTimeoutSeconds=30,
+                    fetchDeadlineSeconds=60,
+                    )
 
     while True:
         next_url = input_queue.get()
@@ -118,9 +124,13 @@ def fetch_urls(storage, input_queue, output_queue):
             input_queue.task_done()
             break
 
-        feed_data = c.fetch(next_url)
-        for entry in feed_data.entries:
-            output_queue.put( (feed_data.feed, entry) )
+        try:
+            feed_data = c.fetch(next_url)
+        except Exception as err:
+            print('Could not fetch %s: %s' % (next_url, err))
+        else:
+            for entry in feed_data.entries:
+                output_queue.put( (feed_data.feed, entry) )
         input_queue.task_done()
     return
 
@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Shelf storage which can be shared by several processes.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections.abc
+import contextlib
+import dbm
+import errno
+import fcntl
+import logging
+import os
+import shelve
+import socket
+import time
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.filelockstorage')
+
+
+class LockTimeout(Exception):
+    """Raised when the lock for a FileLockedShelf cannot be acquired
+    in time.
+    """
+
+
+class FileLockedShelf(collections.abc.MutableMapping):
+    """Shelf which coordinates access from several processes with
+    fcntl advisory locks on a separate lock file.
+
+    Reads hold a shared lock and writes an exclusive one.  The shelf
+    is opened for each operation and closed before the lock is
+    released, so every process sees the data the others have
+    written.  Use get_many(), set_many() and delete_many() to handle
+    several keys with one open and one lock.
+
+    The kernel releases fcntl locks when a process exits, so a crashed
+    process does not leave the shelf locked.  The process holding the
+    exclusive lock records its host and process id in the lock file.
+    If the lock cannot be acquired within lockTimeout seconds and that
+    process is known to be gone (for example, a lock left on a network
+    file system), the lock file is replaced and the attempt repeated.
+    Otherwise LockTimeout is raised.
+    """
+
+    def __init__(self, filename, lockTimeout=30, pollInterval=0.01):
+        """
+        Arguments:
+
+          filename -- Name of the shelf.  The lock file uses the same
+          name with '.lock' added, and breaking a stale lock uses one
+          with '.lock.break' added.
+
+          lockTimeout=30 -- Seconds to wait for the lock.
+
+          pollInterval=0.01 -- Seconds between attempts to acquire
+          the lock.
+
+        """
+        self.filename = filename
+        self.lock_filename = filename + '.lock'
+        self.lock_timeout = lockTimeout
+        self.poll_interval = pollInterval
+        return
+
+    def _acquire(self, operation):
+        """Open the lock file and lock it with operation (LOCK_SH or
+        LOCK_EX), returning the open file descriptor.
+        """
+        deadline = time.time() + self.lock_timeout
+        while True:
+            fd = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                while True:
+                    try:
+                        fcntl.flock(fd, operation | fcntl.LOCK_NB)
+                    except OSError as err:
+                        if err.errno not in (errno.EAGAIN, errno.EACCES):
+                            raise
+                    else:
+                        if self._is_current(fd):
+                            return fd
+                        # The lock file was replaced while we waited.
+                        break
+                    if time.time() >= deadline:
+                        break
+                    time.sleep(self.poll_interval)
+            except BaseException:
+                os.close(fd)
+                raise
+            os.close(fd)
+            if time.time() >= deadline:
+                if not self._break_stale_lock():
+                    raise LockTimeout('Could not lock %s within %s seconds'
+                                      % (self.filename, self.lock_timeout))
+                deadline = time.time() + self.lock_timeout
+
+    def _is_current(self, fd):
+        "Return True if fd still refers to the lock file on disk."
+        try:
+            return os.fstat(fd).st_ino == os.stat(self.lock_filename).st_ino
+        except FileNotFoundError:
+            return False
+
+    def _read_owner(self, fd):
+        "Return the (host, pid) recorded in the lock file fd, or None."
+        try:
+            host, pid = os.pread(fd, 256, 0).decode('ascii').split()
+            return host, int(pid)
+        except (OSError, ValueError):
+            return None
+
+    def _owner_is_gone(self, owner):
+        """Return True if owner, a (host, pid) pair, is a process on
+        this host which no longer exists.
+        """
+        host, pid = owner
+        if host != socket.gethostname():
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            # The process exists, but belongs to someone else.
+            return False
+        return False
+
+    def _break_stale_lock(self):
+        """Remove the lock file if the process recorded as holding it
+        no longer exists.  Returns True if the lock was broken.
+
+        Processes breaking the lock take turns through a second lock
+        file, and the lock file is only removed if it is still the one
+        whose owner was read.  Otherwise a process which read the same
+        stale owner could remove the lock file created by the process
+        which broke the lock first, letting two processes hold it.
+        """
+        break_fd = os.open(self.lock_filename + '.break',
+                           os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            deadline = time.time() + self.lock_timeout
+            while True:
+                try:
+                    fcntl.flock(break_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except OSError as err:
+                    if err.errno not in (errno.EAGAIN, errno.EACCES):
+                        raise
+                if time.time() >= deadline:
+                    return False
+                time.sleep(self.poll_interval)
+            try:
+                fd = os.open(self.lock_filename, os.O_RDONLY)
+            except FileNotFoundError:
+                # Already removed, so try to lock the new one.
+                return True
+            try:
+                owner = self._read_owner(fd)
+                if owner is None or not self._owner_is_gone(owner):
+                    return False
+                if not self._is_current(fd):
+                    return True
+                logger.warning('Breaking stale lock on %s held by process %d',
+                               self.filename, owner[1])
+                os.unlink(self.lock_filename)
+            finally:
+                os.close(fd)
+        finally:
+            # Closing the file releases the lock on it.
+            os.close(break_fd)
+        return True
+
+    @contextlib.contextmanager
+    def _open(self, write):
+        """Context manager which locks the shelf and opens it for
+        reading or writing.  Produces None when reading a shelf which
+        has not been created yet.
+        """
+        fd = self._acquire(fcntl.LOCK_EX if write else fcntl.LOCK_SH)
+        try:
+            if write:
+                os.ftruncate(fd, 0)
+                os.pwrite(fd, ('%s %d' % (socket.gethostname(), os.getpid())
+                               ).encode('ascii'), 0)
+                shelf = shelve.open(self.filename, 'c')
+            else:
+                try:
+                    shelf = shelve.open(self.filename, 'r')
+                except dbm.error:
+                    shelf = None
+            try:
+                yield shelf
+            finally:
+                if shelf is not None:
+                    shelf.close()
+                if write:
+                    os.ftruncate(fd, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def __getitem__(self, key):
+        with self._open(False) as shelf:
+            if shelf is None:
+                raise KeyError(key)
+            return shelf[key]
+
+    def get(self, key, default=None):
+        with self._open(False) as shelf:
+            if shelf is None:
+                return default
+            return shelf.get(key, default)
+
+    def __setitem__(self, key, value):
+        with self._open(True) as shelf:
+            shelf[key] = value
+
+    def __delitem__(self, key):
+        with self._open(True) as shelf:
+            del shelf[key]
+
+    def touch(self, key, cached_time):
+        """Change the time key was stored.  A shelf cannot change part
+        of a value, so the feed is stored again, but under the same
+        lock as the read.
+        """
+        with self._open(True) as shelf:
+            content = shelf[key][1]
+            shelf[key] = (cached_time, content)
+        return
+
+    def __contains__(self, key):
+        with self._open(False) as shelf:
+            return shelf is not None and key in shelf
+
+    def __len__(self):
+        with self._open(False) as shelf:
+            return len(shelf) if shelf is not None else 0
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        "Return a list of the keys in the shelf."
+        with self._open(False) as shelf:
+            return list(shelf.keys()) if shelf is not None else []
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the shelf.
+        """
+        values = {}
+        with self._open(False) as shelf:
+            if shelf is not None:
+                for key in keys:
+                    try:
+                        values[key] = shelf[key]
+                    except KeyError:
+                        pass
+        return values
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        with self._open(True) as shelf:
+            for key, value in items:
+                shelf[key] = value
+        return
+
+    def delete_many(self, keys):
+        "Remove keys from the shelf, ignoring any which are not there."
+        with self._open(True) as shelf:
+            for key in keys:
+                try:
+                    del shelf[key]
+                except KeyError:
+                    pass
+        return
+
+    def close(self):
+        "Nothing is held open between operations, so there is nothing to do."
+        return
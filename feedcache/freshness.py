@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Compute how long a response may be cached from its HTTP headers.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import email.utils
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+def parse_cache_control(value):
+    """Return a dictionary mapping the directive names in a
+    Cache-Control header value to their arguments (None for
+    directives without one).
+    """
+    directives = {}
+    for part in value.split(','):
+        name, sep, argument = part.partition('=')
+        name = name.strip().lower()
+        if not name:
+            continue
+        directives[name] = argument.strip().strip('"') if sep else None
+    return directives
+
+
+def parse_http_date(value):
+    "Return the HTTP date string value as a timestamp, or None."
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def freshness_lifetime(headers, now):
+    """Return the number of seconds a response with the given headers
+    (lower-case names) may be cached, or None if the headers do not
+    say.
+
+    The s-maxage and max-age Cache-Control directives are preferred
+    over the Expires header.  no-store and no-cache give a lifetime
+    of 0, as does an Expires value which cannot be parsed.
+    """
+    directives = parse_cache_control(headers.get('cache-control', ''))
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    for name in ('s-maxage', 'max-age'):
+        try:
+            return max(0, int(directives[name]))
+        except (KeyError, TypeError, ValueError):
+            pass
+    if 'expires' in headers:
+        expires = parse_http_date(headers['expires'])
+        if expires is None:
+            return 0
+        # Measure against the server's clock when we can, to avoid
+        # problems with clock skew.
+        date = parse_http_date(headers.get('date', '')) or now
+        return max(0, expires - date)
+    return None
+
+
+def stored_lifetime(content, cached_time):
+    """Return the lifetime given by the headers saved with the parsed
+    feed content, stored at cached_time, or None.  The storages keep
+    it in their metadata records with the etag and modified values.
+    """
+    get = getattr(content, 'get', None)
+    if get is None:
+        return None
+    return freshness_lifetime(get('headers') or {}, cached_time)
+
+
+def retry_after(headers, now):
+    """Return the time given by the Retry-After header in headers, or
+    None if there is no usable value.
+    """
+    value = headers.get('retry-after', '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return now + int(value)
+    return parse_http_date(value)
@@ -0,0 +1,678 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Append-only log-structured cache storage.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import collections.abc
+import logging
+import mmap
+import os
+import pickle
+import struct
+import threading
+import uuid
+import zlib
+
+#
+# Import local modules
+#
+from .codec import PickleCodec
+from . import freshness
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.logstorage')
+
+SEGMENT_MAGIC = b'FCLOG001'
+SEGMENT_HEADER = struct.Struct('>8s16s')
+# crc32, flags, cached_time, key length, metadata length, body length
+RECORD_HEADER = struct.Struct('>IBdIII')
+PUT = 0
+DELETE = 1
+# Changes the cached time of the latest PUT for the key.
+TOUCH = 2
+
+# Where a live record is: the segment id, the offset and length of
+# the encoded feed, the time it was stored, the etag, modified and
+# lifetime values, and the size of the whole record.
+_Location = collections.namedtuple(
+    '_Location',
+    'segment offset length cached_time etag modified lifetime size')
+
+# Number of values in an index entry, as saved in the hint files.
+ENTRY_FIELDS = 9
+
+
+def _segment_name(segment_id):
+    return '%08d-%04d' % segment_id
+
+
+def _encode_record(flags, key, cached_time, meta, body):
+    "Return the bytes of one log record."
+    key_bytes = key.encode('utf-8')
+    record = RECORD_HEADER.pack(0, flags, cached_time, len(key_bytes),
+                                len(meta), len(body)) + key_bytes + meta + body
+    crc = zlib.crc32(memoryview(record)[4:])
+    return struct.pack('>I', crc) + record[4:]
+
+
+def _decode_meta(data):
+    "Return the (etag, modified, lifetime) values saved in a record."
+    meta = pickle.loads(data)
+    # Records written by older versions have no lifetime.
+    return tuple(meta) + (None,) * (3 - len(meta))
+
+
+class _Segment:
+    "One log file."
+
+    def __init__(self, segment_id, path, token, size):
+        self.id = segment_id
+        self.path = path
+        self.token = token
+        self.size = size
+        self.live = 0
+        self._map = None
+        return
+
+    def map(self, end):
+        """Return a read-only memory map of the file which covers at
+        least the first end bytes.
+        """
+        mapped = self._map
+        if mapped is None or len(mapped) < end:
+            with open(self.path, 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # An older map is closed when the last reader lets go of it.
+            self._map = mapped
+        return mapped
+
+
+class LogStorage(collections.abc.MutableMapping):
+    """Cache storage which appends every write to a log.
+
+    Records are appended to segment files in a directory, so
+    rewriting an entry never rewrites data in place, and touch()
+    (used by the Cache after a 304 response) only appends a small
+    record with the new time.  An index in memory maps each key to
+    the place its latest record was written, along with the cached
+    time, etag, modified and lifetime values, so get_metadata() does
+    no I/O.
+    Feeds are read through memory maps of the segment files and
+    decoded without copying the data first.
+
+    When a segment grows past segmentBytes it is sealed, and a hint
+    file with its index entries is written next to it.  Opening the
+    storage loads the hint files instead of reading the segments, so
+    the index is rebuilt quickly.  The last segment is checked record
+    by record, and anything after a torn write is cut off.
+
+    Old records and deleted keys leave dead space in the sealed
+    segments.  Once the dead share of the sealed data passes
+    compactRatio, the live records are copied to new segments and the
+    old ones are removed, in a background thread unless
+    backgroundCompaction is false.  compact() does the same on demand.
+
+    The storage is safe to share between threads, but only one
+    process should open a directory at a time.
+    """
+
+    def __init__(self, dirname, segmentBytes=64 * 1024 * 1024,
+                 compactRatio=0.5, backgroundCompaction=True, codec=None):
+        """
+        Arguments:
+
+          dirname -- Directory for the segment files.  It is created
+          if it does not exist.
+
+          segmentBytes=64MB -- Size at which a segment is sealed and a
+          new one started.
+
+          compactRatio=0.5 -- Share of dead data in the sealed
+          segments which triggers compaction.
+
+          backgroundCompaction=True -- Compact in a background thread
+          when the ratio is passed.  If false, compaction only happens
+          when compact() is called.
+
+          codec=None -- Object with dumps() and loads() methods which
+          turn the parsed feeds into bytes and back (see
+          feedcache.codec).  Defaults to PickleCodec.
+
+        """
+        self.dirname = dirname
+        self.segment_bytes = segmentBytes
+        self.compact_ratio = compactRatio
+        self.codec = codec if codec is not None else PickleCodec()
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._index = {}
+        self._segments = {}
+        self._active = None
+        self._active_entries = []
+        self._fd = None
+        self._closed = False
+        os.makedirs(dirname, exist_ok=True)
+        self._open()
+        self._compact_wanted = threading.Event()
+        self._compactor = None
+        if backgroundCompaction:
+            self._compactor = threading.Thread(target=self._compact_loop,
+                                               name='feedcache-compactor')
+            self._compactor.daemon = True
+            self._compactor.start()
+        return
+
+    #
+    # Opening and rebuilding the index
+    #
+
+    def _path(self, segment_id, extension):
+        return os.path.join(self.dirname,
+                            _segment_name(segment_id) + extension)
+
+    def _open(self):
+        "Load the existing segments and open the last one for writing."
+        segment_ids = []
+        for name in os.listdir(self.dirname):
+            base, extension = os.path.splitext(name)
+            if extension == '.tmp':
+                # Left behind by an interrupted compaction.
+                os.unlink(os.path.join(self.dirname, name))
+                continue
+            if extension != '.log':
+                continue
+            major, _, minor = base.partition('-')
+            if major.isdigit() and minor.isdigit():
+                segment_ids.append((int(major), int(minor)))
+        segment_ids.sort()
+        for segment_id in segment_ids:
+            self._load_segment(segment_id, segment_id == segment_ids[-1])
+        if segment_ids and segment_ids[-1] in self._segments:
+            self._activate(self._segments[segment_ids[-1]])
+        else:
+            major = segment_ids[-1][0] if segment_ids else 0
+            self._start_segment((major + 1, 0))
+        return
+
+    def _load_segment(self, segment_id, last):
+        "Add the records of one segment file to the index."
+        path = self._path(segment_id, '.log')
+        with open(path, 'rb') as f:
+            magic, token = SEGMENT_HEADER.unpack(
+                f.read(SEGMENT_HEADER.size).ljust(SEGMENT_HEADER.size, b'\0'))
+            size = os.fstat(f.fileno()).st_size
+        if magic != SEGMENT_MAGIC:
+            logger.warning('ignoring %s, it is not a segment file', path)
+            return
+        segment = _Segment(segment_id, path, token, size)
+        self._segments[segment_id] = segment
+        entries = self._read_hint(segment)
+        if entries is None:
+            logger.debug('scanning %s', path)
+            entries, end = self._scan(segment, verify=last)
+            if end < size:
+                logger.warning('truncating %s after a torn write at %d',
+                               path, end)
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+                segment.size = end
+                segment._map = None
+        for entry in entries:
+            self._apply(segment, entry)
+        if last:
+            self._active_entries = list(entries)
+        return
+
+    def _read_hint(self, segment):
+        """Return the index entries saved for segment, or None if there
+        is no hint file or it does not match the segment.
+        """
+        try:
+            with open(self._path(segment.id, '.hint'), 'rb') as f:
+                token, size, entries = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logger.warning('ignoring hint for %s: %s', segment.path, err)
+            return None
+        if token != segment.token or size != segment.size:
+            return None
+        if any(len(entry) != ENTRY_FIELDS for entry in entries):
+            # Written by an older version, so scan the segment.
+            return None
+        return entries
+
+    def _write_hint(self, segment, entries):
+        "Save the index entries for segment next to it."
+        path = self._path(segment.id, '.hint')
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((segment.token, segment.size, entries), f,
+                        pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        return
+
+    def _scan(self, segment, verify):
+        """Return the index entries of the records in segment and the
+        offset where the last complete record ends.  If verify is true,
+        stop at the first record whose checksum does not match.
+        """
+        entries = []
+        pos = SEGMENT_HEADER.size
+        if segment.size <= pos:
+            return entries, pos
+        mapped = segment.map(segment.size)
+        end_of_file = len(mapped)
+        while pos + RECORD_HEADER.size <= end_of_file:
+            crc, flags, cached_time, key_len, meta_len, body_len = \
+                RECORD_HEADER.unpack_from(mapped, pos)
+            start = pos + RECORD_HEADER.size
+            end = start + key_len + meta_len + body_len
+            if end > end_of_file:
+                break
+            if verify and zlib.crc32(mapped[pos + 4:end]) != crc:
+                break
+            key = mapped[start:start + key_len].decode('utf-8')
+            if flags == DELETE or flags == TOUCH:
+                entries.append((key, flags, cached_time, None, None, None,
+                                0, 0, end - pos))
+            else:
+                meta_start = start + key_len
+                etag, modified, lifetime = _decode_meta(
+                    mapped[meta_start:meta_start + meta_len])
+                entries.append((key, PUT, cached_time, etag, modified,
+                                lifetime, meta_start + meta_len, body_len,
+                                end - pos))
+            pos = end
+        return entries, pos
+
+    def _apply(self, segment, entry):
+        "Update the index for one record of segment."
+        (key, flags, cached_time, etag, modified, lifetime, offset, length,
+         size) = entry
+        if flags == TOUCH:
+            # The touch record is not counted as live: once the record
+            # it refers to is compacted, the new copy has the new time.
+            old = self._index.get(key)
+            if old is not None:
+                self._index[key] = old._replace(cached_time=cached_time)
+            return
+        old = self._index.pop(key, None)
+        if old is not None:
+            self._segments[old.segment].live -= old.size
+        if flags == PUT:
+            self._index[key] = _Location(segment.id, offset, length,
+                                         cached_time, etag, modified,
+                                         lifetime, size)
+            segment.live += size
+        return
+
+    #
+    # Writing
+    #
+
+    def _start_segment(self, segment_id):
+        "Create a new, empty segment and make it the active one."
+        path = self._path(segment_id, '.log')
+        token = uuid.uuid4().bytes
+        with open(path, 'xb') as f:
+            f.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, token))
+        segment = _Segment(segment_id, path, token, SEGMENT_HEADER.size)
+        self._segments[segment_id] = segment
+        self._active_entries = []
+        self._activate(segment)
+        return
+
+    def _activate(self, segment):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(segment.path, os.O_WRONLY | os.O_APPEND)
+        self._active = segment
+        return
+
+    def _seal(self):
+        "Write the hint for the active segment and start a new one."
+        self._write_hint(self._active, self._active_entries)
+        self._start_segment((self._active.id[0] + 1, 0))
+        return
+
+    def _append(self, flags, key, cached_time, meta, body):
+        "Write one record to the active segment.  Call with the lock held."
+        if self._closed:
+            raise ValueError('storage is closed')
+        record = _encode_record(flags, key, cached_time, meta, body)
+        view = memoryview(record)
+        while view:
+            view = view[os.write(self._fd, view):]
+        segment = self._active
+        offset = segment.size + len(record) - len(body)
+        segment.size += len(record)
+        if flags == DELETE or flags == TOUCH:
+            entry = (key, flags, cached_time, None, None, None, 0, 0,
+                     len(record))
+        else:
+            etag, modified, lifetime = _decode_meta(meta)
+            entry = (key, PUT, cached_time, etag, modified, lifetime,
+                     offset, len(body), len(record))
+        self._apply(segment, entry)
+        self._active_entries.append(entry)
+        if segment.size >= self.segment_bytes:
+            self._seal()
+        return
+
+    def _encode_value(self, value):
+        "Return the metadata and body bytes for a cache value."
+        cached_time, content = value
+        get = getattr(content, 'get', None)
+        meta = (get('etag') if get else None,
+                get('modified') if get else None,
+                freshness.stored_lifetime(content, cached_time))
+        return (pickle.dumps(meta, pickle.HIGHEST_PROTOCOL),
+                self.codec.dumps(content))
+
+    def _write(self, items):
+        # Pickle outside of the lock.
+        records = [(key, value[0]) + self._encode_value(value)
+                   for key, value in items]
+        with self._lock:
+            for key, cached_time, meta, body in records:
+                self._append(PUT, key, cached_time, meta, body)
+        self._check_garbage()
+        return
+
+    #
+    # Reading
+    #
+
+    def _find(self, key):
+        """Return the location of key and a map of its segment, or
+        (None, None) if key is not stored.  Call with the lock held,
+        so compaction cannot replace the segment between the two.
+        """
+        location = self._index.get(key)
+        if location is None:
+            return None, None
+        segment = self._segments[location.segment]
+        return location, segment.map(location.offset + location.length)
+
+    def _load(self, location, mapped):
+        "Decode the feed stored at location in mapped."
+        view = memoryview(mapped)
+        try:
+            body = view[location.offset:location.offset + location.length]
+            try:
+                return self.codec.loads(body)
+            finally:
+                body.release()
+        finally:
+            view.release()
+
+    def get_metadata(self, key):
+        "Return the metadata record for key, or None."
+        with self._lock:
+            location = self._index.get(key)
+        if location is None:
+            return None
+        return {'cached_time': location.cached_time,
+                'etag': location.etag,
+                'modified': location.modified,
+                'lifetime': location.lifetime,
+                'size': location.length,
+                }
+
+    def get_body(self, key):
+        "Return the parsed feed stored for key."
+        with self._lock:
+            location, mapped = self._find(key)
+        if location is None:
+            raise KeyError(key)
+        return self._load(location, mapped)
+
+    #
+    # Mapping API
+    #
+
+    def __getitem__(self, key):
+        with self._lock:
+            location, mapped = self._find(key)
+        if location is None:
+            raise KeyError(key)
+        return (location.cached_time, self._load(location, mapped))
+
+    def __setitem__(self, key, value):
+        self._write([(key, value)])
+        return
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._index:
+                raise KeyError(key)
+            self._append(DELETE, key, 0, b'', b'')
+        self._check_garbage()
+        return
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._index
+
+    def __len__(self):
+        with self._lock:
+            return len(self._index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        "Return a list of the keys in the storage."
+        with self._lock:
+            return list(self._index)
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the storage.
+        """
+        with self._lock:
+            found = [(key,) + self._find(key) for key in keys]
+        return dict((key, (location.cached_time,
+                           self._load(location, mapped)))
+                    for key, location, mapped in found
+                    if location is not None)
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        self._write(items)
+        return
+
+    def touch(self, key, cached_time):
+        """Change the time key was stored by appending a small record,
+        without writing the feed again.
+        """
+        with self._lock:
+            if key not in self._index:
+                raise KeyError(key)
+            self._append(TOUCH, key, cached_time, b'', b'')
+        self._check_garbage()
+        return
+
+    def delete_many(self, keys):
+        "Remove keys from the storage, ignoring any which are not there."
+        with self._lock:
+            for key in keys:
+                if key in self._index:
+                    self._append(DELETE, key, 0, b'', b'')
+        self._check_garbage()
+        return
+
+    #
+    # Compaction
+    #
+
+    def garbage_ratio(self):
+        "Return the share of the sealed segments taken by dead records."
+        with self._lock:
+            total = live = 0
+            for segment in self._segments.values():
+                if segment is not self._active:
+                    total += segment.size - SEGMENT_HEADER.size
+                    live += segment.live
+        if not total:
+            return 0.0
+        return (total - live) / total
+
+    def _check_garbage(self):
+        if (self._compactor is not None
+                and self.garbage_ratio() >= self.compact_ratio):
+            self._compact_wanted.set()
+        return
+
+    def _compact_loop(self):
+        while True:
+            self._compact_wanted.wait()
+            self._compact_wanted.clear()
+            if self._closed:
+                return
+            try:
+                self.compact()
+            except Exception:
+                logger.exception('compacting %s failed', self.dirname)
+
+    def compact(self):
+        """Copy the live records of the sealed segments to new segments
+        and remove the old ones.  Returns the number of bytes freed.
+        """
+        with self._compact_lock:
+            with self._lock:
+                inputs = sorted(segment_id for segment_id in self._segments
+                                if segment_id != self._active.id)
+                if not inputs:
+                    return 0
+                input_set = set(inputs)
+                live = sorted(((key, location)
+                               for key, location in self._index.items()
+                               if location.segment in input_set),
+                              key=lambda item: (item[1].segment,
+                                                item[1].offset))
+                freed = sum(self._segments[segment_id].size
+                            for segment_id in inputs)
+            # The new segments sort after the ones they replace and
+            # before the active segment, so the records in the active
+            # segment still win when the index is rebuilt.
+            major, minor = inputs[-1]
+            outputs = []
+            moved = []
+            output = None
+            for key, location in live:
+                if output is None or output.size >= self.segment_bytes:
+                    output = self._compact_output((major, minor + 1
+                                                   + len(outputs)))
+                    outputs.append(output)
+                with self._lock:
+                    mapped = self._segments[location.segment].map(
+                        location.offset + location.length)
+                body = mapped[location.offset:location.offset + location.length]
+                meta = pickle.dumps((location.etag, location.modified,
+                                     location.lifetime),
+                                    pickle.HIGHEST_PROTOCOL)
+                record = _encode_record(PUT, key, location.cached_time,
+                                        meta, body)
+                output.file.write(record)
+                entry = (key, PUT, location.cached_time, location.etag,
+                         location.modified, location.lifetime,
+                         output.size + len(record) - len(body),
+                         len(body), len(record))
+                output.size += len(record)
+                output.entries.append(entry)
+                moved.append((key, location, output, entry))
+            for output in outputs:
+                output.file.close()
+                self._write_hint(output, output.entries)
+                os.replace(output.path + '.tmp', output.path)
+                freed -= output.size
+            with self._lock:
+                for output in outputs:
+                    self._segments[output.id] = output
+                for key, location, output, entry in moved:
+                    # Skip keys written or deleted since the copy began.
+                    current = self._index.get(key)
+                    if (current is not None
+                            and current.segment == location.segment
+                            and current.offset == location.offset):
+                        self._apply(output, entry)
+                        if current.cached_time != location.cached_time:
+                            # Touched since the copy began.
+                            self._apply(output, (key, TOUCH,
+                                                 current.cached_time,
+                                                 None, None, None, 0, 0,
+                                                 0))
+                for segment_id in inputs:
+                    segment = self._segments.pop(segment_id)
+                    # Open maps keep the data readable for anyone still
+                    # loading from the old file.
+                    os.unlink(segment.path)
+                    try:
+                        os.unlink(self._path(segment_id, '.hint'))
+                    except FileNotFoundError:
+                        pass
+            logger.debug('compacted %d segments into %d, freed %d bytes',
+                         len(inputs), len(outputs), freed)
+            return freed
+
+    def _compact_output(self, segment_id):
+        "Start a segment file for compaction to write to."
+        path = self._path(segment_id, '.log')
+        token = uuid.uuid4().bytes
+        output = _Segment(segment_id, path, token, SEGMENT_HEADER.size)
+        output.file = open(path + '.tmp', 'wb')
+        output.file.write(SEGMENT_HEADER.pack(SEGMENT_MAGIC, token))
+        output.entries = []
+        return output
+
+    def close(self):
+        """Stop the compaction thread and write the hint for the active
+        segment, so the next open does not have to scan it.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._compactor is not None:
+            self._compact_wanted.set()
+            self._compactor.join()
+        with self._lock:
+            self._write_hint(self._active, self._active_entries)
+            os.close(self._fd)
+            self._fd = None
+        return
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Bounded in-memory cache of parsed feeds.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import sys
+import threading
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+def approximate_size(obj, _depth=0):
+    """Return a rough estimate of the memory used by obj and the
+    containers, strings and numbers it holds, in bytes.
+    """
+    size = sys.getsizeof(obj)
+    if _depth > 20:
+        return size
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key, _depth + 1)
+            size += approximate_size(value, _depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approximate_size(item, _depth + 1)
+    return size
+
+
+class LRUCache:
+    """Thread-safe mapping of keys to values which discards the least
+    recently used values to stay within a number of entries and an
+    approximate number of bytes.
+    """
+
+    def __init__(self, maxEntries=1000, maxBytes=None, sizeof=approximate_size):
+        """
+        Arguments:
+
+          maxEntries=1000 -- The largest number of values to keep, or
+          None for no limit.
+
+          maxBytes=None -- The largest total size of the values, as
+          estimated by sizeof, or None for no limit.
+
+          sizeof=approximate_size -- Function returning the size of a
+          value.
+
+        """
+        self.max_entries = maxEntries
+        self.max_bytes = maxBytes
+        self.sizeof = sizeof
+        self.size = 0
+        # Maps keys to (value, size), least recently used first.
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        return
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        "Return the value for key and mark it as recently used."
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        "Add or replace the value for key, discarding old values as needed."
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if self.max_bytes is not None and size > self.max_bytes:
+                # Would push everything else out, so do not keep it.
+                return
+            self._data[key] = (value, size)
+            self.size += size
+            while ((self.max_entries is not None
+                    and len(self._data) > self.max_entries)
+                   or (self.max_bytes is not None
+                       and self.size > self.max_bytes)):
+                discarded_key, (discarded, discarded_size) = \
+                    self._data.popitem(last=False)
+                self.size -= discarded_size
+        return
+
+    def discard(self, key):
+        "Remove the value for key, if there is one."
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+        return
+
+    def discard_matching(self, predicate):
+        "Remove the values for which predicate(key, value) is true."
+        with self._lock:
+            for key, (value, size) in list(self._data.items()):
+                if predicate(key, value):
+                    del self._data[key]
+                    self.size -= size
+        return
+
+    def clear(self):
+        "Remove all values."
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+        return
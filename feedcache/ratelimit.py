@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Rate limits for the requests sent to feed servers.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import threading
+import time
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+
+class RateLimited(Exception):
+    """Raised instead of waiting when there is no room for a request to
+    host.  delay is the number of seconds until there will be, or None
+    if the request has to wait for a connection to the host to close.
+    """
+
+    def __init__(self, host, delay):
+        Exception.__init__(self, host, delay)
+        self.host = host
+        self.delay = delay
+        return
+
+    def __str__(self):
+        if self.delay is None:
+            return 'too many connections to %s' % self.host
+        return 'rate limit for %s, retry in %.3fs' % (self.host, self.delay)
+
+
+class TokenBucket:
+    """Allow rate events per second on average, and bursts of up to
+    burst events at once.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        return
+
+    def delay(self, now):
+        """Return the seconds until a token is available at now, or 0
+        if there is one already.
+        """
+        if now > self.updated:
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        "Use a token.  Call delay() first to make sure there is one."
+        self.tokens -= 1
+        return
+
+
+class RateLimiter:
+    """Token bucket rate limits for each host and for all hosts
+    together, and a cap on the requests in progress to each host.
+
+    A request may start when both the host's bucket and the global
+    bucket have a token and the host has a free connection.
+    try_acquire() takes the tokens and the connection if they are all
+    available, and otherwise says how long to wait without waiting, so
+    callers with a queue of work can go on to other requests.
+    acquire() waits.  Either way, release() must be called when the
+    request is finished.
+    """
+
+    def __init__(self, perHostRate=None, perHostBurst=1, globalRate=None,
+                 globalBurst=1, maxConnectionsPerHost=None):
+        """
+        Arguments:
+
+          perHostRate=None -- Requests per second allowed to each
+          host, or None for no limit.
+
+          perHostBurst=1 -- Requests which may be sent to a host at
+          once after it has been idle.
+
+          globalRate=None -- Requests per second allowed to all hosts
+          together, or None for no limit.
+
+          globalBurst=1 -- Burst size for the global limit.
+
+          maxConnectionsPerHost=None -- Most requests in progress to
+          one host at a time, or None for no limit.
+
+        """
+        self.per_host_rate = perHostRate
+        self.per_host_burst = perHostBurst
+        self.max_connections_per_host = maxConnectionsPerHost
+        self._global = None
+        if globalRate:
+            self._global = TokenBucket(globalRate, globalBurst)
+        self._hosts = {}
+        self._connections = collections.Counter()
+        self._lock = threading.Lock()
+        self._released = threading.Condition(self._lock)
+        self.stats = collections.Counter()
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the limiter.
+
+          granted -- Requests allowed to start.
+
+          throttled -- Attempts turned away by a rate limit.
+
+          connection_limited -- Attempts turned away because the host
+          had too many requests in progress.
+
+          wait_seconds -- Time spent waiting in acquire().
+
+          connections -- Requests in progress.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['connections'] = sum(self._connections.values())
+        return stats
+
+    def _bucket(self, host):
+        bucket = self._hosts.get(host)
+        if bucket is None:
+            bucket = self._hosts[host] = TokenBucket(self.per_host_rate,
+                                                     self.per_host_burst)
+        return bucket
+
+    def _try_acquire(self, host):
+        "try_acquire() with the lock held."
+        if (self.max_connections_per_host
+                and self._connections[host] >= self.max_connections_per_host):
+            self.stats['connection_limited'] += 1
+            return None
+        now = time.monotonic()
+        delay = 0.0
+        buckets = []
+        if self.per_host_rate:
+            bucket = self._bucket(host)
+            delay = max(delay, bucket.delay(now))
+            buckets.append(bucket)
+        if self._global is not None:
+            delay = max(delay, self._global.delay(now))
+            buckets.append(self._global)
+        if delay:
+            self.stats['throttled'] += 1
+            return delay
+        for bucket in buckets:
+            bucket.take()
+        self._connections[host] += 1
+        self.stats['granted'] += 1
+        return 0.0
+
+    def try_acquire(self, host):
+        """Start a request to host if the limits allow it, returning 0.
+        Otherwise return the seconds to wait before trying again, or
+        None if a request to the host has to finish first.
+        """
+        with self._lock:
+            return self._try_acquire(host)
+
+    def acquire(self, host):
+        "Wait until a request to host may start."
+        start = time.monotonic()
+        with self._lock:
+            while True:
+                delay = self._try_acquire(host)
+                if delay == 0:
+                    break
+                # release() wakes us early when a connection closes.
+                self._released.wait(delay)
+            self.stats['wait_seconds'] += time.monotonic() - start
+        return
+
+    def release(self, host):
+        "Record that a request to host has finished."
+        with self._lock:
+            self._connections[host] -= 1
+            if self._connections[host] <= 0:
+                del self._connections[host]
+            self._released.notify_all()
+        return
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Keep a set of feeds fresh by fetching each one when it is due.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+from concurrent import futures
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+#
+# Import local modules
+#
+from .ratelimit import RateLimited
+
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.scheduler')
+
+
+class Scheduler:
+    """Fetch each of a set of feeds through a Cache whenever its cached
+    data expires.
+
+    The next due time of every feed is kept in a heap, so adding,
+    rescheduling and dispatching a feed cost O(log n) however many
+    feeds there are.  A dispatcher thread sleeps until the earliest
+    due time (or until a feed is added), hands the feeds which are due
+    to a pool of worker threads, and goes back to sleep, so an idle
+    scheduler uses no CPU.
+
+    When a fetch finishes, the feed is scheduled again for the time
+    its new data expires (see Cache.get_expiration()), or for when its
+    failure backoff ends, plus a random delay of up to jitter times
+    the interval.  The delay keeps feeds which were fetched together
+    from expiring together, and never makes a fetch early.  Feeds
+    added without a due time are spread over the first
+    initialSpreadSeconds.
+    """
+
+    def __init__(self, cache, maxWorkers=10, jitter=0.1,
+                 minIntervalSeconds=60, initialSpreadSeconds=0,
+                 callback=None):
+        """
+        Arguments:
+
+          cache -- The Cache to fetch through.
+
+          maxWorkers=10 -- Number of feeds fetched at the same time.
+
+          jitter=0.1 -- Largest random delay added to each interval,
+          as a fraction of the interval.
+
+          minIntervalSeconds=60 -- Shortest time between fetches of
+          the same feed, used when the data has no time-to-live or
+          expired while it was being fetched.
+
+          initialSpreadSeconds=0 -- Feeds added without a due time
+          are first fetched at a random time within this many
+          seconds.
+
+          callback=None -- Function called from the worker thread as
+          callback(url, parsed_result, error) after each fetch.
+          error is the exception raised by the fetch, or None.
+
+        """
+        self.cache = cache
+        self.max_workers = maxWorkers
+        self.jitter = jitter
+        self.min_interval = minIntervalSeconds
+        self.initial_spread = initialSpreadSeconds
+        self.callback = callback
+        self.stats = collections.Counter()
+        self._heap = []
+        # url -> (due, sequence) of the live heap entry, or None
+        # while the feed is being fetched.
+        self._due = {}
+        self._sequence = itertools.count()
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._random = random.Random()
+        self._stopping = False
+        self._dispatcher = None
+        self._executor = None
+        return
+
+    def __len__(self):
+        with self._lock:
+            return len(self._due)
+
+    def __contains__(self, url):
+        with self._lock:
+            return url in self._due
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the scheduler.
+
+          feeds -- Feeds being kept fresh.
+
+          running -- Fetches in progress.
+
+          dispatched -- Fetches started.
+
+          errors -- Fetches which raised an exception.
+
+          rate_limited -- Fetches put off because the cache's rate
+          limiter had no room for them.
+
+          total_lateness -- Sum of the seconds between each feed's
+          due time and the start of its fetch.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['feeds'] = len(self._due)
+            stats['running'] = len(self._running)
+        return stats
+
+    #
+    # The schedule
+    #
+
+    def _push(self, url, due):
+        "Schedule url at due.  Call with the lock held."
+        entry = (due, next(self._sequence), url)
+        self._due[url] = entry[:2]
+        heapq.heappush(self._heap, entry)
+        if len(self._heap) > 2 * len(self._due) + 1000:
+            # Drop the entries left behind by rescheduled and removed
+            # feeds.
+            self._heap = [(d, seq, u) for d, seq, u in self._heap
+                          if self._due.get(u) == (d, seq)]
+            heapq.heapify(self._heap)
+        self._wake.notify()
+        return
+
+    def add(self, url, due=None):
+        """Start keeping url fresh.  It is first fetched at due (a
+        time.time() value), or at a random time within the initial
+        spread if due is None.  Adding a feed which is already
+        scheduled moves it to the new time.
+        """
+        if due is None:
+            due = time.time() + self._random.uniform(0, self.initial_spread)
+        with self._lock:
+            if url in self._running:
+                # It is scheduled again when the fetch finishes, as
+                # long as it is listed, which it may not be if it was
+                # removed during the fetch.
+                self._due[url] = None
+                return
+            self._push(url, due)
+        return
+
+    def add_many(self, urls):
+        "Add each of urls without a due time."
+        for url in urls:
+            self.add(url)
+        return
+
+    def remove(self, url):
+        "Stop fetching url.  A fetch in progress is allowed to finish."
+        with self._lock:
+            self._due.pop(url, None)
+        return
+
+    def next_due(self, url=None):
+        """Return the time url is next due, or the earliest due time
+        of any feed if url is None.  Returns None if nothing is
+        scheduled.
+        """
+        with self._lock:
+            if url is not None:
+                entry = self._due.get(url)
+                return entry[0] if entry else None
+            self._discard_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _discard_stale(self):
+        "Pop stale entries off the top of the heap.  Call with the lock held."
+        heap = self._heap
+        while heap and self._due.get(heap[0][2]) != heap[0][:2]:
+            heapq.heappop(heap)
+        return
+
+    def _next_time(self, url, now):
+        "Return when url should be fetched again."
+        due = self.cache.get_expiration(url)
+        failure = self.cache.get_failure(url)
+        if failure is not None and failure.next_attempt:
+            due = max(due or 0, failure.next_attempt)
+        due = max(due or 0, now + self.min_interval)
+        return due + self._random.uniform(0, self.jitter * (due - now))
+
+    #
+    # Running
+    #
+
+    def start(self):
+        "Start the dispatcher thread and the worker pool."
+        with self._lock:
+            if self._dispatcher is not None:
+                return
+            self._stopping = False
+            self._executor = futures.ThreadPoolExecutor(self.max_workers)
+            self._dispatcher = threading.Thread(target=self._dispatch_loop,
+                                                name='feedcache-scheduler')
+            self._dispatcher.daemon = True
+            self._dispatcher.start()
+        return
+
+    def stop(self, wait=True):
+        """Stop dispatching feeds.  If wait is true, also wait for the
+        fetches in progress to finish.
+        """
+        with self._lock:
+            if self._dispatcher is None:
+                return
+            self._stopping = True
+            self._wake.notify_all()
+            dispatcher = self._dispatcher
+        dispatcher.join()
+        self._executor.shutdown(wait=wait)
+        with self._lock:
+            self._dispatcher = None
+            self._executor = None
+        return
+
+    def _dispatch_loop(self):
+        with self._lock:
+            while not self._stopping:
+                self._discard_stale()
+                if len(self._running) >= self.max_workers:
+                    # Woken when a fetch finishes.
+                    self._wake.wait()
+                    continue
+                if not self._heap:
+                    self._wake.wait()
+                    continue
+                now = time.time()
+                due, sequence, url = self._heap[0]
+                if due > now:
+                    self._wake.wait(due - now)
+                    continue
+                heapq.heappop(self._heap)
+                self._due[url] = None
+                self._running.add(url)
+                self.stats['dispatched'] += 1
+                self.stats['total_lateness'] += now - due
+                self._executor.submit(self._fetch, url)
+        return
+
+    def _fetch(self, url):
+        "Worker thread target: fetch url and schedule it again."
+        result = error = None
+        try:
+            result = self.cache.fetch(url, block=False)
+        except RateLimited as err:
+            # Try again when the limiter has room, instead of holding
+            # the worker thread until then.
+            retry = 0.05 if err.delay is None else err.delay
+            with self._lock:
+                self._running.discard(url)
+                self.stats['rate_limited'] += 1
+                if url in self._due:
+                    self._push(url, time.time() + retry)
+                self._wake.notify()
+            return
+        except Exception as err:
+            logger.exception('fetching %s failed', url)
+            error = err
+        now = time.time()
+        due = self._next_time(url, now)
+        with self._lock:
+            self._running.discard(url)
+            if error is not None:
+                self.stats['errors'] += 1
+            if url in self._due:
+                self._push(url, due)
+            self._wake.notify()
+        if self.callback is not None:
+            try:
+                self.callback(url, result, error)
+            except Exception:
+                logger.exception('scheduler callback failed for %s', url)
+        return
@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Cache storage in a hash-sharded directory tree.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections.abc
+import contextlib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+import tempfile
+import threading
+import time
+
+#
+# Import local modules
+#
+from .codec import PickleCodec
+from . import freshness
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.shardedstorage')
+
+MANIFEST_NAME = 'manifest'
+# Temporary files older than this were left by a writer which died,
+# rather than being written right now.
+STALE_TEMP_SECONDS = 3600
+# Each file starts with the time the feed was stored.
+CACHED_TIME = struct.Struct('>d')
+# Number of locks the keys are spread over while their files and
+# manifest entries are changed.
+KEY_LOCKS = 64
+
+
+class ShardedFileStorage(collections.abc.MutableMapping):
+    """Cache storage with one file per feed in a two-level directory
+    tree.
+
+    Each file is named for the SHA-1 digest of its key and kept in
+    the directory named for the first two pairs of hex digits (for
+    example ab/cd/abcd....feed), so no directory holds more than a
+    small share of the feeds.  A file starts with the time the feed
+    was stored and a pickled header with the key, etag, modified and
+    lifetime values, followed by the encoded feed, so get_metadata() only
+    reads the header.  Files are written under a temporary name and
+    renamed into place, so a reader never sees a partly written feed.
+    touch() overwrites the time at the start of the file in place.
+
+    The keys are listed in a manifest file in the top directory, so
+    keys() and len() do not walk the tree.  Additions and removals are
+    appended to the manifest, which is rewritten once most of its
+    lines are out of date.  If the manifest is missing, it is rebuilt
+    from the tree when the storage is opened, as it is if the last
+    line was torn by a crash, since the feed files are what count.
+    rebuild_manifest() does the same on demand, and also removes
+    temporary files left by writers which died.
+
+    The storage is safe to share between threads.  A key's file and
+    its manifest entry are changed together under a lock for the key,
+    so a write and a removal of the same key cannot leave one without
+    the other.  Several processes may read and write feeds, but each
+    keeps its own list of keys, so only one process should add or
+    remove keys at a time.
+    """
+
+    def __init__(self, dirname, codec=None):
+        """
+        Arguments:
+
+          dirname -- Top directory of the tree.  It is created if it
+          does not exist.
+
+          codec=None -- Object with dumps() and loads() methods which
+          turn the parsed feeds into bytes and back (see
+          feedcache.codec).  Defaults to PickleCodec.
+
+        """
+        self.dirname = dirname
+        self.codec = codec if codec is not None else PickleCodec()
+        self._lock = threading.Lock()
+        self._key_locks = [threading.Lock() for i in range(KEY_LOCKS)]
+        self._keys = set()
+        self._manifest_lines = 0
+        os.makedirs(dirname, exist_ok=True)
+        self._manifest_path = os.path.join(dirname, MANIFEST_NAME)
+        self._remove_stale_temps(self.dirname, os.listdir(self.dirname))
+        if not (os.path.exists(self._manifest_path)
+                and self._load_manifest()):
+            self.rebuild_manifest()
+        return
+
+    def _path(self, key):
+        "Return the name of the file holding key."
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.dirname, digest[:2], digest[2:4],
+                            digest + '.feed')
+
+    @contextlib.contextmanager
+    def _locked(self, keys):
+        """Context manager which holds the locks for keys while their
+        files and manifest entries are changed.
+        """
+        with contextlib.ExitStack() as stack:
+            # Always take the locks in the same order.
+            for i in sorted({hash(key) % KEY_LOCKS for key in keys}):
+                stack.enter_context(self._key_locks[i])
+            yield
+
+    #
+    # Manifest
+    #
+
+    def _load_manifest(self):
+        """Read the list of keys from the manifest.  Returns False if
+        the manifest is damaged and has to be rebuilt.
+        """
+        keys = set()
+        lines = 0
+        with open(self._manifest_path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # A torn append.  The key in it cannot be
+                    # trusted, and later appends would be joined to
+                    # it, so let the feed files decide.
+                    logger.warning('manifest ends with a partial line')
+                    return False
+                lines += 1
+                try:
+                    # UnicodeDecodeError is a ValueError too.
+                    key = json.loads(line[1:].decode('utf-8'))
+                except ValueError as err:
+                    logger.warning('bad manifest line %d: %s', lines, err)
+                    return False
+                if line[:1] == b'+':
+                    keys.add(key)
+                elif line[:1] == b'-':
+                    keys.discard(key)
+                else:
+                    logger.warning('bad manifest line %d', lines)
+                    return False
+        self._keys = keys
+        self._manifest_lines = lines
+        return True
+
+    def _write_manifest(self):
+        """Replace the manifest with one line for each key.  Call with
+        the lock held.
+        """
+        fd, temp_name = tempfile.mkstemp(dir=self.dirname,
+                                         prefix=MANIFEST_NAME + '.',
+                                         suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for key in self._keys:
+                f.write('+' + json.dumps(key) + '\n')
+        os.replace(temp_name, self._manifest_path)
+        self._manifest_lines = len(self._keys)
+        return
+
+    def _log(self, changes):
+        """Append ('+' or '-', key) changes to the manifest.  Call with
+        the lock held.
+        """
+        if not changes:
+            return
+        if self._manifest_lines > 2 * max(len(self._keys), 1000):
+            self._write_manifest()
+            return
+        with open(self._manifest_path, 'a', encoding='utf-8') as f:
+            f.write(''.join(op + json.dumps(key) + '\n'
+                            for op, key in changes))
+        self._manifest_lines += len(changes)
+        return
+
+    def _remove_stale_temps(self, dirpath, filenames):
+        "Remove the old temporary files in dirpath."
+        cutoff = time.time() - STALE_TEMP_SECONDS
+        for filename in filenames:
+            if not filename.endswith('.tmp'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    logger.debug('removing %s', path)
+                    os.unlink(path)
+            except OSError:
+                # Renamed or removed by someone else.
+                pass
+        return
+
+    def rebuild_manifest(self):
+        """Walk the tree and rewrite the manifest from the files found,
+        removing old temporary files on the way.
+        """
+        keys = set()
+        for dirpath, dirnames, filenames in os.walk(self.dirname):
+            self._remove_stale_temps(dirpath, filenames)
+            for filename in filenames:
+                if not filename.endswith('.feed'):
+                    continue
+                try:
+                    with open(os.path.join(dirpath, filename), 'rb') as f:
+                        header = self._read_header(f)
+                except Exception as err:
+                    logger.warning('skipping %s: %s', filename, err)
+                    continue
+                keys.add(header['key'])
+        with self._lock:
+            self._keys = keys
+            self._write_manifest()
+        return
+
+    #
+    # Files
+    #
+
+    def _read_header(self, f):
+        "Read the time and header from the start of the file f."
+        data = f.read(CACHED_TIME.size)
+        if len(data) < CACHED_TIME.size:
+            raise ValueError('%s is too short' % f.name)
+        header = pickle.load(f)
+        header['cached_time'] = CACHED_TIME.unpack(data)[0]
+        return header
+
+    def _open_feed(self, key, mode='rb'):
+        """Return the open file for key, positioned after its header,
+        and the header.
+        """
+        try:
+            f = open(self._path(key), mode)
+        except FileNotFoundError:
+            raise KeyError(key)
+        header = self._read_header(f)
+        if header['key'] != key:
+            f.close()
+            raise KeyError(key)
+        return f, header
+
+    def _write_feed(self, key, value):
+        "Write the file for key, replacing any earlier one."
+        cached_time, content = value
+        get = getattr(content, 'get', None)
+        header = {'key': key,
+                  'etag': get('etag') if get else None,
+                  'modified': get('modified') if get else None,
+                  'lifetime': freshness.stored_lifetime(content,
+                                                        cached_time),
+                  }
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(CACHED_TIME.pack(cached_time))
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                f.write(self.codec.dumps(content))
+            os.replace(temp_name, path)
+        except BaseException:
+            os.unlink(temp_name)
+            raise
+        return
+
+    def get_metadata(self, key):
+        "Return the metadata record for key, or None."
+        try:
+            f, header = self._open_feed(key)
+        except KeyError:
+            return None
+        with f:
+            header['size'] = os.fstat(f.fileno()).st_size - f.tell()
+        del header['key']
+        return header
+
+    def get_body(self, key):
+        "Return the parsed feed stored for key."
+        f, header = self._open_feed(key)
+        with f:
+            return self.codec.loads(f.read())
+
+    def touch(self, key, cached_time):
+        "Change the time key was stored, without rewriting the feed."
+        with self._locked([key]):
+            f, header = self._open_feed(key, 'r+b')
+            with f:
+                f.seek(0)
+                f.write(CACHED_TIME.pack(cached_time))
+        return
+
+    #
+    # Mapping API
+    #
+
+    def __getitem__(self, key):
+        f, header = self._open_feed(key)
+        with f:
+            return (header['cached_time'], self.codec.loads(f.read()))
+
+    def __setitem__(self, key, value):
+        with self._locked([key]):
+            self._write_feed(key, value)
+            with self._lock:
+                if key not in self._keys:
+                    self._keys.add(key)
+                    self._log([('+', key)])
+        return
+
+    def __delitem__(self, key):
+        with self._lock:
+            if key not in self._keys:
+                raise KeyError(key)
+        self.delete_many([key])
+        return
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._keys
+
+    def __len__(self):
+        with self._lock:
+            return len(self._keys)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        "Return a list of the keys in the storage."
+        with self._lock:
+            return list(self._keys)
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the storage.
+        """
+        values = {}
+        for key in keys:
+            try:
+                values[key] = self[key]
+            except KeyError:
+                pass
+        return values
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        items = list(items)
+        added = [key for key, value in items]
+        with self._locked(added):
+            for key, value in items:
+                self._write_feed(key, value)
+            with self._lock:
+                new_keys = [key for key in set(added)
+                            if key not in self._keys]
+                self._keys.update(new_keys)
+                self._log([('+', key) for key in new_keys])
+        return
+
+    def delete_many(self, keys):
+        "Remove keys from the storage, ignoring any which are not there."
+        removed = list(keys)
+        with self._locked(removed):
+            for key in removed:
+                try:
+                    os.unlink(self._path(key))
+                except FileNotFoundError:
+                    pass
+            with self._lock:
+                gone = [key for key in set(removed) if key in self._keys]
+                self._keys.difference_update(gone)
+                self._log([('-', key) for key in gone])
+        return
+
+    def close(self):
+        "Rewrite the manifest so it holds one line for each key."
+        with self._lock:
+            if self._manifest_lines != len(self._keys):
+                self._write_manifest()
+        return
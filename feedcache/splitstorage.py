@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""Storage which keeps feed metadata separate from the parsed feeds.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections.abc
+import hashlib
+
+#
+# Import local modules
+#
+from .codec import PickleCodec
+from . import freshness
+
+#
+# Module
+#
+
+class SplitStorage(collections.abc.MutableMapping):
+    """Cache storage which keeps a small metadata record for each feed
+    apart from the parsed feed itself.
+
+    Values are stored and returned as (cached_time, parsed_feed)
+    tuples, like any other cache storage.  The Cache also uses
+    get_metadata() to check whether the data has expired and to build
+    the conditional GET request, so the parsed feed is only loaded
+    when it is returned to the caller.
+
+    The metadata record is a dictionary with the keys cached_time,
+    etag, modified, lifetime (see freshness.stored_lifetime()), size
+    (the length of the encoded feed) and hash (the SHA-1 digest of the
+    encoded feed).
+    """
+
+    def __init__(self, metadata, bodies, codec=None):
+        """
+        Arguments:
+
+          metadata -- Dictionary-like store for the metadata records.
+
+          bodies -- Dictionary-like store for the encoded feeds.  It
+          may be a different kind of store than the one used for the
+          metadata (for example, metadata in memory or in a small
+          shelf and the feeds in a large one).
+
+          codec=None -- Object with dumps() and loads() methods which
+          turn the parsed feeds into bytes and back (see
+          feedcache.codec).  Defaults to PickleCodec.
+
+        """
+        self.metadata = metadata
+        self.bodies = bodies
+        self.codec = codec if codec is not None else PickleCodec()
+        return
+
+    def get_metadata(self, key):
+        "Return the metadata record for key, or None."
+        return self.metadata.get(key)
+
+    def get_body(self, key):
+        "Return the parsed feed stored for key."
+        return self.codec.loads(self.bodies[key])
+
+    def touch(self, key, cached_time):
+        "Change the time key was stored, without rewriting the feed."
+        metadata = dict(self.metadata[key])
+        metadata['cached_time'] = cached_time
+        self.metadata[key] = metadata
+        return
+
+    def __getitem__(self, key):
+        metadata = self.metadata[key]
+        return (metadata['cached_time'], self.get_body(key))
+
+    def __setitem__(self, key, value):
+        cached_time, content = value
+        body = self.codec.dumps(content)
+        get = getattr(content, 'get', None)
+        metadata = {
+            'cached_time': cached_time,
+            'etag': get('etag') if get else None,
+            'modified': get('modified') if get else None,
+            'lifetime': freshness.stored_lifetime(content, cached_time),
+            'size': len(body),
+            'hash': hashlib.sha1(body).hexdigest(),
+            }
+        # Write the body first so the metadata never refers to
+        # data which is not there.
+        self.bodies[key] = body
+        self.metadata[key] = metadata
+        return
+
+    def __delitem__(self, key):
+        del self.metadata[key]
+        try:
+            del self.bodies[key]
+        except KeyError:
+            pass
+        return
+
+    def __contains__(self, key):
+        return key in self.metadata
+
+    def __iter__(self):
+        return iter(self.metadata)
+
+    def __len__(self):
+        return len(self.metadata)
+
+    def keys(self):
+        return self.metadata.keys()
+
+    def close(self):
+        "Close the underlying stores, if they support it."
+        for store in (self.metadata, self.bodies):
+            close = getattr(store, 'close', None)
+            if close is not None:
+                close()
+        return
@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+
+"""SQLite cache storage.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections.abc
+import contextlib
+import os
+import sqlite3
+import threading
+import weakref
+
+#
+# Import local modules
+#
+from .codec import PickleCodec
+from . import freshness
+
+#
+# Module
+#
+
+# Most keys to look up with one statement, kept below the limit on
+# parameters in older SQLite versions.
+MAX_VARIABLES = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS feeds (
+    key TEXT PRIMARY KEY,
+    cached_time REAL NOT NULL,
+    etag TEXT,
+    modified TEXT,
+    body BLOB NOT NULL,
+    lifetime REAL
+);
+CREATE INDEX IF NOT EXISTS feeds_cached_time ON feeds (cached_time);
+"""
+
+INSERT = ('INSERT OR REPLACE INTO feeds'
+          ' (key, cached_time, etag, modified, body, lifetime)'
+          ' VALUES (?, ?, ?, ?, ?, ?)')
+
+
+class _ThreadConnection:
+    """Kept in the thread-local data of the storage, so the connection
+    of a thread is closed when the thread exits.
+    """
+
+    def __init__(self, db, connections):
+        self.db = db
+        self.pid = os.getpid()
+        connections.add(db)
+        weakref.finalize(self, _close_connection, db, self.pid, connections)
+        return
+
+
+def _close_connection(db, pid, connections):
+    "Forget db, and close it unless the process has forked since."
+    connections.discard(db)
+    if os.getpid() == pid:
+        db.close()
+    return
+
+
+class SQLiteStorage(collections.abc.MutableMapping):
+    """Cache storage in an SQLite database.
+
+    The database is used in write-ahead log mode, so readers in other
+    threads and processes are not blocked by a writer.  Each thread
+    gets its own connection, which is closed when the thread exits.
+    Values are (cached_time, parsed_feed) tuples, as for any cache
+    storage.  The etag, modified and lifetime (see
+    freshness.stored_lifetime()) values are kept in their own columns,
+    so get_metadata() can answer the Cache's freshness checks without
+    loading the stored feed.  There is an index on cached_time, so
+    purge_before() removes expired entries with one DELETE statement.
+
+    set_many() and delete_many() each run in a single transaction, as
+    does everything inside a transaction() block.  get_many() reads
+    with one SELECT statement for up to MAX_VARIABLES keys, without
+    taking the write lock.
+    """
+
+    def __init__(self, filename, timeout=30, codec=None):
+        """
+        Arguments:
+
+          filename -- Name of the database file.
+
+          timeout=30 -- Seconds to wait for another connection to
+          finish writing.
+
+          codec=None -- Object with dumps() and loads() methods which
+          turn the parsed feeds into bytes and back (see
+          feedcache.codec).  Defaults to PickleCodec.
+
+        """
+        self.filename = filename
+        self.timeout = timeout
+        self.codec = codec if codec is not None else PickleCodec()
+        self._local = threading.local()
+        # Open connections, so close() can find them.
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+        # executescript() commits first, so it runs outside of
+        # transaction().
+        db = self._connection()
+        db.executescript(SCHEMA)
+        columns = [row[1] for row in db.execute('PRAGMA table_info(feeds)')]
+        if 'lifetime' not in columns:
+            # Created by an older version.
+            db.execute('ALTER TABLE feeds ADD COLUMN lifetime REAL')
+        return
+
+    def _connection(self):
+        "Return the connection for the current thread and process."
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or connection.pid != os.getpid():
+            # isolation_level=None leaves transactions to us.
+            db = sqlite3.connect(self.filename, timeout=self.timeout,
+                                 isolation_level=None,
+                                 check_same_thread=False)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with self._connections_lock:
+                connection = _ThreadConnection(db, self._connections)
+            self._local.connection = connection
+            self._local.depth = 0
+        return connection.db
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Context manager which groups the operations inside it into
+        one transaction.  Blocks may be nested.
+        """
+        db = self._connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield db
+            finally:
+                self._local.depth -= 1
+            return
+        db.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield db
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        else:
+            db.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def get_metadata(self, key):
+        "Return the metadata record for key, or None."
+        row = self._connection().execute(
+            'SELECT cached_time, etag, modified, lifetime, length(body)'
+            ' FROM feeds WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return {'cached_time': row[0],
+                'etag': row[1],
+                'modified': row[2],
+                'lifetime': row[3],
+                'size': row[4],
+                }
+
+    def get_body(self, key):
+        "Return the parsed feed stored for key."
+        row = self._connection().execute(
+            'SELECT body FROM feeds WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return self.codec.loads(row[0])
+
+    def touch(self, key, cached_time):
+        "Change the time key was stored, without rewriting the feed."
+        with self.transaction() as db:
+            cursor = db.execute(
+                'UPDATE feeds SET cached_time = ? WHERE key = ?',
+                (cached_time, key))
+            if not cursor.rowcount:
+                raise KeyError(key)
+        return
+
+    def __getitem__(self, key):
+        row = self._connection().execute(
+            'SELECT cached_time, body FROM feeds WHERE key = ?',
+            (key,)).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return (row[0], self.codec.loads(row[1]))
+
+    def _row(self, key, value):
+        "Return the column values used to store value for key."
+        cached_time, content = value
+        get = getattr(content, 'get', None)
+        modified = get('modified') if get else None
+        if modified is not None and not isinstance(modified, str):
+            # Older feed parser versions give a time tuple.
+            modified = None
+        return (key, cached_time, get('etag') if get else None, modified,
+                self.codec.dumps(content),
+                freshness.stored_lifetime(content, cached_time))
+
+    def __setitem__(self, key, value):
+        with self.transaction() as db:
+            db.execute(INSERT, self._row(key, value))
+        return
+
+    def __delitem__(self, key):
+        with self.transaction() as db:
+            cursor = db.execute('DELETE FROM feeds WHERE key = ?', (key,))
+            if not cursor.rowcount:
+                raise KeyError(key)
+        return
+
+    def __contains__(self, key):
+        return self._connection().execute(
+            'SELECT 1 FROM feeds WHERE key = ?', (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self._connection().execute(
+            'SELECT COUNT(*) FROM feeds').fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        "Return a list of the keys in the storage."
+        return [row[0] for row in
+                self._connection().execute('SELECT key FROM feeds')]
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the storage.
+        """
+        # Each SELECT reads a consistent snapshot without a write
+        # transaction, so readers do not wait for writers.
+        db = self._connection()
+        keys = list(keys)
+        values = {}
+        for start in range(0, len(keys), MAX_VARIABLES):
+            chunk = keys[start:start + MAX_VARIABLES]
+            rows = db.execute(
+                'SELECT key, cached_time, body FROM feeds WHERE key IN (%s)'
+                % ', '.join('?' * len(chunk)), chunk)
+            for key, cached_time, body in rows:
+                values[key] = (cached_time, self.codec.loads(body))
+        return values
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        with self.transaction() as db:
+            db.executemany(INSERT, [self._row(key, value)
+                                    for key, value in items])
+        return
+
+    def delete_many(self, keys):
+        "Remove keys from the storage, ignoring any which are not there."
+        with self.transaction() as db:
+            db.executemany('DELETE FROM feeds WHERE key = ?',
+                           [(key,) for key in keys])
+        return
+
+    def purge_before(self, cutoff, limit=None):
+        """Remove the entries stored at or before cutoff, at most limit
+        of them if limit is given.  Returns the number removed.
+        """
+        with self.transaction() as db:
+            if limit is None:
+                cursor = db.execute('DELETE FROM feeds WHERE cached_time <= ?',
+                                    (cutoff,))
+            else:
+                cursor = db.execute(
+                    'DELETE FROM feeds WHERE key IN'
+                    ' (SELECT key FROM feeds WHERE cached_time <= ? LIMIT ?)',
+                    (cutoff, limit))
+            return cursor.rowcount
+
+    def close(self):
+        "Close all of the connections."
+        with self._connections_lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for db in connections:
+            db.close()
+        self._local = threading.local()
+        return
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.adaptive
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import unittest
+
+#
+# Import local modules
+#
+from .adaptive import ChangeHistory
+
+#
+# Module
+#
+
+
+class ChangeHistoryTest(unittest.TestCase):
+
+    def testNotEnoughHistory(self):
+        history = ChangeHistory()
+        self.assertEqual(history.estimate_ttl(60, 3600), None)
+        history.add(0, True)
+        self.assertEqual(history.estimate_ttl(60, 3600), None)
+        return
+
+    def testUnchangedFeedBacksOff(self):
+        # A feed which never changes gets a TTL as long as
+        # the history, up to the maximum.
+        history = ChangeHistory()
+        history.add(0, True)
+        history.add(600, False)
+        self.assertEqual(history.estimate_ttl(60, 3600), 600)
+        history.add(1200, False)
+        self.assertEqual(history.estimate_ttl(60, 3600), 1200)
+        history.add(5000, False)
+        self.assertEqual(history.estimate_ttl(60, 3600), 3600)
+        return
+
+    def testChangingFeedTightens(self):
+        # A feed which changes every time gets half the interval.
+        history = ChangeHistory()
+        for when in range(0, 1000, 200):
+            history.add(when, True)
+        self.assertEqual(history.estimate_ttl(60, 3600), 100)
+        self.assertEqual(history.estimate_ttl(150, 3600), 150)
+        return
+
+    def testHistoryIsBounded(self):
+        history = ChangeHistory(size=3)
+        for when in range(10):
+            history.add(when, False)
+        self.assertEqual(list(history.observations),
+                         [(7, False), (8, False), (9, False)])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.asynccache
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import asyncio
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .asynccache import AsyncCache
+from .test_server import HTTPTestBase, TestHTTPHandler, TestHTTPServer
+from .test_timeouts import TarpitHTTPServer
+from .timeouts import DeadlineExceeded
+
+#
+# Module
+#
+
+
+class AsyncCacheTestBase(HTTPTestBase):
+
+    CACHE_TTL = 30
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.storage = {}
+        self.cache = AsyncCache(self.storage,
+                                timeToLiveSeconds=self.CACHE_TTL,
+                                userAgent='feedcache.test',
+                                )
+        return
+
+    def fetch(self, url, **kwds):
+        return asyncio.run(self.cache.fetch(url, **kwds))
+
+
+class AsyncCacheTest(AsyncCacheTestBase):
+
+    def getServer(self):
+        return TestHTTPServer(applyModifiedHeaders=False)
+
+    def testRetrieveNotInCache(self):
+        feed_data = self.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(feed_data.status, 200)
+        self.assertTrue(self.TEST_URL in self.storage)
+        return
+
+    def testRetrieveIsInCache(self):
+        feed_data = self.fetch(self.TEST_URL)
+        feed_data2 = self.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testOfflineMode(self):
+        self.storage[self.TEST_URL] = (0, self.id())
+        feed_data = self.fetch(self.TEST_URL, offline=True)
+        self.assertEqual(feed_data, self.id())
+        return
+
+    def testRedirectNotCached(self):
+        self.server.setResponse(302, '/redirected')
+        feed_data = self.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.status, 302)
+        self.assertEqual(feed_data.href, self.TEST_URL + 'redirected')
+        self.assertFalse(self.storage)
+        return
+
+    def testGather(self):
+        urls = [self.TEST_URL + 'feed%d' % i for i in range(5)]
+        results = asyncio.run(self.cache.gather(urls, limit=2))
+        self.assertEqual(len(results), 5)
+        for feed_data in results:
+            self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(sorted(self.storage.keys()), sorted(urls))
+        return
+
+
+class AsyncCacheConditionalGETTest(AsyncCacheTestBase):
+
+    CACHE_TTL = 0
+
+    def testFetchOnceForEtag(self):
+        response1 = self.fetch(self.TEST_URL)
+        response1['modified'] = None
+        response2 = self.fetch(self.TEST_URL)
+        self.assertTrue(response1 is response2)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def testFetchOnceForModifiedTime(self):
+        response1 = self.fetch(self.TEST_URL)
+        response1['etag'] = None
+        response2 = self.fetch(self.TEST_URL)
+        self.assertTrue(response1 is response2)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+
+class NoReplyHTTPHandler(TestHTTPHandler):
+    "Request handler which closes the connection without replying."
+
+    def do_GET_200(self):
+        self.close_connection = True
+        return
+
+
+class AsyncCacheNoReplyTest(AsyncCacheTestBase):
+
+    CACHE_TTL = 0
+
+    def getServer(self):
+        return TestHTTPServer(handler=NoReplyHTTPHandler)
+
+    def testStaleIfError(self):
+        stored = {'title': self.id()}
+        self.storage[self.TEST_URL] = (time.time() - 1, stored)
+        self.cache.stale_if_error = 60
+        self.assertEqual(self.fetch(self.TEST_URL), stored)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['stale_if_error'], 1)
+        return
+
+
+class AsyncCacheTimeoutTest(AsyncCacheTestBase):
+
+    CACHE_TTL = 0
+
+    def getServer(self):
+        return TarpitHTTPServer()
+
+    def testReadTimeout(self):
+        self.cache.read_timeout = 0.2
+        self.server.hang = 1
+        start = time.time()
+        feed_data = self.fetch(self.TEST_URL)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertTrue(isinstance(feed_data.bozo_exception, TimeoutError))
+        self.assertEqual(self.cache.get_stats()['timeouts'], 1)
+        return
+
+    def testDeadline(self):
+        self.cache.read_timeout = 1
+        self.cache.fetch_deadline = 0.3
+        self.server.drip = 0.1
+        start = time.time()
+        feed_data = self.fetch(self.TEST_URL)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertTrue(isinstance(feed_data.bozo_exception,
+                                   DeadlineExceeded))
+        self.assertFalse(self.storage)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
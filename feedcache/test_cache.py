@@ -39,15 +39,18 @@ logger = logging.getLogger('feedcache.test_cache')
 # Import system modules
 #
 import copy
+import threading
 import time
 import unittest
+import urllib.parse
 from collections import UserDict
 
 #
 # Import local modules
 #
 from . import cache
-from .test_server import HTTPTestBase, TestHTTPServer
+from .splitstorage import SplitStorage
+from .test_server import HTTPTestBase, TestHTTPHandler, TestHTTPServer
 
 #
 # Module
@@ -68,6 +71,11 @@ class CacheTestBase(HTTPTestBase):
                                  )
         return
 
+    def tearDown(self):
+        self.cache.close()
+        HTTPTestBase.tearDown(self)
+        return
+
     def getStorage(self):
         "Return a cache storage for the test."
         return {}
@@ -184,6 +192,19 @@ class SingleWriteMemoryStorage(UserDict):
         return
 
 
+class ReadRecordingStorage(dict):
+    "Cache storage which records the keys read with get()."
+
+    def __init__(self):
+        dict.__init__(self)
+        self.reads = []
+        return
+
+    def get(self, key, default=None):
+        self.reads.append(key)
+        return dict.get(self, key, default)
+
+
 class CacheConditionalGETTest(CacheTestBase):
 
     CACHE_TTL = 0
@@ -285,6 +306,492 @@ class CacheRedirectHandlingTest(CacheTestBase):
         self._test(307)
 
 
+class CacheFetchManyTest(CacheTestBase):
+
+    def testFetchAll(self):
+        # Fetch several URLs and verify each is returned once.
+        urls = [self.TEST_URL + 'feed%d' % i for i in range(4)]
+        results = dict(self.cache.fetch_many(urls, max_workers=2))
+        self.assertEqual(sorted(results.keys()), sorted(urls))
+        for feed_data in results.values():
+            self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.server.getNumRequests(), 4)
+        return
+
+    def testHitsDoNotUseNetwork(self):
+        # Data still within the TTL should come straight from the cache.
+        feed_data = self.cache.fetch(self.TEST_URL)
+        results = list(self.cache.fetch_many([self.TEST_URL]))
+        self.assertEqual(len(results), 1)
+        self.assertTrue(results[0][1] is feed_data)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testPerHostLimit(self):
+        # Requests beyond the per-host limit are queued, not dropped,
+        # and each host gets no more than the limit at once.
+        lock = threading.Lock()
+        running = {}
+        peak = {}
+        fetch = self.cache.fetch
+
+        def counting_fetch(url, **kwds):
+            host = urllib.parse.urlsplit(url).netloc
+            with lock:
+                running[host] = running.get(host, 0) + 1
+                running['all'] = running.get('all', 0) + 1
+                for name in (host, 'all'):
+                    peak[name] = max(peak.get(name, 0), running[name])
+            try:
+                # Give the other workers time to start.
+                time.sleep(0.1)
+                return fetch(url, **kwds)
+            finally:
+                with lock:
+                    running[host] -= 1
+                    running['all'] -= 1
+
+        self.cache.fetch = counting_fetch
+        # The same server under two host names.
+        other_url = self.TEST_URL.replace('localhost', '127.0.0.1')
+        urls = [base + 'feed%d' % i
+                for base in (self.TEST_URL, other_url)
+                for i in range(3)]
+        results = list(self.cache.fetch_many(urls, max_workers=4,
+                                             per_host_limit=1))
+        self.assertEqual(sorted(url for url, data in results), sorted(urls))
+        self.assertEqual(self.server.getNumRequests(), 6)
+        self.assertEqual(peak, {'localhost:9999': 1,
+                                '127.0.0.1:9999': 1,
+                                'all': 2,
+                                })
+        return
+
+
+class SlowHTTPHandler(TestHTTPHandler):
+    "Request handler which takes a while to answer."
+
+    def do_GET_200(self):
+        time.sleep(0.5)
+        return TestHTTPHandler.do_GET_200(self)
+
+
+class CacheCoalescingTest(CacheTestBase):
+
+    def getServer(self):
+        return TestHTTPServer(handler=SlowHTTPHandler)
+
+    def testConcurrentFetchesShareRequest(self):
+        # Several threads asking for the same feed at once
+        # should result in a single request to the server.
+        results = []
+
+        def fetch():
+            results.append(self.cache.fetch(self.TEST_URL))
+
+        threads = [threading.Thread(target=fetch) for i in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(results), 5)
+        for feed_data in results:
+            self.assertTrue(feed_data is results[0])
+        self.assertEqual(self.server.getNumRequests(), 1)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['network_requests'], 1)
+        self.assertEqual(stats['coalesced'], 4)
+        return
+
+
+class CacheStaleTest(CacheTestBase):
+
+    def setUp(self):
+        CacheTestBase.setUp(self)
+        self.cache.stale_while_revalidate = 60
+        self.cache.stale_if_error = 60
+        return
+
+    def _expire(self):
+        "Make the cached data look older than the TTL."
+        cached_time, cached_content = self.storage[self.TEST_URL]
+        self.storage[self.TEST_URL] = (cached_time - self.CACHE_TTL - 10,
+                                       cached_content)
+        return cached_time
+
+    def testStaleWhileRevalidate(self):
+        # Expired data within the window is returned right away
+        # and updated in the background.
+        feed_data = self.cache.fetch(self.TEST_URL)
+        original_time = self._expire()
+
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+
+        # The server answers with a 304, so the background
+        # update only changes the time stored with the data.
+        for i in range(20):
+            if self.storage[self.TEST_URL][0] >= original_time:
+                break
+            time.sleep(0.1)
+        self.assertTrue(self.storage[self.TEST_URL][0] >= original_time)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        self.assertEqual(self.cache.get_stats()['stale_while_revalidate'], 1)
+        return
+
+    def testRevalidateWorkers(self):
+        # Background updates for many stale feeds share a small
+        # pool of threads, which close() stops.
+        self.cache.revalidate_workers = 2
+        self.cache.fetch(self.TEST_URL)
+        original_time = self._expire()
+        cached_time, cached_content = self.storage[self.TEST_URL]
+        urls = ['%s?n=%d' % (self.TEST_URL, i) for i in range(20)]
+        for url in urls:
+            self.storage[url] = (cached_time, cached_content)
+
+        def revalidating():
+            return [t for t in threading.enumerate()
+                    if t.name.startswith('feedcache-revalidate')]
+        most = 0
+        for url in urls:
+            self.assertTrue(self.cache.fetch(url) is not None)
+            most = max(most, len(revalidating()))
+        self.cache.close()
+
+        self.assertTrue(0 < most <= 2)
+        self.assertEqual(revalidating(), [])
+        for url in urls:
+            self.assertTrue(self.storage[url][0] >= original_time)
+        return
+
+    def testStaleIfError(self):
+        # Expired data within the window is returned when
+        # the server fails.
+        self.cache.stale_while_revalidate = 0
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self._expire()
+        self.server.setResponse(500)
+
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        self.assertEqual(self.cache.get_stats()['stale_if_error'], 1)
+        return
+
+    def testErrorOutsideWindow(self):
+        # Data which is too old is not used when the server fails.
+        self.cache.stale_while_revalidate = 0
+        self.cache.stale_if_error = 5
+        self.cache.fetch(self.TEST_URL)
+        self._expire()
+        self.server.setResponse(500)
+
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.get('status'), 500)
+        return
+
+
+class CacheFailureBackoffTest(CacheTestBase):
+
+    def setUp(self):
+        CacheTestBase.setUp(self)
+        self.cache.failure_backoff = 10
+        self.cache.max_failure_backoff = 25
+        return
+
+    def testNoRequestDuringBackoff(self):
+        # After a failure, the server is left alone for a while.
+        self.server.setResponse(500)
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.get('status'), 500)
+
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data, None)
+        self.assertEqual(self.server.getNumRequests(), 1)
+
+        failure = self.cache.get_failure(self.TEST_URL)
+        self.assertEqual(failure.status, 500)
+        self.assertEqual(failure.count, 1)
+        self.assertEqual(self.cache.get_stats()['backoff'], 1)
+        return
+
+    def testLastGoodContentDuringBackoff(self):
+        # The previously stored content is returned during the backoff.
+        good_data = self.cache.fetch(self.TEST_URL)
+        self.server.setResponse(500)
+        self.cache.fetch(self.TEST_URL, force_update=True)
+        # Expire the stored data so only the backoff prevents a request.
+        self.storage[self.TEST_URL] = (0, good_data)
+
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is good_data)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def testBackoffGrows(self):
+        # The delay doubles with each failure, up to the limit.
+        self.server.setResponse(500)
+        delays = []
+        for i in range(3):
+            start = time.time()
+            self.cache.fetch(self.TEST_URL, force_update=True)
+            failure = self.cache.get_failure(self.TEST_URL)
+            delays.append(round(failure.next_attempt - start))
+        self.assertEqual(delays, [10, 20, 25])
+        return
+
+    def testSuccessClearsFailure(self):
+        self.server.setResponse(500)
+        self.cache.fetch(self.TEST_URL)
+        self.server.setResponse(200)
+        self.cache.fetch(self.TEST_URL, force_update=True)
+        self.assertEqual(self.cache.get_failure(self.TEST_URL), None)
+        return
+
+
+class CacheAdaptiveTTLTest(CacheTestBase):
+
+    CACHE_TTL = 0
+
+    def testHistoryRecorded(self):
+        self.cache.adaptive_time_to_live = True
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.cache.get_ttl(self.TEST_URL), 0)
+        self.cache.fetch(self.TEST_URL)
+
+        history = self.cache.get_history(self.TEST_URL)
+        self.assertEqual([changed for when, changed in history],
+                         [True, False])
+        # Not long enough to go beyond the minimum.
+        self.assertEqual(self.cache.get_ttl(self.TEST_URL),
+                         self.cache.min_time_to_live)
+
+        # The adaptive TTL is now used for the freshness check.
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def testDisabled(self):
+        self.cache.fetch(self.TEST_URL)
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.cache.get_ttl(self.TEST_URL), 0)
+        return
+
+
+class CacheHeadersTest(CacheTestBase):
+
+    CACHE_TTL = 0
+
+    def setUp(self):
+        CacheTestBase.setUp(self)
+        self.cache.honor_cache_headers = True
+        return
+
+    def testMaxAge(self):
+        # The server's max-age is used instead of the TTL.
+        self.server.extra_headers['Cache-Control'] = 'max-age=3600'
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testMaxAgeLimited(self):
+        # The lifetime is kept below the maximum TTL.
+        self.cache.max_time_to_live = 1
+        self.cache.min_time_to_live = 0
+        self.server.extra_headers['Cache-Control'] = 'max-age=3600'
+        self.cache.fetch(self.TEST_URL)
+        time.sleep(1.5)
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def restart(self):
+        "Return a new cache using the same storage."
+        return cache.Cache(self.storage, timeToLiveSeconds=self.CACHE_TTL,
+                           honorCacheHeaders=True)
+
+    def testMaxAgeAfterRestart(self):
+        # The lifetime comes from the stored headers when the cache
+        # has not seen the feed.
+        self.server.extra_headers['Cache-Control'] = 'max-age=3600'
+        self.cache.fetch(self.TEST_URL)
+        self.restart().fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testNotModifiedHeadersSaved(self):
+        # Cache headers sent with a 304 are saved with the feed.
+        self.cache.fetch(self.TEST_URL)
+        self.server.extra_headers['Cache-Control'] = 'max-age=3600'
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        headers = self.storage[self.TEST_URL][1]['headers']
+        self.assertEqual(headers['cache-control'], 'max-age=3600')
+
+        self.restart().fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def testUnchangedHeadersTouch(self):
+        # A 304 with the same cache headers only touches the feed.
+        self.storage = TouchRecordingStorage()
+        self.cache = self.restart()
+        self.cache.min_time_to_live = 0
+        self.server.extra_headers['Cache-Control'] = 'max-age=0'
+        for i in range(3):
+            if i:
+                # Give each response a new Date header.
+                time.sleep(1)
+            self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 3)
+        self.assertEqual(self.storage.writes, 1)
+        self.assertEqual(self.storage.touched, [self.TEST_URL] * 2)
+        return
+
+    def testRetryAfter(self):
+        # A server asking us to wait is left alone.
+        self.server.setResponse(503)
+        self.server.extra_headers['Retry-After'] = '120'
+        self.cache.fetch(self.TEST_URL)
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data, None)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+
+class TouchRecordingStorage(dict):
+    "Cache storage which records calls to touch() and writes."
+
+    def __init__(self):
+        dict.__init__(self)
+        self.touched = []
+        self.writes = 0
+        return
+
+    def __setitem__(self, key, value):
+        self.writes += 1
+        dict.__setitem__(self, key, value)
+        return
+
+    def touch(self, key, cached_time):
+        self.touched.append(key)
+        content = self[key][1]
+        dict.__setitem__(self, key, (cached_time, content))
+        return
+
+
+class CacheTouchTest(CacheTestBase):
+
+    CACHE_TTL = 0
+
+    def getStorage(self):
+        return TouchRecordingStorage()
+
+    def testRevalidationTouches(self):
+        self.cache.fetch(self.TEST_URL)
+        cached_time = self.storage[self.TEST_URL][0]
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        self.assertEqual(self.storage.writes, 1)
+        self.assertEqual(self.storage.touched, [self.TEST_URL])
+        self.assertTrue(self.storage[self.TEST_URL][0] >= cached_time)
+        return
+
+    def testTouchMissingKey(self):
+        # If the entry disappears between the read and the update,
+        # the content is stored again.
+        self.cache.fetch(self.TEST_URL)
+        entry = self.cache._lookup(self.TEST_URL)
+        dict.__delitem__(self.storage, self.TEST_URL)
+        self.cache._touch(self.TEST_URL, 100, entry.content)
+        self.assertEqual(self.storage[self.TEST_URL][0], 100)
+        self.assertEqual(self.storage.writes, 2)
+        return
+
+
+class VanishingSplitStorage(SplitStorage):
+    "Split storage which can lose a feed right after its metadata is read."
+
+    vanish = False
+
+    def get_metadata(self, key):
+        metadata = SplitStorage.get_metadata(self, key)
+        if self.vanish and metadata:
+            del self[key]
+        return metadata
+
+
+class CacheBodyRemovedTest(CacheTestBase):
+
+    def getStorage(self):
+        return VanishingSplitStorage({}, {})
+
+    def testFreshHit(self):
+        self.cache.fetch(self.TEST_URL)
+        self.storage.vanish = True
+        self.assertEqual(self.cache.fetch(self.TEST_URL), None)
+        return
+
+    def testRevalidate(self):
+        self.cache.time_to_live = 0
+        self.cache.fetch(self.TEST_URL)
+        self.storage.vanish = True
+        self.assertEqual(self.cache.fetch(self.TEST_URL), None)
+        self.assertFalse(self.TEST_URL in self.storage)
+        self.storage.vanish = False
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.server.getNumRequests(), 3)
+        return
+
+
+class CacheMemoryTierTest(CacheTestBase):
+
+    def getStorage(self):
+        # The split storage returns a new copy of the feed
+        # every time it is read.
+        return SplitStorage({}, {})
+
+    def setUp(self):
+        CacheTestBase.setUp(self)
+        self.cache = cache.Cache(self.storage,
+                                 timeToLiveSeconds=self.CACHE_TTL,
+                                 memoryCacheEntries=10,
+                                 )
+        return
+
+    def testRetrieveIsInMemory(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+        stats = self.cache.get_stats()
+        self.assertEqual(stats['memory_hits'], 1)
+        self.assertEqual(stats['memory_misses'], 1)
+        self.assertEqual(stats['storage_misses'], 1)
+        self.assertEqual(stats['memory_hit_rate'], 0.5)
+        return
+
+    def testLoadedFromStorage(self):
+        # Data found in the storage is kept in memory once loaded.
+        self.cache.fetch(self.TEST_URL)
+        self.cache.memory.clear()
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertTrue(feed_data is feed_data2)
+        self.assertEqual(self.cache.get_stats()['storage_hits'], 1)
+        return
+
+    def testPurge(self):
+        self.cache.fetch(self.TEST_URL)
+        self.cache.purge(None)
+        self.assertEqual(len(self.cache.memory), 0)
+        return
+
+
 class CachePurgeTest(CacheTestBase):
 
     def testPurgeAll(self):
@@ -318,6 +825,86 @@ class CachePurgeTest(CacheTestBase):
                              ['http://this.should.remain/'])
         return
 
+    def testPurgeStep(self):
+        # Purge a little at a time.
+        now = time.time()
+        for i in range(20):
+            self.storage['http://old/%d' % i] = (now - 100, None)
+        self.storage['http://new/'] = (now, None)
+
+        steps = 1
+        while not self.cache.purge_step(50, budgetSeconds=0):
+            steps += 1
+        self.assertTrue(steps > 1)
+        self.assertEqual(list(self.storage.keys()), ['http://new/'])
+        return
+
+    def testPurgeReadsOnlyExpired(self):
+        # Once the index is built, only expired entries are read.
+        storage = self.cache.storage = ReadRecordingStorage()
+        now = time.time()
+        self.cache.purge(50)
+        for i in range(10):
+            self.cache._index_add('http://new/%d' % i, now)
+            storage['http://new/%d' % i] = (now, None)
+        self.cache._index_add('http://old/', now - 100)
+        storage['http://old/'] = (now - 100, None)
+
+        self.cache.purge(50)
+        self.assertEqual(storage.reads, ['http://old/'])
+        self.assertFalse('http://old/' in storage)
+        return
+
+    def testPurgeFindsOutsideWrites(self):
+        # Keys stored without going through this cache after the
+        # index was built are still purged.
+        self.storage['http://a/'] = (0, None)
+        self.cache.purge(10)
+        self.storage['http://b/'] = (0, None)
+        self.cache.purge(10)
+        self.assertEqual(list(self.storage.keys()), [])
+        self.storage['http://c/'] = (0, None)
+        # purge_step() only scans again after INDEX_RESCAN_SECONDS.
+        while not self.cache.purge_step(10, budgetSeconds=0):
+            pass
+        self.assertEqual(list(self.storage.keys()), ['http://c/'])
+        self.cache._index_scanned_at -= cache.INDEX_RESCAN_SECONDS
+        while not self.cache.purge_step(10, budgetSeconds=0):
+            pass
+        self.assertEqual(list(self.storage.keys()), [])
+        return
+
+    def testIndexScan(self):
+        # The keys are listed once, without holding up writes.
+        storage = KeyListingStorage()
+        c = cache.Cache(storage, timeToLiveSeconds=30)
+        storage.cache = c
+        for i in range(3):
+            storage['http://%d/' % i] = (0, None)
+        for i in range(3):
+            while not c.purge_step(10, budgetSeconds=0):
+                pass
+            storage['http://x%d/' % i] = (0, None)
+        self.assertEqual(storage.listed, 1)
+        self.assertEqual(sorted(storage.keys()),
+                         ['http://x0/', 'http://x1/', 'http://x2/'])
+        return
+
+
+class KeyListingStorage(dict):
+    "Cache storage which records calls to keys()."
+
+    cache = None
+    listed = 0
+
+    def keys(self):
+        self.listed += 1
+        if self.cache is not None:
+            # The index can still be updated.
+            assert self.cache._index_lock.acquire(blocking=False)
+            self.cache._index_lock.release()
+        return dict.keys(self)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -32,17 +32,24 @@ __module_id__ = "$Id$"
 #
 # Import system modules
 #
+import glob
 import os
 import shelve
 import tempfile
 import threading
+import time
 import unittest
 
 #
 # Import local modules
 #
 from .cache import Cache
-from .cachestoragelock import CacheStorageLock
+from .cachestoragelock import (CacheStorageLock,
+                               ReadWriteCacheStorageLock,
+                               ReadWriteLock,
+                               StripedCacheStorageLock,
+                               )
+from .splitstorage import SplitStorage
 from .test_server import HTTPTestBase
 
 #
@@ -59,10 +66,10 @@ class CacheShelveTest(HTTPTestBase):
         return
 
     def tearDown(self):
-        try:
-            os.unlink(self.shelve_filename)
-        except AttributeError:
-            pass
+        # Depending on the dbm module in use, the shelf may be spread
+        # across several files sharing the same prefix.
+        for filename in glob.glob(self.shelve_filename + '*'):
+            os.unlink(filename)
         HTTPTestBase.tearDown(self)
         return
 
@@ -86,5 +93,155 @@ class CacheShelveTest(HTTPTestBase):
         return
 
 
+class CountingLock:
+    "Lock which counts how many times it is acquired."
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        return
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.count += 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+        return False
+
+
+class LockWrapperTestMixin:
+    "Checks common to all of the lock wrappers."
+
+    def testFullMappingAPI(self):
+        locked = self.wrapper({'a': 1, 'b': 2})
+        self.assertEqual(len(locked), 2)
+        self.assertEqual(sorted(locked), ['a', 'b'])
+        self.assertEqual(sorted(locked.keys()), ['a', 'b'])
+        self.assertTrue('a' in locked)
+        del locked['a']
+        self.assertFalse('a' in locked)
+        self.assertRaises(KeyError, locked.__delitem__, 'a')
+        return
+
+    def testBatchOperations(self):
+        storage = {}
+        locked = self.wrapper(storage)
+        locked.set_many({'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(storage, {'a': 1, 'b': 2, 'c': 3})
+        self.assertEqual(locked.get_many(['a', 'b', 'x']), {'a': 1, 'b': 2})
+        locked.delete_many(['a', 'x'])
+        self.assertEqual(storage, {'b': 2, 'c': 3})
+        return
+
+    def testTouch(self):
+        storage = {'a': (1, 'data')}
+        locked = self.wrapper(storage)
+        locked.touch('a', 2)
+        self.assertEqual(storage['a'], (2, 'data'))
+        self.assertRaises(KeyError, locked.touch, 'b', 2)
+        # A storage with its own touch() is left to do the work.
+        split = SplitStorage({}, {})
+        split['a'] = (1, 'data')
+        self.wrapper(split).touch('a', 3)
+        self.assertEqual(split.get_metadata('a')['cached_time'], 3)
+        return
+
+    def testMappingAPI(self):
+        storage = {}
+        locked = self.wrapper(storage)
+        locked['a'] = 1
+        self.assertEqual(locked['a'], 1)
+        self.assertEqual(locked.get('a'), 1)
+        self.assertEqual(locked.get('b', 2), 2)
+        self.assertRaises(KeyError, locked.__getitem__, 'b')
+        self.assertEqual(storage, {'a': 1})
+        return
+
+    def testWithCache(self):
+        fc = Cache(self.wrapper({}))
+        fc.fetch(self.TEST_URL)
+        parsed_data = fc.fetch(self.TEST_URL)
+        self.assertEqual(parsed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+
+class CacheStorageLockTest(LockWrapperTestMixin, HTTPTestBase):
+
+    wrapper = CacheStorageLock
+
+    def testPurgeLocksPerBatch(self):
+        # Purging takes the lock once per batch of keys
+        # instead of once per key.
+        now = time.time()
+        storage = dict(('http://old/%d' % i, (now - 100, None))
+                       for i in range(250))
+        locked = CacheStorageLock(storage)
+        locked.lock = CountingLock()
+        fc = Cache(locked)
+        fc.purge(50)
+        self.assertFalse(storage)
+        # Listing the keys, then reading and removing three batches
+        # while building the index and purging.
+        self.assertEqual(locked.lock.count, 1 + 3 + 3 + 3)
+        return
+
+
+class StripedCacheStorageLockTest(LockWrapperTestMixin, HTTPTestBase):
+
+    wrapper = StripedCacheStorageLock
+
+    def testSameKeySameLock(self):
+        locked = StripedCacheStorageLock({}, stripes=4)
+        self.assertTrue(locked._lock_for('a') is locked._lock_for('a'))
+        self.assertEqual(len(locked.locks), 4)
+        return
+
+
+class ReadWriteCacheStorageLockTest(LockWrapperTestMixin, HTTPTestBase):
+
+    wrapper = ReadWriteCacheStorageLock
+
+
+class ReadWriteLockTest(unittest.TestCase):
+
+    def testConcurrentReaders(self):
+        lock = ReadWriteLock()
+        lock.acquire_read()
+        acquired = threading.Event()
+
+        def read():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        t = threading.Thread(target=read)
+        t.start()
+        self.assertTrue(acquired.wait(1))
+        t.join()
+        lock.release_read()
+        return
+
+    def testWriterExcludesReaders(self):
+        lock = ReadWriteLock()
+        lock.acquire_write()
+        acquired = threading.Event()
+
+        def read():
+            lock.acquire_read()
+            acquired.set()
+            lock.release_read()
+
+        t = threading.Thread(target=read)
+        t.start()
+        self.assertFalse(acquired.wait(0.2))
+        lock.release_write()
+        self.assertTrue(acquired.wait(1))
+        t.join()
+        return
+
+
 if __name__ == '__main__':
     unittest.main()
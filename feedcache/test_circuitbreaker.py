@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.circuitbreaker
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import asyncio
+import unittest
+
+#
+# Import local modules
+#
+from . import cache
+from .asynccache import AsyncCache
+from .circuitbreaker import CircuitBreaker, CLOSED, HALF_OPEN, OPEN
+from .test_server import HTTPTestBase
+from .test_timeouts import TarpitHTTPServer
+
+#
+# Module
+#
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.breaker = CircuitBreaker(failureThreshold=3,
+                                      resetTimeoutSeconds=60)
+        return
+
+    def fail_host(self, host, count):
+        for i in range(count):
+            self.assertTrue(self.breaker.allow(host))
+            self.breaker.record_failure(host)
+        return
+
+    def expire(self, host):
+        "Pretend the reset timeout has passed for host."
+        self.breaker._hosts[host].opened_at -= 60
+        return
+
+    def testOpensAfterThreshold(self):
+        self.fail_host('a', 2)
+        self.assertEqual(self.breaker.get_state('a'), CLOSED)
+        self.fail_host('a', 1)
+        self.assertEqual(self.breaker.get_state('a'), OPEN)
+        self.assertFalse(self.breaker.allow('a'))
+        # Other hosts are not affected.
+        self.assertTrue(self.breaker.allow('b'))
+        stats = self.breaker.get_stats()
+        self.assertEqual(stats['opened'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['open'], 1)
+        self.assertEqual(self.breaker.get_states(), {'a': OPEN})
+        return
+
+    def testSuccessResetsCount(self):
+        self.fail_host('a', 2)
+        self.breaker.record_success('a')
+        self.fail_host('a', 2)
+        self.assertEqual(self.breaker.get_state('a'), CLOSED)
+        return
+
+    def testSingleProbe(self):
+        self.fail_host('a', 3)
+        self.expire('a')
+        self.assertTrue(self.breaker.allow('a'))
+        self.assertEqual(self.breaker.get_state('a'), HALF_OPEN)
+        self.assertFalse(self.breaker.allow('a'))
+        self.breaker.record_success('a')
+        self.assertEqual(self.breaker.get_state('a'), CLOSED)
+        self.assertTrue(self.breaker.allow('a'))
+        stats = self.breaker.get_stats()
+        self.assertEqual(stats['probes'], 1)
+        self.assertEqual(stats['half_opened'], 1)
+        self.assertEqual(stats['closed'], 1)
+        self.assertEqual(self.breaker.get_states(), {})
+        return
+
+    def testFailedProbeReopens(self):
+        self.fail_host('a', 3)
+        self.expire('a')
+        self.assertTrue(self.breaker.allow('a'))
+        self.breaker.record_failure('a')
+        self.assertEqual(self.breaker.get_state('a'), OPEN)
+        self.assertFalse(self.breaker.allow('a'))
+        self.assertEqual(self.breaker.get_stats()['opened'], 2)
+        return
+
+    def testCancelledProbe(self):
+        self.fail_host('a', 3)
+        self.expire('a')
+        self.assertTrue(self.breaker.allow('a'))
+        self.breaker.cancel('a')
+        self.assertTrue(self.breaker.allow('a'))
+        return
+
+
+class CacheCircuitBreakerTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.breaker = CircuitBreaker(failureThreshold=2,
+                                      resetTimeoutSeconds=60)
+        self.cache = cache.Cache({},
+                                 timeToLiveSeconds=0,
+                                 userAgent='feedcache.test',
+                                 circuitBreaker=self.breaker,
+                                 )
+        return
+
+    def testOpenServesCache(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.server.setResponse(500)
+        for i in range(2):
+            self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.breaker.get_states(), {'localhost:9999': OPEN})
+        self.assertEqual(self.server.getNumRequests(), 3)
+        # While open, the server is not contacted and the cached
+        # content is returned.
+        self.assertEqual(self.cache.fetch(self.TEST_URL), feed_data)
+        self.assertEqual(self.cache.fetch(self.TEST_URL + 'other'), None)
+        self.assertEqual(self.server.getNumRequests(), 3)
+        self.assertEqual(self.cache.get_stats()['circuit_open'], 2)
+        return
+
+    def testProbeCloses(self):
+        self.server.setResponse(500)
+        for i in range(2):
+            self.cache.fetch(self.TEST_URL)
+        self.server.setResponse(200)
+        self.breaker._hosts['localhost:9999'].opened_at -= 60
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.breaker.get_state('localhost:9999'), CLOSED)
+        self.assertEqual(self.server.getNumRequests(), 3)
+        return
+
+
+class AsyncCacheCircuitBreakerTest(HTTPTestBase):
+
+    def getServer(self):
+        return TarpitHTTPServer()
+
+    def testCancelledProbe(self):
+        # A probe cancelled while waiting for the server must not
+        # leave the host refused for good.
+        breaker = CircuitBreaker(failureThreshold=1)
+        c = AsyncCache({}, timeToLiveSeconds=0, circuitBreaker=breaker)
+        breaker.record_failure('localhost:9999')
+        breaker._hosts['localhost:9999'].opened_at -= 60
+        self.server.hang = 1
+        self.assertRaises(
+            asyncio.TimeoutError, asyncio.run,
+            asyncio.wait_for(c.fetch(self.TEST_URL), 0.2))
+        self.assertEqual(breaker.get_state('localhost:9999'), HALF_OPEN)
+        self.assertTrue(breaker.allow('localhost:9999'))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
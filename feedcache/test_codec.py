@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.codec
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import shutil
+import tempfile
+import time
+import unittest
+
+import feedparser
+
+#
+# Import local modules
+#
+from .codec import CompressedCodec, JSONCodec, MarshalCodec, PickleCodec
+from .logstorage import LogStorage
+from .shardedstorage import ShardedFileStorage
+from .splitstorage import SplitStorage
+from .sqlitestorage import SQLiteStorage
+from .test_server import TestHTTPHandler
+
+#
+# Module
+#
+
+
+class CodecTestMixin:
+
+    def setUp(self):
+        self.feed = feedparser.parse(TestHTTPHandler.FEED_DATA)
+        return
+
+    def round_trip(self, content):
+        data = self.codec.dumps(content)
+        self.assertTrue(isinstance(data, bytes))
+        return self.codec.loads(data)
+
+    def testRoundTrip(self):
+        loaded = self.round_trip(self.feed)
+        self.assertEqual(loaded, self.feed)
+        self.assertTrue(isinstance(loaded, feedparser.FeedParserDict))
+        self.assertEqual(loaded.feed.title, 'CacheTest test data')
+        entry = loaded.entries[0]
+        self.assertTrue(isinstance(entry, feedparser.FeedParserDict))
+        self.assertTrue(isinstance(entry.updated_parsed, time.struct_time))
+        self.assertEqual(entry.summary_detail.value, 'description goes here')
+        self.assertEqual(entry.description, 'description goes here')
+        return
+
+    def testLoadsBuffer(self):
+        data = memoryview(self.codec.dumps(self.feed))
+        self.assertEqual(self.codec.loads(data), self.feed)
+        return
+
+
+class PickleCodecTest(CodecTestMixin, unittest.TestCase):
+    codec = PickleCodec()
+
+
+class PlainCodecTestMixin(CodecTestMixin):
+
+    def testDetailValues(self):
+        # Only values which repeat the plain field are shared.
+        content = feedparser.FeedParserDict(
+            title='a',
+            title_detail={'type': 'text/plain', 'value': 'a'},
+            summary='b',
+            summary_detail={'type': 'text/plain', 'value': 'different'},
+            author_detail={'name': 'someone'},
+            author='someone',
+            )
+        self.assertEqual(self.round_trip(content), content)
+        return
+
+    def testOtherObjects(self):
+        content = {'bozo': 1, 'bozo_exception': ValueError('broken'),
+                   'tags': ('x', 'y')}
+        self.assertEqual(self.round_trip(content),
+                         {'bozo': 1, 'bozo_exception': 'broken',
+                          'tags': ['x', 'y']})
+        return
+
+    def testDetailValuesStoredOnce(self):
+        size = len(self.codec.dumps(self.feed))
+        entry = self.feed.entries[0]
+        entry['summary'] = entry['summary_detail']['value'] = 'x' * 1000
+        self.assertTrue(len(self.codec.dumps(self.feed)) < size + 1500)
+        return
+
+
+class MarshalCodecTest(PlainCodecTestMixin, unittest.TestCase):
+    codec = MarshalCodec()
+
+
+class JSONCodecTest(PlainCodecTestMixin, unittest.TestCase):
+    codec = JSONCodec()
+
+
+class CompressedCodecTest(CodecTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        CodecTestMixin.setUp(self)
+        self.codec = CompressedCodec(threshold=100)
+        return
+
+    def testCompresses(self):
+        entry = self.feed.entries[0]
+        entry['summary'] = entry['summary_detail']['value'] = 'x' * 10000
+        data = self.codec.dumps(self.feed)
+        self.assertTrue(data.startswith(b'z'))
+        self.assertTrue(len(data) < 2000)
+        stats = self.codec.get_stats()
+        self.assertEqual(stats['compressed'], 1)
+        self.assertTrue(stats['compression_ratio'] > 5)
+        self.assertTrue('compress_seconds' in stats)
+        self.codec.loads(data)
+        self.assertEqual(self.codec.get_stats()['decompressed'], 1)
+        return
+
+    def testThreshold(self):
+        data = self.codec.dumps({'title': 'small'})
+        self.assertTrue(data.startswith(b'-'))
+        self.assertEqual(self.codec.loads(data), {'title': 'small'})
+        self.assertEqual(self.codec.get_stats()['stored_raw'], 1)
+        self.assertFalse('decompressed' in self.codec.get_stats())
+        return
+
+    def testLZMA(self):
+        codec = CompressedCodec(MarshalCodec(), method='lzma', level=1,
+                                threshold=0)
+        data = codec.dumps(self.feed)
+        self.assertTrue(data.startswith(b'x'))
+        self.assertEqual(codec.loads(data), self.feed)
+        # Data written with one method can be read with another.
+        self.assertEqual(CompressedCodec(MarshalCodec()).loads(data),
+                         self.feed)
+        return
+
+    def testUnknownMethod(self):
+        self.assertRaises(ValueError, CompressedCodec, method='rar')
+        return
+
+
+class StorageCodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp('codec')
+        self.feed = feedparser.parse(TestHTTPHandler.FEED_DATA)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+        return
+
+    def check(self, storage):
+        try:
+            storage['a'] = (1, self.feed)
+            cached_time, loaded = storage['a']
+            self.assertEqual(loaded, self.feed)
+            self.assertEqual(storage.get_body('a'), self.feed)
+            self.assertEqual(storage.get_metadata('a')['etag'],
+                             self.feed.get('etag'))
+        finally:
+            storage.close()
+        return
+
+    def testSplitStorage(self):
+        storage = SplitStorage({}, {}, codec=JSONCodec())
+        self.check(storage)
+        self.assertTrue(storage.bodies['a'].startswith(b'{'))
+        return
+
+    def testSQLiteStorage(self):
+        self.check(SQLiteStorage(self.dirname + '/cache.db',
+                                 codec=MarshalCodec()))
+        return
+
+    def testLogStorage(self):
+        self.check(LogStorage(self.dirname, codec=MarshalCodec()))
+        return
+
+    def testCompressedLogStorage(self):
+        codec = CompressedCodec(threshold=0)
+        self.check(LogStorage(self.dirname, codec=codec))
+        self.assertEqual(codec.get_stats()['compressed'], 1)
+        return
+
+    def testShardedFileStorage(self):
+        self.check(ShardedFileStorage(self.dirname, codec=JSONCodec()))
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.filelockstorage
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import fcntl
+import multiprocessing
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+#
+# Import local modules
+#
+from .filelockstorage import FileLockedShelf, LockTimeout
+from .test_storage import StorageTestMixin
+
+#
+# Module
+#
+
+NUM_PROCESSES = 8
+KEYS_PER_PROCESS = 25
+
+
+def stress_worker(filename, worker):
+    """Write this worker's keys one at a time, reading back the keys
+    written by the others along the way.
+    """
+    storage = FileLockedShelf(filename)
+    for i in range(KEYS_PER_PROCESS):
+        key = 'http://example.com/%d/%d' % (worker, i)
+        storage[key] = (worker, i, 'x' * 1000)
+        other = 'http://example.com/%d/%d' % ((worker + 1) % NUM_PROCESSES, i)
+        value = storage.get(other)
+        if value is not None:
+            assert value[2] == 'x' * 1000, value
+    return
+
+
+class ReplacedLockShelf(FileLockedShelf):
+    """Shelf where another process breaks the stale lock and takes
+    the new one while this one is checking the old owner.
+    """
+
+    def _owner_is_gone(self, owner):
+        gone = FileLockedShelf._owner_is_gone(self, owner)
+        os.unlink(self.lock_filename)
+        self.holder = os.open(self.lock_filename, os.O_RDWR | os.O_CREAT)
+        os.write(self.holder, ('%s %d' % (socket.gethostname(), os.getpid())
+                               ).encode('ascii'))
+        return gone
+
+
+class FileLockedShelfTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp('filelockstorage')
+        self.filename = os.path.join(self.dirname, 'cache')
+        self.storage = FileLockedShelf(self.filename, lockTimeout=0.5)
+        return
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+        return
+
+
+class FileLockedShelfTest(StorageTestMixin, FileLockedShelfTestBase):
+
+    def testEmpty(self):
+        self.assertEqual(self.storage.get('a'), None)
+        self.assertEqual(len(self.storage), 0)
+        self.assertFalse('a' in self.storage)
+        self.assertRaises(KeyError, self.storage.__getitem__, 'a')
+        return
+
+    def testTouch(self):
+        self.storage['a'] = (1, 'data')
+        self.storage.touch('a', 2)
+        self.assertEqual(self.storage['a'], (2, 'data'))
+        self.assertRaises(KeyError, self.storage.touch, 'b', 2)
+        return
+
+
+class FileLockedShelfLockingTest(FileLockedShelfTestBase):
+
+    def _hold_lock(self, pid):
+        "Lock the shelf as though process pid were writing to it."
+        fd = os.open(self.storage.lock_filename, os.O_RDWR | os.O_CREAT)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.write(fd, ('%s %d' % (socket.gethostname(), pid)).encode('ascii'))
+        self.addCleanup(os.close, fd)
+        return
+
+    def testLockTimeout(self):
+        # A lock held by a live process is respected.
+        self._hold_lock(os.getpid())
+        self.assertRaises(LockTimeout, self.storage.__setitem__, 'a', 1)
+        return
+
+    def testStaleLock(self):
+        # A lock recorded for a process which is gone is broken.
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        self._hold_lock(child.pid)
+        self.storage['a'] = 1
+        self.assertEqual(self.storage['a'], 1)
+        return
+
+    def testStaleLockReplaced(self):
+        # A lock file replaced since its stale owner was read is left
+        # alone.
+        child = subprocess.Popen([sys.executable, '-c', 'pass'])
+        child.wait()
+        self._hold_lock(child.pid)
+        storage = ReplacedLockShelf(self.filename, lockTimeout=0.5)
+        self.assertTrue(storage._break_stale_lock())
+        self.addCleanup(os.close, storage.holder)
+        self.assertTrue(os.path.exists(self.storage.lock_filename))
+        self.assertTrue(storage._is_current(storage.holder))
+        return
+
+
+class FileLockedShelfStressTest(FileLockedShelfTestBase):
+
+    def test(self):
+        # Many processes writing and reading the same shelf at
+        # once should not lose or damage any data.
+        processes = [multiprocessing.Process(target=stress_worker,
+                                             args=(self.filename, n))
+                     for n in range(NUM_PROCESSES)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+            self.assertEqual(p.exitcode, 0)
+
+        values = self.storage.get_many(self.storage.keys())
+        self.assertEqual(len(values), NUM_PROCESSES * KEYS_PER_PROCESS)
+        for key, (worker, i, data) in values.items():
+            self.assertEqual(key, 'http://example.com/%d/%d' % (worker, i))
+            self.assertEqual(data, 'x' * 1000)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
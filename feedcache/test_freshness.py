@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.freshness
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import unittest
+
+#
+# Import local modules
+#
+from . import freshness
+
+#
+# Module
+#
+
+NOW = 1333916208  # Sun, 08 Apr 2012 20:16:48 GMT
+
+
+class CacheControlTest(unittest.TestCase):
+
+    def testParse(self):
+        directives = freshness.parse_cache_control(
+            'public, Max-Age=3600, no-transform, private="x"')
+        self.assertEqual(directives, {'public': None,
+                                      'max-age': '3600',
+                                      'no-transform': None,
+                                      'private': 'x',
+                                      })
+        return
+
+
+class FreshnessLifetimeTest(unittest.TestCase):
+
+    def testNoHeaders(self):
+        self.assertEqual(freshness.freshness_lifetime({}, NOW), None)
+        return
+
+    def testMaxAge(self):
+        headers = {'cache-control': 'max-age=3600'}
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 3600)
+        return
+
+    def testSharedMaxAgePreferred(self):
+        headers = {'cache-control': 'max-age=3600, s-maxage=60',
+                   'expires': 'Sun, 08 Apr 2012 22:16:48 GMT',
+                   }
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 60)
+        return
+
+    def testNoCache(self):
+        headers = {'cache-control': 'no-cache, max-age=3600'}
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 0)
+        return
+
+    def testExpiresRelativeToDate(self):
+        headers = {'expires': 'Sun, 08 Apr 2012 21:16:48 GMT',
+                   'date': 'Sun, 08 Apr 2012 20:46:48 GMT',
+                   }
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 1800)
+        return
+
+    def testExpiresWithoutDate(self):
+        headers = {'expires': 'Sun, 08 Apr 2012 21:16:48 GMT'}
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 3600)
+        return
+
+    def testInvalidExpires(self):
+        headers = {'expires': '0'}
+        self.assertEqual(freshness.freshness_lifetime(headers, NOW), 0)
+        return
+
+
+class StoredLifetimeTest(unittest.TestCase):
+
+    def testHeaders(self):
+        content = {'headers': {'cache-control': 'max-age=60'}}
+        self.assertEqual(freshness.stored_lifetime(content, NOW), 60)
+        return
+
+    def testExpiresWithoutDate(self):
+        # The time the feed was stored stands in for the Date header.
+        content = {'headers': {'expires': 'Sun, 08 Apr 2012 20:26:48 GMT'}}
+        self.assertEqual(freshness.stored_lifetime(content, NOW), 600)
+        return
+
+    def testNoHeaders(self):
+        self.assertEqual(freshness.stored_lifetime({}, NOW), None)
+        self.assertEqual(freshness.stored_lifetime(None, NOW), None)
+        return
+
+
+class RetryAfterTest(unittest.TestCase):
+
+    def testSeconds(self):
+        headers = {'retry-after': '120'}
+        self.assertEqual(freshness.retry_after(headers, NOW), NOW + 120)
+        return
+
+    def testDate(self):
+        headers = {'retry-after': 'Sun, 08 Apr 2012 20:26:48 GMT'}
+        self.assertEqual(freshness.retry_after(headers, NOW), NOW + 600)
+        return
+
+    def testMissing(self):
+        self.assertEqual(freshness.retry_after({}, NOW), None)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.logstorage
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import glob
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .cache import Cache
+from . import logstorage
+from .logstorage import LogStorage
+from .test_server import HTTPTestBase
+from .test_storage import MetadataStorageTestMixin
+
+#
+# Module
+#
+
+
+class LogStorageTest(MetadataStorageTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp('logstorage')
+        self.storage = self.open()
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        return
+
+    def open(self, **kwds):
+        kwds.setdefault('backgroundCompaction', False)
+        return LogStorage(self.dirname, **kwds)
+
+    def reopen(self, **kwds):
+        self.storage.close()
+        self.storage = self.open(**kwds)
+        return self.storage
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.dirname, '*.log')))
+
+    def testRewritesAppend(self):
+        self.storage['a'] = (1, 'x' * 100)
+        size = os.path.getsize(self.segments()[0])
+        self.storage['a'] = (2, 'x' * 100)
+        self.assertTrue(os.path.getsize(self.segments()[0]) > size)
+        self.assertEqual(self.storage['a'], (2, 'x' * 100))
+        return
+
+    def testTouch(self):
+        self.storage['a'] = (1, 'x' * 1000)
+        size = os.path.getsize(self.segments()[0])
+        self.storage.touch('a', 2)
+        self.assertTrue(os.path.getsize(self.segments()[0]) < size + 100)
+        self.assertEqual(self.storage['a'], (2, 'x' * 1000))
+        self.assertEqual(self.storage.get_metadata('a')['cached_time'], 2)
+        self.assertRaises(KeyError, self.storage.touch, 'b', 2)
+        self.reopen()
+        self.assertEqual(self.storage['a'], (2, 'x' * 1000))
+        return
+
+    def testTouchAndCompact(self):
+        storage = self.reopen(segmentBytes=1024)
+        for i in range(20):
+            storage['key%d' % i] = (i, 'x' * 100)
+        for i in range(20):
+            storage.touch('key%d' % i, 100 + i)
+        storage.compact()
+        self.assertEqual(storage['key3'], (103, 'x' * 100))
+        self.reopen(segmentBytes=1024)
+        self.assertEqual(self.storage['key3'], (103, 'x' * 100))
+        self.assertEqual(self.storage['key19'], (119, 'x' * 100))
+        return
+
+    def testReopenWithHints(self):
+        self.storage['a'] = (1, 'one')
+        self.storage['b'] = (2, 'two')
+        del self.storage['b']
+        self.reopen()
+        self.assertEqual(self.storage.keys(), ['a'])
+        self.assertEqual(self.storage['a'], (1, 'one'))
+        return
+
+    def testOlderFormat(self):
+        # Records and hints written before the lifetime was saved can
+        # still be read.
+        with self.storage._lock:
+            self.storage._append(logstorage.PUT, 'a', 1,
+                                 pickle.dumps(('abc', 'today')),
+                                 self.storage.codec.dumps('one'))
+        self.storage.close()
+        for hint in glob.glob(os.path.join(self.dirname, '*.hint')):
+            with open(hint, 'rb') as f:
+                token, size, entries = pickle.load(f)
+            entries = [entry[:5] + entry[6:] for entry in entries]
+            with open(hint, 'wb') as f:
+                pickle.dump((token, size, entries), f)
+        self.storage = self.open()
+        self.assertEqual(self.storage['a'], (1, 'one'))
+        metadata = self.storage.get_metadata('a')
+        self.assertEqual(metadata['etag'], 'abc')
+        self.assertEqual(metadata['lifetime'], None)
+        return
+
+    def testReopenWithoutHints(self):
+        self.storage['a'] = (1, 'one')
+        self.storage['b'] = (2, 'two')
+        del self.storage['b']
+        self.storage.close()
+        for hint in glob.glob(os.path.join(self.dirname, '*.hint')):
+            os.unlink(hint)
+        self.storage = self.open()
+        self.assertEqual(self.storage.keys(), ['a'])
+        self.assertEqual(self.storage['a'], (1, 'one'))
+        return
+
+    def testTornWrite(self):
+        self.storage['a'] = (1, 'one')
+        self.storage['b'] = (2, 'two')
+        self.storage.close()
+        for hint in glob.glob(os.path.join(self.dirname, '*.hint')):
+            os.unlink(hint)
+        segment = self.segments()[-1]
+        with open(segment, 'r+b') as f:
+            f.truncate(os.path.getsize(segment) - 3)
+        self.storage = self.open()
+        self.assertEqual(self.storage.keys(), ['a'])
+        self.storage['c'] = (3, 'three')
+        self.reopen()
+        self.assertEqual(sorted(self.storage.keys()), ['a', 'c'])
+        return
+
+    def testSegments(self):
+        storage = self.reopen(segmentBytes=1024)
+        for i in range(50):
+            storage['key%d' % i] = (i, 'x' * 100)
+        self.assertTrue(len(self.segments()) > 1)
+        self.reopen(segmentBytes=1024)
+        self.assertEqual(len(self.storage), 50)
+        self.assertEqual(self.storage['key7'], (7, 'x' * 100))
+        return
+
+    def testCompact(self):
+        storage = self.reopen(segmentBytes=1024)
+        for n in range(5):
+            for i in range(10):
+                storage['key%d' % i] = (n, 'x' * 100)
+        del storage['key0']
+        self.assertTrue(storage.garbage_ratio() > 0.5)
+        before = len(self.segments())
+        self.assertTrue(storage.compact() > 0)
+        self.assertTrue(len(self.segments()) < before)
+        self.assertEqual(storage.garbage_ratio(), 0.0)
+        self.assertEqual(len(storage), 9)
+        self.assertEqual(storage['key5'], (4, 'x' * 100))
+        self.reopen(segmentBytes=1024)
+        self.assertEqual(len(self.storage), 9)
+        self.assertFalse('key0' in self.storage)
+        self.assertEqual(self.storage['key5'], (4, 'x' * 100))
+        return
+
+    def testReadDuringCompaction(self):
+        # Reads of a live key must not fail while compaction moves it
+        # to a new segment.
+        storage = self.reopen(segmentBytes=1024)
+        storage['k'] = (1, 'x' * 100)
+        errors = []
+        done = threading.Event()
+
+        def read():
+            try:
+                while not done.is_set():
+                    storage['k']
+                    storage.get_body('k')
+                    storage.get_many(['k'])
+            except Exception as err:
+                errors.append(err)
+
+        t = threading.Thread(target=read)
+        t.start()
+        try:
+            for n in range(200):
+                for i in range(10):
+                    storage['other%d' % i] = (n, 'y' * 100)
+                storage.compact()
+        finally:
+            done.set()
+            t.join()
+        self.assertEqual(errors, [])
+        return
+
+    def testBackgroundCompaction(self):
+        storage = self.reopen(segmentBytes=1024, backgroundCompaction=True)
+        for n in range(10):
+            for i in range(5):
+                storage['key%d' % i] = (n, 'x' * 100)
+        deadline = time.time() + 5
+        while storage.garbage_ratio() >= 0.5 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(storage.garbage_ratio() < 0.5)
+        self.assertEqual(storage['key3'], (9, 'x' * 100))
+        return
+
+
+class CacheLogStorageTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.dirname = tempfile.mkdtemp('logstorage')
+        self.storage = LogStorage(self.dirname)
+        self.cache = Cache(self.storage, timeToLiveSeconds=30)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        HTTPTestBase.tearDown(self)
+        return
+
+    def testFetch(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data2.feed.title, 'CacheTest test data')
+        self.assertEqual(feed_data, feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
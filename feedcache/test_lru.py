@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.lru
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import unittest
+
+#
+# Import local modules
+#
+from .lru import LRUCache, approximate_size
+
+#
+# Module
+#
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def testEntryLimit(self):
+        lru = LRUCache(maxEntries=2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.put('c', 3)
+        self.assertEqual(len(lru), 2)
+        self.assertEqual(lru.get('a'), None)
+        self.assertEqual(lru.get('c'), 3)
+        return
+
+    def testRecentlyUsedKept(self):
+        lru = LRUCache(maxEntries=2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.get('a')
+        lru.put('c', 3)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('b'), None)
+        return
+
+    def testByteLimit(self):
+        lru = LRUCache(maxEntries=None, maxBytes=10, sizeof=len)
+        lru.put('a', 'xxxx')
+        lru.put('b', 'xxxx')
+        self.assertEqual(lru.size, 8)
+        lru.put('c', 'xxxx')
+        self.assertEqual(lru.size, 8)
+        self.assertFalse('a' in lru)
+        # Values larger than the limit are not kept.
+        lru.put('d', 'x' * 11)
+        self.assertFalse('d' in lru)
+        self.assertEqual(len(lru), 2)
+        return
+
+    def testReplace(self):
+        lru = LRUCache(maxBytes=100, sizeof=len)
+        lru.put('a', 'xxxx')
+        lru.put('a', 'xx')
+        self.assertEqual(lru.size, 2)
+        lru.discard('a')
+        self.assertEqual(lru.size, 0)
+        return
+
+    def testApproximateSize(self):
+        small = approximate_size({'a': 'x'})
+        large = approximate_size({'a': 'x' * 1000, 'b': ['y' * 1000]})
+        self.assertTrue(large > small + 2000)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.ratelimit
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from . import cache
+from .ratelimit import RateLimited, RateLimiter, TokenBucket
+from .test_server import HTTPTestBase
+
+#
+# Module
+#
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def testBurst(self):
+        bucket = TokenBucket(1, burst=2)
+        now = bucket.updated
+        for i in range(2):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.delay(now), 1.0)
+        return
+
+    def testRefill(self):
+        bucket = TokenBucket(10, burst=1)
+        now = bucket.updated
+        bucket.take()
+        self.assertAlmostEqual(bucket.delay(now), 0.1)
+        self.assertAlmostEqual(bucket.delay(now + 0.05), 0.05)
+        self.assertEqual(bucket.delay(now + 0.1), 0)
+        # Idle time does not build up more than burst tokens.
+        self.assertEqual(bucket.delay(now + 60), 0)
+        self.assertEqual(bucket.tokens, 1)
+        return
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def testUnlimited(self):
+        limiter = RateLimiter()
+        for i in range(100):
+            self.assertEqual(limiter.try_acquire('example.com'), 0)
+        self.assertEqual(limiter.get_stats()['connections'], 100)
+        return
+
+    def testPerHostRate(self):
+        limiter = RateLimiter(perHostRate=1)
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        delay = limiter.try_acquire('a')
+        self.assertTrue(0 < delay <= 1, delay)
+        # Other hosts have their own bucket.
+        self.assertEqual(limiter.try_acquire('b'), 0)
+        stats = limiter.get_stats()
+        self.assertEqual(stats['granted'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        return
+
+    def testGlobalRate(self):
+        limiter = RateLimiter(globalRate=1, globalBurst=2)
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        self.assertEqual(limiter.try_acquire('b'), 0)
+        self.assertTrue(limiter.try_acquire('c') > 0)
+        return
+
+    def testRefusalTakesNoTokens(self):
+        # A request refused by the global bucket must not use up the
+        # host's token.
+        limiter = RateLimiter(perHostRate=1, globalRate=1)
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        self.assertTrue(limiter.try_acquire('b') > 0)
+        self.assertEqual(limiter._bucket('b').tokens, 1)
+        return
+
+    def testConnectionLimit(self):
+        limiter = RateLimiter(maxConnectionsPerHost=2)
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        self.assertEqual(limiter.try_acquire('a'), None)
+        self.assertEqual(limiter.try_acquire('b'), 0)
+        limiter.release('a')
+        self.assertEqual(limiter.try_acquire('a'), 0)
+        self.assertEqual(limiter.get_stats()['connection_limited'], 1)
+        return
+
+    def testAcquireWaitsForRelease(self):
+        limiter = RateLimiter(maxConnectionsPerHost=1)
+        limiter.acquire('a')
+        acquired = threading.Event()
+
+        def worker():
+            limiter.acquire('a')
+            acquired.set()
+
+        t = threading.Thread(target=worker)
+        t.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release('a')
+        self.assertTrue(acquired.wait(5))
+        t.join()
+        return
+
+    def testAcquireWaitsForToken(self):
+        limiter = RateLimiter(perHostRate=10)
+        start = time.monotonic()
+        for i in range(3):
+            limiter.acquire('a')
+            limiter.release('a')
+        self.assertTrue(time.monotonic() - start >= 0.15)
+        self.assertTrue(limiter.get_stats()['wait_seconds'] > 0)
+        return
+
+
+class CacheRateLimitTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.limiter = RateLimiter(perHostRate=5)
+        self.cache = cache.Cache({},
+                                 timeToLiveSeconds=30,
+                                 userAgent='feedcache.test',
+                                 rateLimiter=self.limiter,
+                                 )
+        return
+
+    def testFetchWaits(self):
+        start = time.monotonic()
+        self.cache.fetch(self.TEST_URL + 'feed0')
+        self.cache.fetch(self.TEST_URL + 'feed1')
+        self.assertTrue(time.monotonic() - start >= 0.15)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        self.assertEqual(self.limiter.get_stats()['connections'], 0)
+        return
+
+    def testFetchNoBlock(self):
+        self.cache.fetch(self.TEST_URL + 'feed0')
+        self.assertRaises(RateLimited, self.cache.fetch,
+                          self.TEST_URL + 'feed1', block=False)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        self.assertEqual(self.cache.get_stats()['rate_limited'], 1)
+        return
+
+    def testFetchManyDoesNotHoldWorkers(self):
+        # While the requests for the first host wait for the limiter,
+        # the only worker thread is free to fetch from the other.
+        urls = [self.TEST_URL + 'feed%d' % i for i in range(3)]
+        other = self.TEST_URL.replace('localhost', '127.0.0.1') + 'other'
+        results = list(self.cache.fetch_many(urls + [other], max_workers=1))
+        fetched = [url for url, data in results]
+        self.assertEqual(sorted(fetched), sorted(urls + [other]))
+        self.assertTrue(fetched.index(other) < 3, fetched)
+        for url, data in results:
+            self.assertEqual(data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.server.getNumRequests(), 4)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
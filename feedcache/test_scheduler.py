@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.scheduler
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .cache import Cache, FailureRecord
+from .ratelimit import RateLimited
+from .scheduler import Scheduler
+from .test_server import HTTPTestBase
+
+#
+# Module
+#
+
+
+class FakeCache:
+    "Stands in for a Cache, recording the feeds fetched."
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.fetched = []
+        self.expirations = {}
+        self.failures = {}
+        self.event = threading.Event()
+        return
+
+    def fetch(self, url, block=True):
+        self.fetched.append((url, time.time()))
+        self.expirations[url] = time.time() + self.ttl
+        self.event.set()
+        if url == 'broken':
+            raise ValueError('broken feed')
+        return url
+
+    def get_expiration(self, url):
+        return self.expirations.get(url)
+
+    def get_failure(self, url):
+        return self.failures.get(url)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = FakeCache()
+        self.scheduler = Scheduler(self.cache, maxWorkers=2, jitter=0,
+                                   minIntervalSeconds=0)
+        return
+
+    def tearDown(self):
+        self.scheduler.stop()
+        return
+
+    def wait_for(self, count, timeout=5):
+        deadline = time.time() + timeout
+        while len(self.cache.fetched) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return
+
+    def testDueOrder(self):
+        now = time.time()
+        self.scheduler.add('b', now + 0.2)
+        self.scheduler.add('a', now + 0.1)
+        self.scheduler.add('c', now - 1)
+        self.assertEqual(self.scheduler.next_due(), now - 1)
+        self.scheduler.start()
+        self.wait_for(3)
+        self.assertEqual([url for url, when in self.cache.fetched],
+                         ['c', 'a', 'b'])
+        for (url, when), due in zip(self.cache.fetched,
+                                    (now, now + 0.1, now + 0.2)):
+            self.assertTrue(when >= due)
+        return
+
+    def testRescheduledAtExpiration(self):
+        self.scheduler.add('a', time.time())
+        self.scheduler.start()
+        self.wait_for(1)
+        deadline = time.time() + 5
+        while (self.scheduler.next_due('a') is None
+               and time.time() < deadline):
+            time.sleep(0.01)
+        self.assertEqual(self.scheduler.next_due('a'),
+                         self.cache.expirations['a'])
+        self.assertEqual(len(self.cache.fetched), 1)
+        return
+
+    def testBackoff(self):
+        record = FailureRecord()
+        record.next_attempt = time.time() + 1000
+        self.cache.failures['a'] = record
+        self.scheduler._due['a'] = None
+        self.scheduler._fetch('a')
+        self.assertEqual(self.scheduler.next_due('a'), record.next_attempt)
+        return
+
+    def testRateLimited(self):
+        # A fetch turned away by the rate limiter is retried when the
+        # limiter says, without counting an error or calling back.
+        calls = []
+
+        def fetch(url, block=True):
+            raise RateLimited('example.com', 30)
+
+        self.cache.fetch = fetch
+        self.scheduler.callback = lambda *args: calls.append(args)
+        self.scheduler._due['a'] = None
+        now = time.time()
+        self.scheduler._fetch('a')
+        self.assertTrue(now + 30 <= self.scheduler.next_due('a')
+                        <= time.time() + 30)
+        stats = self.scheduler.get_stats()
+        self.assertEqual(stats['rate_limited'], 1)
+        self.assertFalse('errors' in stats)
+        self.assertEqual(calls, [])
+        return
+
+    def testReaddWhileRunning(self):
+        # A feed removed and added again during its fetch is still
+        # scheduled afterwards.
+        gate = threading.Event()
+        started = threading.Event()
+
+        def fetch(url, block=True):
+            started.set()
+            gate.wait(5)
+            return FakeCache.fetch(self.cache, url)
+
+        self.cache.fetch = fetch
+        self.scheduler.add('u', time.time())
+        self.scheduler.start()
+        self.assertTrue(started.wait(5))
+        self.scheduler.remove('u')
+        self.scheduler.add('u')
+        gate.set()
+        self.wait_for(1)
+        deadline = time.time() + 5
+        while (self.scheduler.next_due('u') is None
+               and time.time() < deadline):
+            time.sleep(0.01)
+        self.assertTrue('u' in self.scheduler)
+        self.assertEqual(self.scheduler.next_due('u'),
+                         self.cache.expirations['u'])
+        return
+
+    def testJitterNeverEarly(self):
+        scheduler = Scheduler(self.cache, jitter=0.5, minIntervalSeconds=0)
+        now = time.time()
+        self.cache.expirations['a'] = now + 100
+        for i in range(100):
+            due = scheduler._next_time('a', now)
+            self.assertTrue(now + 100 <= due <= now + 150)
+        return
+
+    def testInitialSpread(self):
+        scheduler = Scheduler(self.cache, initialSpreadSeconds=100)
+        now = time.time()
+        scheduler.add_many('feed%d' % i for i in range(100))
+        dues = [scheduler.next_due('feed%d' % i) for i in range(100)]
+        self.assertTrue(min(dues) >= now)
+        self.assertTrue(max(dues) <= now + 101)
+        self.assertTrue(max(dues) - min(dues) > 50)
+        return
+
+    def testRemove(self):
+        self.scheduler.add('a', time.time() + 0.05)
+        self.scheduler.add('b', time.time() + 0.1)
+        self.scheduler.remove('a')
+        self.assertFalse('a' in self.scheduler)
+        self.scheduler.start()
+        self.wait_for(1)
+        time.sleep(0.1)
+        self.assertEqual([url for url, when in self.cache.fetched], ['b'])
+        return
+
+    def testWorkerLimit(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def fetch(url, block=True):
+            with lock:
+                active.append(url)
+                peak.append(len(active))
+            time.sleep(0.05)
+            with lock:
+                active.remove(url)
+            FakeCache.fetch(self.cache, url)
+
+        self.cache.fetch = fetch
+        for i in range(6):
+            self.scheduler.add('feed%d' % i, time.time())
+        self.scheduler.start()
+        self.wait_for(6)
+        self.assertEqual(max(peak), 2)
+        return
+
+    def testErrorsAndCallback(self):
+        results = []
+        self.scheduler.callback = lambda *args: results.append(args)
+        self.scheduler.add('broken', time.time())
+        self.scheduler.add('ok', time.time())
+        self.scheduler.start()
+        self.wait_for(2)
+        deadline = time.time() + 5
+        while len(results) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        results = dict((url, (result, error))
+                       for url, result, error in results)
+        self.assertEqual(results['ok'], ('ok', None))
+        self.assertTrue(isinstance(results['broken'][1], ValueError))
+        self.assertEqual(self.scheduler.get_stats()['errors'], 1)
+        # A broken feed stays scheduled.
+        self.assertTrue('broken' in self.scheduler)
+        return
+
+    def testManyFeeds(self):
+        scheduler = Scheduler(self.cache, initialSpreadSeconds=3600)
+        start = time.perf_counter()
+        scheduler.add_many('http://example.com/%d' % i
+                           for i in range(100000))
+        for i in range(0, 100000, 2):
+            scheduler.add('http://example.com/%d' % i, time.time() + 7200)
+        self.assertTrue(time.perf_counter() - start < 10)
+        self.assertEqual(len(scheduler), 100000)
+        self.assertTrue(len(scheduler._heap) <= 2 * 100000 + 1000)
+        return
+
+
+class SchedulerCacheTest(HTTPTestBase):
+
+    def testFetchThroughCache(self):
+        cache = Cache({}, timeToLiveSeconds=60)
+        fetched = threading.Event()
+        scheduler = Scheduler(cache, callback=lambda *args: fetched.set())
+        scheduler.add(self.TEST_URL, time.time())
+        scheduler.start()
+        try:
+            self.assertTrue(fetched.wait(5))
+        finally:
+            scheduler.stop()
+        self.assertEqual(self.server.getNumRequests(), 1)
+        due = scheduler.next_due(self.TEST_URL)
+        expiration = cache.get_expiration(self.TEST_URL)
+        self.assertTrue(expiration <= due <= expiration + 6)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -35,6 +35,7 @@ __module_id__ = "$Id$"
 import http.server
 import logging
 from hashlib import md5
+import socketserver
 import threading
 import time
 import unittest
@@ -101,6 +102,8 @@ class TestHTTPHandler(http.server.BaseHTTPRequestHandler):
             logger.debug('Stopping server')
             self.server.stop()
             self.send_response(200)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
 
         else:
             # Record the request for tests that count them
@@ -122,6 +125,8 @@ class TestHTTPHandler(http.server.BaseHTTPRequestHandler):
         logger.debug('redirecting to %s', new_path)
         self.send_response(self.server.response)
         self.send_header('Location', new_path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
         return
 
     do_GET_301 = do_GET_3xx
@@ -129,6 +134,25 @@ class TestHTTPHandler(http.server.BaseHTTPRequestHandler):
     do_GET_303 = do_GET_3xx
     do_GET_307 = do_GET_3xx
 
+    def do_GET_error(self):
+        "Report an error"
+        logger.debug('Response %d', self.server.response)
+        self.send_response(self.server.response)
+        self.send_extra_headers()
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+
+    do_GET_429 = do_GET_error
+    do_GET_500 = do_GET_error
+    do_GET_503 = do_GET_error
+
+    def send_extra_headers(self):
+        "Send any additional headers the test asked for."
+        for name, value in self.server.extra_headers.items():
+            self.send_header(name, value)
+        return
+
     def do_GET_200(self):
         logger.debug('Etag: %s' % self.ETAG)
         logger.debug('Last-Modified: %s' % self.MODIFIED_TIME)
@@ -146,11 +170,15 @@ class TestHTTPHandler(http.server.BaseHTTPRequestHandler):
             if incoming_etag == self.ETAG:
                 logger.debug('Response 304, etag')
                 self.send_response(304)
+                self.send_extra_headers()
+                self.end_headers()
                 send_data = False
 
             elif incoming_modified == self.MODIFIED_TIME:
                 logger.debug('Response 304, modified time')
                 self.send_response(304)
+                self.send_extra_headers()
+                self.end_headers()
                 send_data = False
 
         # Now optionally send the data, if the client needs it
@@ -166,10 +194,14 @@ class TestHTTPHandler(http.server.BaseHTTPRequestHandler):
             logger.debug('Outgoing modified time: %s' % self.MODIFIED_TIME)
             self.send_header('Last-Modified', self.MODIFIED_TIME)
 
+            data = self.FEED_DATA.encode('utf-8')
+            self.send_header('Content-Length', str(len(data)))
+
+            self.send_extra_headers()
             self.end_headers()
 
             logger.debug('Sending data')
-            self.wfile.write(self.FEED_DATA.encode('utf-8'))
+            self.wfile.write(data)
         return
 
 
@@ -182,6 +214,8 @@ class TestHTTPServer(http.server.HTTPServer):
         self.apply_modified_headers = applyModifiedHeaders
         self.keep_serving = True
         self.requests = []
+        # Additional headers to include in responses.
+        self.extra_headers = {}
         self.setResponse(200)
         http.server.HTTPServer.__init__(self, ('', 9999), handler)
         return
@@ -211,6 +245,33 @@ class TestHTTPServer(http.server.HTTPServer):
         return
 
 
+class KeepAliveHTTPHandler(TestHTTPHandler):
+    "Request handler which keeps the connection open between requests."
+
+    protocol_version = 'HTTP/1.1'
+
+    # The headers and body are written separately, so with Nagle's
+    # algorithm the body waits for the client's delayed ACK.
+    disable_nagle_algorithm = True
+
+
+class KeepAliveHTTPServer(socketserver.ThreadingMixIn, TestHTTPServer):
+    """Test server which handles each connection in its own thread,
+    so idle keep-alive connections do not block the others.
+    """
+
+    daemon_threads = True
+
+    # Return from handle_request() now and then, so serve_forever()
+    # notices when another thread has stopped the server.
+    timeout = 0.1
+
+    def __init__(self, applyModifiedHeaders=True,
+                 handler=KeepAliveHTTPHandler):
+        TestHTTPServer.__init__(self, applyModifiedHeaders, handler)
+        return
+
+
 class HTTPTestBase(unittest.TestCase):
     "Base class for tests that use a TestHTTPServer"
 
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.shardedstorage
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .cache import Cache
+from . import shardedstorage
+from .shardedstorage import ShardedFileStorage
+from .test_server import HTTPTestBase
+from .test_storage import MetadataStorageTestMixin
+
+#
+# Module
+#
+
+
+class RacingStorage(ShardedFileStorage):
+    """Storage which removes the key being written from another
+    thread, after its file is written.
+    """
+
+    def _write_feed(self, key, value):
+        ShardedFileStorage._write_feed(self, key, value)
+        t = threading.Thread(target=self.delete_many, args=([key],))
+        t.start()
+        # The removal waits for the write to finish.
+        t.join(0.2)
+        self.remover = t
+        return
+
+
+class ShardedFileStorageTest(MetadataStorageTestMixin, unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp('shardedstorage')
+        self.storage = ShardedFileStorage(self.dirname)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        return
+
+    def manifest_lines(self):
+        with open(os.path.join(self.dirname, 'manifest')) as f:
+            return f.readlines()
+
+    def testLayout(self):
+        self.storage['http://example.com/feed'] = (1, None)
+        path = self.storage._path('http://example.com/feed')
+        self.assertTrue(os.path.exists(path))
+        relative = os.path.relpath(path, self.dirname).split(os.sep)
+        self.assertEqual(len(relative), 3)
+        self.assertEqual(relative[0] + relative[1], relative[2][:4])
+        self.assertEqual([name for name in os.listdir(os.path.dirname(path))
+                          if name.endswith('.tmp')], [])
+        return
+
+    def testTouch(self):
+        self.storage['a'] = (1, {'etag': 'abc'})
+        path = self.storage._path('a')
+        inode = os.stat(path).st_ino
+        self.storage.touch('a', 2)
+        self.assertEqual(self.storage['a'], (2, {'etag': 'abc'}))
+        self.assertEqual(self.storage.get_metadata('a')['cached_time'], 2)
+        # The file was changed in place, not replaced.
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertRaises(KeyError, self.storage.touch, 'b', 2)
+        return
+
+    def testManifest(self):
+        self.storage['a'] = (1, None)
+        self.storage['a'] = (2, None)
+        self.storage['b'] = (1, None)
+        del self.storage['b']
+        self.assertEqual(len(self.manifest_lines()), 3)
+        storage = ShardedFileStorage(self.dirname)
+        self.assertEqual(storage.keys(), ['a'])
+        self.storage.close()
+        self.assertEqual(self.manifest_lines(), ['+"a"\n'])
+        return
+
+    def testRebuildManifest(self):
+        self.storage.set_many({'a': (1, None), 'b': (2, None)})
+        os.unlink(os.path.join(self.dirname, 'manifest'))
+        storage = ShardedFileStorage(self.dirname)
+        self.assertEqual(sorted(storage.keys()), ['a', 'b'])
+        return
+
+    def testTornManifest(self):
+        self.storage['a'] = (1, None)
+        self.storage['b'] = (1, None)
+        self.storage.close()
+        # Tear the line for 'b' and add one for a key with no file.
+        path = os.path.join(self.dirname, 'manifest')
+        with open(path) as f:
+            lines = f.readlines()
+        with open(path, 'w') as f:
+            f.writelines(line for line in lines if '"b"' not in line)
+            f.write('+"c"\n+"b')
+        storage = ShardedFileStorage(self.dirname)
+        # The feed files decide.
+        self.assertEqual(sorted(storage.keys()), ['a', 'b'])
+        # Later appends start on a line of their own.
+        storage['d'] = (1, None)
+        storage = ShardedFileStorage(self.dirname)
+        self.assertEqual(sorted(storage.keys()), ['a', 'b', 'd'])
+        return
+
+    def testDamagedManifest(self):
+        self.storage['a'] = (1, None)
+        with open(os.path.join(self.dirname, 'manifest'), 'a') as f:
+            f.write('+"b" junk\n')
+        storage = ShardedFileStorage(self.dirname)
+        self.assertEqual(storage.keys(), ['a'])
+        return
+
+    def testUndecodableManifest(self):
+        self.storage['a'] = (1, None)
+        with open(os.path.join(self.dirname, 'manifest'), 'ab') as f:
+            f.write(b'+"b\xff"\n')
+        storage = ShardedFileStorage(self.dirname)
+        self.assertEqual(storage.keys(), ['a'])
+        return
+
+    def testWriteRacingRemove(self):
+        # The file and the manifest entry stay in step.
+        storage = RacingStorage(os.path.join(self.dirname, 'racing'))
+        storage['a'] = (1, None)
+        storage.remover.join()
+        self.assertEqual(os.path.exists(storage._path('a')),
+                         'a' in storage)
+        return
+
+    def testStaleTemps(self):
+        self.storage['a'] = (1, None)
+        shard = os.path.dirname(self.storage._path('a'))
+        old = os.path.join(shard, 'old.tmp')
+        new = os.path.join(shard, 'new.tmp')
+        top = os.path.join(self.dirname, 'manifest.old.tmp')
+        for path in (old, new, top):
+            with open(path, 'w') as f:
+                f.write('partial')
+        stale = time.time() - 2 * shardedstorage.STALE_TEMP_SECONDS
+        os.utime(old, (stale, stale))
+        os.utime(top, (stale, stale))
+        ShardedFileStorage(self.dirname)
+        self.assertFalse(os.path.exists(top))
+        self.storage.rebuild_manifest()
+        self.assertFalse(os.path.exists(old))
+        # It may still be being written.
+        self.assertTrue(os.path.exists(new))
+        self.assertEqual(self.storage.keys(), ['a'])
+        return
+
+
+class CacheShardedFileStorageTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.dirname = tempfile.mkdtemp('shardedstorage')
+        self.storage = ShardedFileStorage(self.dirname)
+        self.cache = Cache(self.storage, timeToLiveSeconds=30)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        HTTPTestBase.tearDown(self)
+        return
+
+    def testFetchAndPurge(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data2.feed.title, 'CacheTest test data')
+        self.assertEqual(feed_data, feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        self.cache.purge(None)
+        self.assertEqual(self.storage.keys(), [])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.splitstorage
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import unittest
+
+#
+# Import local modules
+#
+from . import cache
+from .splitstorage import SplitStorage
+from .test_server import HTTPTestBase
+
+#
+# Module
+#
+
+
+class CountingDict(dict):
+    "Dictionary which counts how many values are read from it."
+
+    def __init__(self):
+        dict.__init__(self)
+        self.reads = 0
+        return
+
+    def __getitem__(self, key):
+        self.reads += 1
+        return dict.__getitem__(self, key)
+
+
+class SplitStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bodies = CountingDict()
+        self.storage = SplitStorage({}, self.bodies)
+        return
+
+    def testRoundTrip(self):
+        content = {'etag': 'abc', 'modified': 'yesterday', 'feed': {}}
+        self.storage['url'] = (10, content)
+        self.assertEqual(self.storage['url'], (10, content))
+        self.assertEqual(list(self.storage.keys()), ['url'])
+        self.assertTrue('url' in self.storage)
+        return
+
+    def testMetadata(self):
+        content = {'etag': 'abc', 'modified': 'yesterday',
+                   'headers': {'cache-control': 'max-age=60'}}
+        self.storage['url'] = (10, content)
+        metadata = self.storage.get_metadata('url')
+        self.assertEqual(metadata['cached_time'], 10)
+        self.assertEqual(metadata['etag'], 'abc')
+        self.assertEqual(metadata['modified'], 'yesterday')
+        self.assertEqual(metadata['lifetime'], 60)
+        self.assertEqual(metadata['size'], len(self.bodies['url']))
+        self.assertTrue(metadata['hash'])
+        return
+
+    def testTouch(self):
+        self.storage['url'] = (10, {'etag': 'abc'})
+        body = self.bodies['url']
+        self.storage.touch('url', 20)
+        self.assertEqual(self.storage.get_metadata('url')['cached_time'], 20)
+        self.assertTrue(self.bodies['url'] is body)
+        self.assertRaises(KeyError, self.storage.touch, 'other', 20)
+        return
+
+    def testDelete(self):
+        self.storage['url'] = (10, {})
+        del self.storage['url']
+        self.assertFalse(self.storage)
+        self.assertFalse(self.bodies)
+        return
+
+
+class CacheSplitStorageTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.bodies = CountingDict()
+        self.storage = SplitStorage({}, self.bodies)
+        self.cache = cache.Cache(self.storage, timeToLiveSeconds=30)
+        return
+
+    def testFetch(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data, feed_data2)
+        self.assertEqual(feed_data2.feed.title, 'CacheTest test data')
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testExpiredCheckUsesMetadata(self):
+        # Deciding the data has expired and sending the conditional
+        # GET does not load the stored feed.
+        self.server.apply_modified_headers = False
+        self.cache.fetch(self.TEST_URL)
+        self.storage.get_metadata(self.TEST_URL)['cached_time'] = 0
+        reads = self.bodies.reads
+
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.status, 200)
+        self.assertEqual(self.bodies.reads, reads)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        return
+
+    def testHeaderLifetimeUsesMetadata(self):
+        # The lifetime from the cache headers is kept in the metadata,
+        # so a new cache finds it without loading the stored feed.
+        self.server.extra_headers['Cache-Control'] = 'max-age=3600'
+        self.cache.fetch(self.TEST_URL)
+        cached_time = self.storage.get_metadata(self.TEST_URL)['cached_time']
+        reads = self.bodies.reads
+
+        c = cache.Cache(self.storage, timeToLiveSeconds=30,
+                        honorCacheHeaders=True)
+        self.assertEqual(c.get_expiration(self.TEST_URL), cached_time + 3600)
+        self.assertEqual(self.bodies.reads, reads)
+        return
+
+    def testPurgeUsesMetadata(self):
+        self.cache.fetch(self.TEST_URL)
+        reads = self.bodies.reads
+        self.cache.purge(0)
+        self.assertFalse(self.storage)
+        self.assertEqual(self.bodies.reads, reads)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.sqlitestorage
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import gc
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .cache import Cache
+from .sqlitestorage import SQLiteStorage
+from .test_server import HTTPTestBase
+from .test_storage import MetadataStorageTestMixin
+
+#
+# Module
+#
+
+
+class SQLiteStorageTestBase(unittest.TestCase):
+
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp('sqlitestorage')
+        self.storage = SQLiteStorage(os.path.join(self.dirname, 'cache.db'))
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        return
+
+
+class SQLiteStorageTest(MetadataStorageTestMixin, SQLiteStorageTestBase):
+
+    def testGetManyChunks(self):
+        self.storage.set_many(('k%d' % i, (i, None)) for i in range(1200))
+        values = self.storage.get_many('k%d' % i for i in range(0, 1300, 2))
+        self.assertEqual(len(values), 600)
+        self.assertEqual(values['k1198'], (1198, None))
+        return
+
+    def testGetManyDuringWrite(self):
+        # Reads do not wait for another connection's write.
+        self.storage.set_many({'a': (1, None), 'b': (2, None)})
+        writer = SQLiteStorage(self.storage.filename, timeout=0.1)
+        reader = SQLiteStorage(self.storage.filename, timeout=0.1)
+        self.addCleanup(writer.close)
+        self.addCleanup(reader.close)
+        with writer.transaction():
+            writer['a'] = (3, None)
+            self.assertEqual(reader.get_many(['a', 'b']),
+                             {'a': (1, None), 'b': (2, None)})
+        return
+
+    def testTouch(self):
+        self.storage['a'] = (1, {'etag': 'abc'})
+        self.storage.touch('a', 2)
+        self.assertEqual(self.storage['a'], (2, {'etag': 'abc'}))
+        self.assertEqual(self.storage.get_metadata('a')['etag'], 'abc')
+        self.assertRaises(KeyError, self.storage.touch, 'b', 2)
+        return
+
+    def testOlderSchema(self):
+        # A database created before the lifetime column was added
+        # gets the column when it is opened.
+        filename = os.path.join(self.dirname, 'old.db')
+        db = sqlite3.connect(filename)
+        db.execute('CREATE TABLE feeds (key TEXT PRIMARY KEY,'
+                   ' cached_time REAL NOT NULL, etag TEXT, modified TEXT,'
+                   ' body BLOB NOT NULL)')
+        db.execute('INSERT INTO feeds VALUES (?, ?, ?, ?, ?)',
+                   ('a', 1, 'abc', None, self.storage.codec.dumps('one')))
+        db.commit()
+        db.close()
+        storage = SQLiteStorage(filename)
+        self.addCleanup(storage.close)
+        self.assertEqual(storage['a'], (1, 'one'))
+        self.assertEqual(storage.get_metadata('a')['lifetime'], None)
+        storage['b'] = (2, {'headers': {'cache-control': 'max-age=60'}})
+        self.assertEqual(storage.get_metadata('b')['lifetime'], 60)
+        return
+
+    def testTransactionRollback(self):
+        try:
+            with self.storage.transaction():
+                self.storage['a'] = (1, None)
+                raise RuntimeError('stop')
+        except RuntimeError:
+            pass
+        self.assertFalse('a' in self.storage)
+        return
+
+    def testPurgeBefore(self):
+        self.storage.set_many(('k%d' % i, (i, None)) for i in range(10))
+        self.assertEqual(self.storage.purge_before(2, limit=2), 2)
+        self.assertEqual(self.storage.purge_before(4), 3)
+        self.assertEqual(sorted(self.storage.keys()),
+                         ['k5', 'k6', 'k7', 'k8', 'k9'])
+        return
+
+    def testThreads(self):
+        # Each thread uses its own connection.
+        errors = []
+
+        def work(n):
+            try:
+                for i in range(20):
+                    self.storage['%d-%d' % (n, i)] = (i, None)
+                    self.storage.get('%d-%d' % ((n + 1) % 4, i))
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.storage), 80)
+        return
+
+
+    def testThreadExitClosesConnection(self):
+        # Connections opened by threads which have finished are closed.
+        def work():
+            self.storage.get('a')
+
+        for n in range(20):
+            t = threading.Thread(target=work)
+            t.start()
+            t.join()
+        gc.collect()
+        # Only the connection of this thread is left.
+        self.assertEqual(len(self.storage._connections), 1)
+        return
+
+
+class CacheSQLiteStorageTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.dirname = tempfile.mkdtemp('sqlitestorage')
+        self.storage = SQLiteStorage(os.path.join(self.dirname, 'cache.db'))
+        self.cache = Cache(self.storage, timeToLiveSeconds=30)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        HTTPTestBase.tearDown(self)
+        return
+
+    def testFetch(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        feed_data2 = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data2.feed.title, 'CacheTest test data')
+        self.assertEqual(feed_data, feed_data2)
+        self.assertEqual(self.server.getNumRequests(), 1)
+        return
+
+    def testPurge(self):
+        self.cache.fetch(self.TEST_URL)
+        self.storage['http://old/'] = (time.time() - 100, None)
+        self.cache.purge(50)
+        self.assertEqual(self.storage.keys(), [self.TEST_URL])
+        self.assertTrue(self.cache.purge_step(0, budgetSeconds=0))
+        self.assertEqual(self.storage.keys(), [])
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Tests shared by the storage backends.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+
+#
+# Import local modules
+#
+
+#
+# Module
+#
+
+
+class StorageTestMixin:
+    """Tests for the mapping API and the batch methods, for a test
+    case which sets self.storage to an empty storage.
+    """
+
+    def testMappingAPI(self):
+        self.storage['a'] = (1, {'etag': 'abc'})
+        self.assertEqual(self.storage['a'], (1, {'etag': 'abc'}))
+        self.assertEqual(self.storage.get('b'), None)
+        self.assertEqual(self.storage.keys(), ['a'])
+        self.assertEqual(len(self.storage), 1)
+        self.assertTrue('a' in self.storage)
+        del self.storage['a']
+        self.assertFalse('a' in self.storage)
+        self.assertRaises(KeyError, self.storage.__delitem__, 'a')
+        return
+
+    def testBatchOperations(self):
+        self.storage.set_many({'a': (1, None), 'b': (2, None)})
+        self.assertEqual(self.storage.get_many(['a', 'x']), {'a': (1, None)})
+        self.storage.delete_many(['a', 'x'])
+        self.assertEqual(self.storage.keys(), ['b'])
+        return
+
+
+class MetadataStorageTestMixin(StorageTestMixin):
+    "Adds tests for get_metadata() to StorageTestMixin."
+
+    def testMetadata(self):
+        self.storage['a'] = (1, {'etag': 'abc', 'modified': 'today',
+                                 'headers': {'cache-control': 'max-age=60'}})
+        self.storage['b'] = (1, {})
+        metadata = self.storage.get_metadata('a')
+        self.assertEqual(metadata['cached_time'], 1)
+        self.assertEqual(metadata['etag'], 'abc')
+        self.assertEqual(metadata['modified'], 'today')
+        self.assertEqual(metadata['lifetime'], 60)
+        self.assertEqual(self.storage.get_metadata('b')['lifetime'], None)
+        self.assertTrue(metadata['size'] > 0)
+        self.assertEqual(self.storage.get_metadata('c'), None)
+        return
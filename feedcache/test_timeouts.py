@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.timeouts
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import time
+import unittest
+
+#
+# Import local modules
+#
+from . import cache
+from .test_server import HTTPTestBase, TestHTTPHandler, TestHTTPServer
+from .timeouts import DeadlineExceeded, FetchTimeouts, is_timeout
+
+#
+# Module
+#
+
+
+class TarpitHTTPHandler(TestHTTPHandler):
+    "Request handler which can be told to answer slowly."
+
+    def do_GET_200(self):
+        time.sleep(self.server.hang)
+        if not self.server.drip:
+            return TestHTTPHandler.do_GET_200(self)
+        # Send the data a little at a time, fast enough to get past
+        # the read timeout.
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/atom+xml')
+        self.end_headers()
+        data = self.FEED_DATA.encode('utf-8')
+        try:
+            for i in range(0, len(data), 50):
+                self.wfile.write(data[i:i + 50])
+                self.wfile.flush()
+                time.sleep(self.server.drip)
+        except OSError:
+            # The client gave up.
+            pass
+        return
+
+
+class TarpitHTTPServer(TestHTTPServer):
+    "Test server which can be told to stall."
+
+    def __init__(self):
+        TestHTTPServer.__init__(self, handler=TarpitHTTPHandler)
+        self.hang = 0
+        self.drip = 0
+        return
+
+
+class FetchTimeoutsTest(unittest.TestCase):
+
+    def testConnectTimeout(self):
+        timeouts = FetchTimeouts(connectTimeout=5, deadline=1)
+        self.assertTrue(timeouts.next_connect_timeout() <= 1)
+        timeouts = FetchTimeouts(connectTimeout=0.5, deadline=10)
+        self.assertEqual(timeouts.next_connect_timeout(), 0.5)
+        return
+
+    def testDeadlinePassed(self):
+        timeouts = FetchTimeouts(deadline=0)
+        self.assertRaises(DeadlineExceeded, timeouts.next_connect_timeout)
+        self.assertRaises(DeadlineExceeded, timeouts.check)
+        return
+
+    def testIsTimeout(self):
+        import urllib.error
+        self.assertTrue(is_timeout(DeadlineExceeded()))
+        self.assertTrue(is_timeout(urllib.error.URLError(TimeoutError())))
+        self.assertFalse(is_timeout(urllib.error.URLError('refused')))
+        self.assertFalse(is_timeout(None))
+        return
+
+
+class CacheTimeoutTest(HTTPTestBase):
+
+    def getServer(self):
+        return TarpitHTTPServer()
+
+    def getCache(self, **kwds):
+        return cache.Cache({}, timeToLiveSeconds=0,
+                           userAgent='feedcache.test', **kwds)
+
+    def testReadTimeout(self):
+        c = self.getCache(readTimeoutSeconds=0.2)
+        self.server.hang = 1
+        start = time.time()
+        self.assertRaises(TimeoutError, c.fetch, self.TEST_URL)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(c.get_stats()['timeouts'], 1)
+        return
+
+    def testConnectTimeoutNotUsedForReads(self):
+        c = self.getCache(connectTimeoutSeconds=0.2)
+        self.server.hang = 0.5
+        feed_data = c.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        return
+
+    def testDeadline(self):
+        c = self.getCache(readTimeoutSeconds=1, fetchDeadlineSeconds=0.3)
+        self.server.drip = 0.1
+        start = time.time()
+        self.assertRaises(DeadlineExceeded, c.fetch, self.TEST_URL)
+        self.assertTrue(time.time() - start < 0.9)
+        self.assertEqual(c.get_stats()['timeouts'], 1)
+        self.assertEqual(c.storage, {})
+        return
+
+    def testDeadlineNotReached(self):
+        c = self.getCache(fetchDeadlineSeconds=5)
+        feed_data = c.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        return
+
+    def testStaleOnTimeout(self):
+        c = self.getCache(readTimeoutSeconds=0.2, staleIfErrorSeconds=60)
+        feed_data = c.fetch(self.TEST_URL)
+        self.server.hang = 1
+        self.assertEqual(c.fetch(self.TEST_URL), feed_data)
+        self.assertEqual(c.get_stats()['stale_if_error'], 1)
+        return
+
+    def testBudget(self):
+        c = self.getCache(fetchDeadlineSeconds=2)
+        urls = [self.TEST_URL + 'feed%d' % i for i in range(4)]
+        for url in urls:
+            c.fetch(url)
+        self.server.hang = 0.5
+        skipped = []
+        start = time.time()
+        results = dict(c.fetch_many(urls, max_workers=1, budget=0.2,
+                                    skipped=skipped))
+        self.assertTrue(time.time() - start < 1.5)
+        self.assertEqual(sorted(results), urls)
+        self.assertEqual(len(skipped), 3)
+        for url in skipped:
+            self.assertEqual(results[url].feed.title, 'CacheTest test data')
+        self.assertEqual(c.get_stats()['skipped'], 3)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
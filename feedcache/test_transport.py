@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.transport
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import socket
+import unittest
+
+#
+# Import local modules
+#
+from . import cache
+from .test_server import HTTPTestBase, KeepAliveHTTPServer
+from .transport import PooledHTTPTransport
+
+#
+# Module
+#
+
+
+class PooledHTTPTransportTest(HTTPTestBase):
+
+    def getServer(self):
+        return KeepAliveHTTPServer()
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.transport = PooledHTTPTransport()
+        self.cache = cache.Cache({},
+                                 timeToLiveSeconds=0,
+                                 userAgent='feedcache.test',
+                                 transport=self.transport,
+                                 )
+        return
+
+    def tearDown(self):
+        self.transport.close()
+        HTTPTestBase.tearDown(self)
+        return
+
+    def testReusesConnection(self):
+        for i in range(3):
+            feed_data = self.cache.fetch(self.TEST_URL + 'feed%d' % i)
+            self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+            self.assertEqual(feed_data.status, 200)
+        stats = self.transport.get_stats()
+        self.assertEqual(stats['connections_opened'], 1)
+        self.assertEqual(stats['connections_reused'], 2)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(self.server.getNumRequests(), 3)
+        return
+
+    def testConditionalGet(self):
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.cache.fetch(self.TEST_URL), feed_data)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        self.assertEqual(self.transport.get_stats()['connections_opened'], 1)
+        return
+
+    def testRedirect(self):
+        self.server.setResponse(302, self.TEST_URL + 'redirected')
+        feed_data = self.cache.fetch(self.TEST_URL)
+        self.assertEqual(feed_data.status, 302)
+        self.assertEqual(feed_data.href, self.TEST_URL + 'redirected')
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        self.assertEqual(self.transport.get_stats()['connections_opened'], 1)
+        return
+
+    def testRetryClosedConnection(self):
+        self.cache.fetch(self.TEST_URL)
+        # Break the idle connection, as if the server had dropped it.
+        conn, last_used = self.transport._idle[('http', 'localhost:9999')][0]
+        conn.sock.shutdown(socket.SHUT_RDWR)
+        feed_data = self.cache.fetch(self.TEST_URL + 'again')
+        self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        stats = self.transport.get_stats()
+        self.assertEqual(stats['retries'], 1)
+        self.assertEqual(stats['connections_opened'], 2)
+        return
+
+    def testIdleTimeout(self):
+        self.transport.idle_timeout = 0
+        self.cache.fetch(self.TEST_URL + 'feed0')
+        self.cache.fetch(self.TEST_URL + 'feed1')
+        stats = self.transport.get_stats()
+        self.assertEqual(stats['connections_opened'], 2)
+        self.assertFalse('connections_reused' in stats)
+        return
+
+    def testConnectionError(self):
+        feed_data = self.cache.fetch('http://localhost:9998/')
+        self.assertTrue(feed_data.bozo)
+        self.assertFalse('status' in feed_data)
+        self.assertEqual(self.cache.get_stats()['failures'], 1)
+        return
+
+
+class HTTP10TransportTest(HTTPTestBase):
+
+    def testServerClosesConnection(self):
+        # An HTTP/1.0 server closes the connection after each
+        # response, so there is nothing to keep.
+        transport = PooledHTTPTransport()
+        c = cache.Cache({}, timeToLiveSeconds=0, transport=transport)
+        for i in range(2):
+            feed_data = c.fetch(self.TEST_URL + 'feed%d' % i)
+            self.assertEqual(feed_data.feed.title, 'CacheTest test data')
+        stats = transport.get_stats()
+        self.assertEqual(stats['connections_opened'], 2)
+        self.assertEqual(stats['idle'], 0)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
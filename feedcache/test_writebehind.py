@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Unittests for feedcache.writebehind
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+#
+# Import local modules
+#
+from .cache import Cache
+from .splitstorage import SplitStorage
+from .sqlitestorage import SQLiteStorage
+from .test_server import HTTPTestBase
+from .writebehind import WriteBehindStorage
+
+#
+# Module
+#
+
+
+class RecordingStorage(dict):
+    "Dictionary which records the batches written to it."
+
+    def __init__(self, *args):
+        dict.__init__(self, *args)
+        self.batches = []
+        self.closed = False
+        return
+
+    def set_many(self, items):
+        items = list(items)
+        self.batches.append(items)
+        self.update(items)
+        return
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.pop(key, None)
+        return
+
+    def close(self):
+        self.closed = True
+        return
+
+
+class RacingStorage(RecordingStorage):
+    """Storage where another thread stores a new value while a touch()
+    checks whether the key is stored.
+    """
+
+    writer = None
+
+    def __contains__(self, key):
+        if self.writer is None:
+            self.writer = threading.Thread(
+                target=self.buffered.__setitem__, args=(key, (5, 'new')))
+            self.writer.start()
+            # The write waits for the touch to finish.
+            self.writer.join(0.2)
+        return dict.__contains__(self, key)
+
+
+class WriteBehindStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backing = RecordingStorage({'old': (1, 'old data')})
+        self.storage = WriteBehindStorage(self.backing, maxPending=100,
+                                          flushInterval=60)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        return
+
+    def testReadsSeeBufferedWrites(self):
+        self.storage['a'] = (1, {'etag': 'abc'})
+        self.assertFalse('a' in self.backing)
+        self.assertEqual(self.storage['a'], (1, {'etag': 'abc'}))
+        self.assertEqual(self.storage.get_metadata('a')['etag'], 'abc')
+        self.assertEqual(self.storage.get_body('a'), {'etag': 'abc'})
+        self.assertEqual(sorted(self.storage.keys()), ['a', 'old'])
+        self.assertEqual(self.storage.get_many(['a', 'old', 'x']),
+                         {'a': (1, {'etag': 'abc'}), 'old': (1, 'old data')})
+        return
+
+    def testBufferedDelete(self):
+        del self.storage['old']
+        self.assertTrue('old' in self.backing)
+        self.assertFalse('old' in self.storage)
+        self.assertEqual(self.storage.get_metadata('old'), None)
+        self.assertEqual(self.storage.keys(), [])
+        self.assertRaises(KeyError, self.storage.__delitem__, 'old')
+        self.storage.flush()
+        self.assertFalse('old' in self.backing)
+        return
+
+    def testCoalesce(self):
+        for i in range(10):
+            self.storage['a'] = (i, None)
+        self.storage.flush()
+        self.assertEqual(self.backing.batches, [[('a', (9, None))]])
+        stats = self.storage.get_stats()
+        self.assertEqual(stats['writes'], 10)
+        self.assertEqual(stats['coalesced'], 9)
+        self.assertEqual(stats['flushes'], 1)
+        self.assertEqual(stats['pending'], 0)
+        return
+
+    def testTouch(self):
+        self.storage.touch('old', 2)
+        self.assertEqual(self.storage['old'], (2, 'old data'))
+        self.assertEqual(self.storage.get_metadata('old')['cached_time'], 2)
+        self.assertEqual(self.storage.get_many(['old']),
+                         {'old': (2, 'old data')})
+        self.assertEqual(self.backing['old'], (1, 'old data'))
+        self.storage['new'] = (1, 'new data')
+        self.storage.touch('new', 3)
+        self.assertRaises(KeyError, self.storage.touch, 'missing', 2)
+        self.storage.flush()
+        self.assertEqual(self.backing['old'], (2, 'old data'))
+        self.assertEqual(self.backing['new'], (3, 'new data'))
+        return
+
+    def testTouchRacingWrite(self):
+        # A value stored during a touch() is not lost.
+        backing = RacingStorage({'a': (1, 'old')})
+        storage = backing.buffered = WriteBehindStorage(backing)
+        storage.touch('a', 2)
+        backing.writer.join()
+        self.assertEqual(storage['a'], (5, 'new'))
+        storage.close()
+        self.assertEqual(backing['a'], (5, 'new'))
+        return
+
+    def testTouchUsesStorageTouch(self):
+        backing = SplitStorage({}, {})
+        backing['a'] = (1, 'data')
+        storage = WriteBehindStorage(backing)
+        storage.touch('a', 2)
+        storage.close()
+        self.assertEqual(backing.get_metadata('a')['cached_time'], 2)
+        return
+
+    def testFlushOnSize(self):
+        for i in range(100):
+            self.storage['key%d' % i] = (i, None)
+        deadline = time.time() + 5
+        while len(self.backing) < 101 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(self.backing), 101)
+        return
+
+    def testFlushOnTime(self):
+        self.storage.close()
+        self.storage = WriteBehindStorage(self.backing, flushInterval=0.05)
+        self.storage['a'] = (1, None)
+        deadline = time.time() + 5
+        while 'a' not in self.backing and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue('a' in self.backing)
+        return
+
+    def testClose(self):
+        self.storage['a'] = (1, None)
+        self.storage.close()
+        self.assertEqual(self.backing['a'], (1, None))
+        self.assertTrue(self.backing.closed)
+        self.assertRaises(ValueError, self.storage.__setitem__, 'b', (1, None))
+        return
+
+    def testPlainDictionary(self):
+        backing = {'old': (1, None)}
+        storage = WriteBehindStorage(backing)
+        storage['a'] = (2, None)
+        del storage['old']
+        self.assertFalse(hasattr(storage, 'purge_before'))
+        storage.close()
+        self.assertEqual(backing, {'a': (2, None)})
+        return
+
+
+class CacheWriteBehindTest(HTTPTestBase):
+
+    def setUp(self):
+        HTTPTestBase.setUp(self)
+        self.dirname = tempfile.mkdtemp('writebehind')
+        self.backing = SQLiteStorage(os.path.join(self.dirname, 'cache.db'))
+        self.storage = WriteBehindStorage(self.backing, flushInterval=60)
+        self.cache = Cache(self.storage, timeToLiveSeconds=30)
+        return
+
+    def tearDown(self):
+        self.storage.close()
+        shutil.rmtree(self.dirname)
+        HTTPTestBase.tearDown(self)
+        return
+
+    def testRevalidationIsBuffered(self):
+        self.cache.fetch(self.TEST_URL)
+        self.storage.flush()
+        self.backing[self.TEST_URL] = (0, self.backing.get_body(self.TEST_URL))
+        self.cache.fetch(self.TEST_URL)
+        self.assertEqual(self.server.getNumRequests(), 2)
+        # The new timestamp is only in the buffer until a flush.
+        url = self.TEST_URL
+        self.assertEqual(self.backing.get_metadata(url)['cached_time'], 0)
+        self.assertTrue(self.storage.get_metadata(url)['cached_time'] > 0)
+        self.storage.flush()
+        self.assertTrue(self.backing.get_metadata(url)['cached_time'] > 0)
+        return
+
+    def testPurgeFlushesFirst(self):
+        self.storage['http://old/'] = (time.time() - 100, None)
+        self.cache.purge(50)
+        self.assertFalse('http://old/' in self.storage)
+        self.assertFalse('http://old/' in self.backing)
+        return
+
+
+if __name__ == '__main__':
+    unittest.main()
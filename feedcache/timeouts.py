@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Connect and read timeouts and an overall deadline for one fetch.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import functools
+import http.client
+import socket
+import threading
+import time
+import urllib.request
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+
+class DeadlineExceeded(TimeoutError):
+    "The whole fetch took longer than its deadline."
+
+
+def is_timeout(error):
+    """Return True if error, as raised by feedparser or stored in
+    bozo_exception, is the result of a timeout.
+    """
+    # urllib wraps errors raised while connecting in a URLError.
+    return (isinstance(error, TimeoutError)
+            or isinstance(getattr(error, 'reason', None), TimeoutError))
+
+
+class FetchTimeouts:
+    """Limits for one fetch, applied through the urllib handlers
+    returned by handlers().
+
+    The connect timeout covers opening the connection (including the
+    TLS handshake), and the read timeout covers each read after that.
+    A server which sends a byte now and then can get past both, so
+    when there is a deadline each connection's socket is shut down
+    when it passes.  The response may then look like it ended early,
+    so check() must be called after parsing to turn that into an
+    error.  cancel() stops the deadline timers.
+    """
+
+    def __init__(self, connectTimeout=None, readTimeout=None,
+                 deadline=None):
+        """
+        Arguments:
+
+          connectTimeout=None -- Seconds allowed for connecting.
+
+          readTimeout=None -- Seconds allowed for each read.
+
+          deadline=None -- Seconds allowed for the whole fetch,
+          including redirects, starting now.
+
+        """
+        self.connect_timeout = connectTimeout
+        self.read_timeout = readTimeout
+        self.deadline = None
+        if deadline is not None:
+            self.deadline = time.monotonic() + deadline
+        self.expired = False
+        self._timers = []
+        self._lock = threading.Lock()
+        return
+
+    def handlers(self):
+        "Return the handlers to give to feedparser.parse()."
+        return [_TimeoutHTTPHandler(self), _TimeoutHTTPSHandler(self)]
+
+    def _remaining(self):
+        "Return the seconds left before the deadline, or None."
+        if self.deadline is None:
+            return None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            self.expired = True
+            raise DeadlineExceeded('fetch deadline passed')
+        return remaining
+
+    def next_connect_timeout(self):
+        "Return the timeout to use for a new connection."
+        timeouts = [t for t in (self.connect_timeout, self._remaining())
+                    if t is not None]
+        if not timeouts:
+            return socket.getdefaulttimeout()
+        return min(timeouts)
+
+    def connected(self, sock):
+        """Apply the read timeout and deadline to a new or reused
+        connection.  Without a read timeout, reads use the default
+        socket timeout rather than the one used to connect.
+        """
+        remaining = self._remaining()
+        if self.read_timeout is not None:
+            sock.settimeout(self.read_timeout)
+        else:
+            sock.settimeout(socket.getdefaulttimeout())
+        if remaining is not None:
+            timer = threading.Timer(remaining, self._expire, (sock,))
+            timer.daemon = True
+            with self._lock:
+                self._timers.append(timer)
+            timer.start()
+        return
+
+    def _expire(self, sock):
+        "Timer target: wake up anything blocked reading from sock."
+        self.expired = True
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # The connection is already closed.
+            pass
+        return
+
+    def check(self):
+        "Raise DeadlineExceeded if the deadline passed during the fetch."
+        if self.expired:
+            raise DeadlineExceeded('fetch deadline passed')
+        return
+
+    def cancel(self):
+        "Stop the deadline timers."
+        with self._lock:
+            timers, self._timers = self._timers, []
+        for timer in timers:
+            timer.cancel()
+        return
+
+
+class _TimeoutConnectionMixin:
+    "Report new connections to a FetchTimeouts."
+
+    def __init__(self, *args, timeouts=None, **kwds):
+        super().__init__(*args, **kwds)
+        self.timeouts = timeouts
+        return
+
+    def connect(self):
+        super().connect()
+        self.timeouts.connected(self.sock)
+        return
+
+
+class _TimeoutHTTPConnection(_TimeoutConnectionMixin,
+                             http.client.HTTPConnection):
+    pass
+
+
+class _TimeoutHTTPSConnection(_TimeoutConnectionMixin,
+                              http.client.HTTPSConnection):
+    pass
+
+
+class _TimeoutHTTPHandler(urllib.request.HTTPHandler):
+
+    def __init__(self, timeouts):
+        urllib.request.HTTPHandler.__init__(self)
+        self.timeouts = timeouts
+        return
+
+    def http_open(self, req):
+        # do_open() passes req.timeout to the connection.
+        req.timeout = self.timeouts.next_connect_timeout()
+        return self.do_open(
+            functools.partial(_TimeoutHTTPConnection, timeouts=self.timeouts),
+            req)
+
+
+class _TimeoutHTTPSHandler(urllib.request.HTTPSHandler):
+
+    def __init__(self, timeouts):
+        urllib.request.HTTPSHandler.__init__(self)
+        self.timeouts = timeouts
+        return
+
+    def https_open(self, req):
+        req.timeout = self.timeouts.next_connect_timeout()
+        return self.do_open(
+            functools.partial(_TimeoutHTTPSConnection,
+                              timeouts=self.timeouts),
+            req, context=self._context)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""HTTP transports which fetch feed data for Cache to parse.
+
+A transport has a get(url, request_headers, timeouts=None) method.
+It follows redirects and returns a tuple containing the status, the
+URL of the data after any redirects, the response headers with
+lower-case names, and the body.  As with feed parser, when redirects
+are followed the status is the redirect code and not the status of
+the final response.  timeouts is a feedcache.timeouts.FetchTimeouts,
+or None.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import feedparser
+
+import calendar
+import collections
+import email.utils
+import gzip
+import http.client
+import io
+import logging
+import ssl
+import struct
+import threading
+import time
+import urllib.parse
+import zlib
+
+#
+# Import local modules
+#
+
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.transport')
+
+# Maximum number of redirects followed for one request.
+MAX_REDIRECTS = 5
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+def _format_modified(modified):
+    """Return modified as a value for an If-Modified-Since header.
+
+    Feed parser stores the Last-Modified header as a string, but older
+    cached data may hold a time tuple instead.
+    """
+    if isinstance(modified, str):
+        return modified
+    return email.utils.formatdate(calendar.timegm(modified), usegmt=True)
+
+
+def _parse_response(url, status, headers, body):
+    """Parse a feed from an HTTP response body.
+
+    Builds a result which looks like the one feed parser produces when
+    it fetches the URL itself.  This is a module-level function so it
+    can be run by a process pool as well as by threads.
+    """
+    error = None
+    encoding = headers.get('content-encoding', '')
+    if body and 'gzip' in encoding:
+        try:
+            body = gzip.GzipFile(fileobj=io.BytesIO(body)).read()
+        except (EOFError, IOError, struct.error) as e:
+            error = e
+    elif body and 'deflate' in encoding:
+        try:
+            body = zlib.decompress(body)
+        except zlib.error:
+            try:
+                # The data may have no headers and no checksum.
+                body = zlib.decompress(body, -15)
+            except zlib.error as e:
+                error = e
+
+    response_headers = dict(headers)
+    response_headers.setdefault('content-location', url)
+    result = feedparser.parse(io.BytesIO(body),
+                              response_headers=response_headers)
+    result['headers'] = headers
+    result['href'] = url
+    result['status'] = status
+    if headers.get('etag'):
+        result['etag'] = headers['etag']
+    if headers.get('last-modified'):
+        result['modified'] = headers['last-modified']
+        result['modified_parsed'] = feedparser.datetimes._parse_date(
+            headers['last-modified'])
+    if error is not None:
+        result['bozo'] = True
+        result['bozo_exception'] = error
+    return result
+
+
+def _error_result(error):
+    """Report error the way feed parser does when it cannot fetch a
+    URL, so the result is handled like any other failed request.
+    """
+    return feedparser.FeedParserDict(
+        bozo=True,
+        bozo_exception=error,
+        entries=[],
+        feed=feedparser.FeedParserDict(),
+        headers={},
+        )
+
+
+class PooledHTTPTransport:
+    """Transport which keeps connections open between requests.
+
+    Idle connections are kept for each scheme and host, so fetching
+    several feeds from one server only pays for connecting (and the
+    TLS handshake) once.  A request sent on a connection the server
+    has closed in the meantime is retried once on a new connection.
+    The transport is safe to share between threads; each request
+    has a connection to itself while it runs.
+    """
+
+    def __init__(self, maxIdlePerHost=4, idleTimeoutSeconds=30,
+                 sslContext=None):
+        """
+        Arguments:
+
+          maxIdlePerHost=4 -- Most idle connections kept for one host.
+          Set it to about the number of requests run at once for a
+          host.
+
+          idleTimeoutSeconds=30 -- Close connections which have not
+          been used for this long instead of reusing them.  Servers
+          usually close idle connections after a while anyway.
+
+          sslContext=None -- ssl.SSLContext for HTTPS connections.
+          The default context is used if no value is given.
+
+        """
+        self.max_idle_per_host = maxIdlePerHost
+        self.idle_timeout = idleTimeoutSeconds
+        self.ssl_context = sslContext
+        # Lists of (connection, last_used) pairs by (scheme, netloc).
+        self._idle = {}
+        self._lock = threading.Lock()
+        self.stats = collections.Counter()
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the transport.
+
+          requests -- HTTP requests sent, including redirects.
+
+          connections_opened -- New connections made.
+
+          connections_reused -- Requests sent on an idle connection.
+
+          retries -- Requests sent again because the server had
+          closed an idle connection.
+
+          idle -- Connections waiting to be reused.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['idle'] = sum(len(v) for v in self._idle.values())
+        return stats
+
+    def _count(self, name):
+        "Increment the named counter in the stats."
+        with self._lock:
+            self.stats[name] += 1
+        return
+
+    def _connect(self, scheme, netloc, timeouts):
+        "Return a new connection to netloc."
+        timeout = None
+        if timeouts is not None:
+            timeout = timeouts.next_connect_timeout()
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context()
+            conn = http.client.HTTPSConnection(netloc, timeout=timeout,
+                                               context=self.ssl_context)
+        elif scheme == 'http':
+            conn = http.client.HTTPConnection(netloc, timeout=timeout)
+        else:
+            raise ValueError('Unsupported URL scheme %r' % scheme)
+        conn.connect()
+        self._count('connections_opened')
+        return conn
+
+    def _checkout(self, key):
+        "Return an idle connection for key, or None."
+        now = time.monotonic()
+        stale = []
+        conn = None
+        with self._lock:
+            idle = self._idle.get(key)
+            while idle:
+                candidate, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    conn = candidate
+                    break
+                stale.append(candidate)
+        for candidate in stale:
+            candidate.close()
+        return conn
+
+    def _checkin(self, key, conn):
+        "Keep conn for another request to key, if there is room."
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle_per_host:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+        return
+
+    def _request(self, key, path, request_headers, timeouts):
+        """Send one GET request and return the status, the headers
+        with lower-case names, and the body.
+        """
+        while True:
+            conn = self._checkout(key)
+            reused = conn is not None
+            if reused:
+                conn.sock.settimeout(None)
+            else:
+                conn = self._connect(key[0], key[1], timeouts)
+            try:
+                if timeouts is not None:
+                    timeouts.connected(conn.sock)
+                self._count('requests')
+                conn.request('GET', path, headers=request_headers)
+                response = conn.getresponse()
+                body = response.read()
+            except ConnectionError:
+                conn.close()
+                if not reused:
+                    raise
+                # The server closed the connection while it was idle.
+                logger.debug('idle connection to %s was closed', key[1])
+                self._count('retries')
+                continue
+            except Exception:
+                conn.close()
+                raise
+            if reused:
+                self._count('connections_reused')
+            break
+
+        headers = {}
+        for name, value in response.getheaders():
+            name = name.lower()
+            if name in headers:
+                headers[name] += ', ' + value
+            else:
+                headers[name] = value
+        if response.will_close or (timeouts is not None and timeouts.expired):
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        return response.status, headers, body
+
+    def get(self, url, request_headers, timeouts=None):
+        "Fetch url, following redirects.  See the module docstring."
+        redirect_status = None
+        for attempt in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+            status, headers, body = self._request(
+                (parts.scheme, parts.netloc), path, request_headers,
+                timeouts)
+            if status in REDIRECT_CODES and 'location' in headers:
+                redirect_status = status
+                url = urllib.parse.urljoin(url, headers['location'])
+                logger.debug('redirected to %s', url)
+                continue
+            return (redirect_status or status, url, headers, body)
+
+        raise IOError('Too many redirects for %s' % url)
+
+    def close(self):
+        "Close the idle connections."
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for conn, last_used in connections:
+                conn.close()
+        return
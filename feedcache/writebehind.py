@@ -0,0 +1,413 @@
+#!/usr/bin/env python
+#
+# Copyright 2007 Doug Hellmann.
+#
+#
+#                         All Rights Reserved
+#
+# Permission to use, copy, modify, and distribute this software and
+# its documentation for any purpose and without fee is hereby
+# granted, provided that the above copyright notice appear in all
+# copies and that both that copyright notice and this permission
+# notice appear in supporting documentation, and that the name of Doug
+# Hellmann not be used in advertising or publicity pertaining to
+# distribution of the software without specific, written prior
+# permission.
+#
+# DOUG HELLMANN DISCLAIMS ALL WARRANTIES WITH REGARD TO THIS SOFTWARE,
+# INCLUDING ALL IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS, IN
+# NO EVENT SHALL DOUG HELLMANN BE LIABLE FOR ANY SPECIAL, INDIRECT OR
+# CONSEQUENTIAL DAMAGES OR ANY DAMAGES WHATSOEVER RESULTING FROM LOSS
+# OF USE, DATA OR PROFITS, WHETHER IN AN ACTION OF CONTRACT,
+# NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF OR IN
+# CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+#
+
+"""Storage wrapper which writes updates in the background.
+
+"""
+
+__module_id__ = "$Id$"
+
+#
+# Import system modules
+#
+import collections
+import collections.abc
+import logging
+import threading
+
+#
+# Import local modules
+#
+from . import freshness
+
+#
+# Module
+#
+
+logger = logging.getLogger('feedcache.writebehind')
+
+# Marks a key whose removal has not been written yet.
+_DELETED = object()
+
+
+class _Touched:
+    "Marks a key whose new cached time has not been written yet."
+
+    def __init__(self, cached_time):
+        self.cached_time = cached_time
+        return
+
+
+class WriteBehindStorage(collections.abc.MutableMapping):
+    """Wrapper which buffers writes to another storage.
+
+    Storing a value only records it in memory and returns.  A
+    background thread writes the buffered values to the wrapped
+    storage in batches, when maxPending keys are waiting or
+    flushInterval seconds have passed.  Only the last value stored
+    for a key is written, so the timestamp updates the Cache makes
+    after each 304 response cost one write per flush however often
+    the feed is checked.  Those updates are passed on with the
+    storage's touch() method, if it has one.  Reads see buffered
+    values before they are written.
+
+    Buffered writes are lost if the process dies before they are
+    flushed.  close() (or flush()) writes everything that is
+    waiting.
+    """
+
+    def __init__(self, storage, maxPending=1000, flushInterval=1.0):
+        """
+        Arguments:
+
+          storage -- The storage to write to.  set_many() and
+          delete_many() are used for the batches if it has them.
+
+          maxPending=1000 -- Number of buffered keys which triggers a
+          flush.
+
+          flushInterval=1.0 -- Longest time, in seconds, a write
+          waits in the buffer.
+
+        """
+        self.storage = storage
+        self.max_pending = maxPending
+        self.flush_interval = flushInterval
+        self._pending = {}
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.stats = collections.Counter()
+        if hasattr(storage, 'purge_before'):
+            self.purge_before = self._purge_before
+        self._writer = threading.Thread(target=self._write_loop,
+                                        name='feedcache-write-behind')
+        self._writer.daemon = True
+        self._writer.start()
+        return
+
+    def get_stats(self):
+        """Return a dictionary of counters describing the work done by
+        the buffer.
+
+          writes -- Values and removals stored through the wrapper.
+
+          coalesced -- Writes replaced by a later write for the same
+          key before they were flushed.
+
+          flushes -- Batches written to the storage.
+
+          flushed -- Values and removals written to the storage.
+
+          pending -- Keys waiting to be written.
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._pending)
+        return stats
+
+    #
+    # Buffering and flushing
+    #
+
+    def _buffer(self, items):
+        "Record (key, value or _DELETED) pairs in the buffer."
+        with self._lock:
+            self._add_pending(items)
+        return
+
+    def _add_pending(self, items):
+        "Add items to the buffer.  Call with the lock held."
+        if self._closed:
+            raise ValueError('storage is closed')
+        for key, value in items:
+            self.stats['writes'] += 1
+            if key in self._pending:
+                self.stats['coalesced'] += 1
+            self._pending[key] = value
+        if len(self._pending) >= self.max_pending:
+            self._wake.notify()
+        return
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                if not self._closed and len(self._pending) < self.max_pending:
+                    self._wake.wait(self.flush_interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('write-behind flush failed')
+
+    def flush(self):
+        "Write all of the buffered values to the storage."
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                batch = self._flushing = self._pending
+                self._pending = {}
+            try:
+                self._write_batch(batch)
+            except BaseException:
+                with self._lock:
+                    # Keep what failed, unless it was replaced since.
+                    for key, value in batch.items():
+                        self._pending.setdefault(key, value)
+                    self._flushing = {}
+                raise
+            with self._lock:
+                self._flushing = {}
+                self.stats['flushes'] += 1
+                self.stats['flushed'] += len(batch)
+        return
+
+    def _write_batch(self, batch):
+        removed = []
+        touched = []
+        stored = []
+        for key, value in batch.items():
+            if value is _DELETED:
+                removed.append(key)
+            elif isinstance(value, _Touched):
+                touched.append((key, value.cached_time))
+            else:
+                stored.append((key, value))
+        set_many = getattr(self.storage, 'set_many', None)
+        if set_many is not None:
+            set_many(stored)
+        else:
+            for key, value in stored:
+                self.storage[key] = value
+        delete_many = getattr(self.storage, 'delete_many', None)
+        if delete_many is not None:
+            delete_many(removed)
+        else:
+            for key in removed:
+                try:
+                    del self.storage[key]
+                except KeyError:
+                    pass
+        touch = getattr(self.storage, 'touch', None)
+        for key, cached_time in touched:
+            try:
+                if touch is not None:
+                    touch(key, cached_time)
+                else:
+                    content = self.storage[key][1]
+                    self.storage[key] = (cached_time, content)
+            except KeyError:
+                # Removed from the storage by someone else.
+                pass
+        return
+
+    def _buffered(self, key):
+        """Return the buffered value for key, _DELETED, a _Touched, or
+        None if nothing is waiting to be written for it.
+        """
+        with self._lock:
+            return self._find_pending(key)
+
+    def _find_pending(self, key):
+        "Return what _buffered() does.  Call with the lock held."
+        value = self._pending.get(key)
+        if value is None:
+            value = self._flushing.get(key)
+        return value
+
+    #
+    # Reading
+    #
+
+    def _current(self, key):
+        "Return the value for key, combining the buffer and the storage."
+        value = self._buffered(key)
+        if value is None:
+            return self.storage[key]
+        if value is _DELETED:
+            raise KeyError(key)
+        if isinstance(value, _Touched):
+            return (value.cached_time, self.storage[key][1])
+        return value
+
+    def get_metadata(self, key):
+        "Return the metadata record for key, or None."
+        value = self._buffered(key)
+        if value is _DELETED:
+            return None
+        if value is None or isinstance(value, _Touched):
+            get_metadata = getattr(self.storage, 'get_metadata', None)
+            if get_metadata is not None:
+                metadata = get_metadata(key)
+                if metadata is not None and value is not None:
+                    metadata = dict(metadata, cached_time=value.cached_time)
+                return metadata
+            try:
+                value = self._current(key)
+            except KeyError:
+                return None
+        cached_time, content = value
+        get = getattr(content, 'get', None)
+        return {'cached_time': cached_time,
+                'etag': get('etag') if get else None,
+                'modified': get('modified') if get else None,
+                'lifetime': freshness.stored_lifetime(content, cached_time),
+                }
+
+    def get_body(self, key):
+        "Return the parsed feed stored for key."
+        value = self._buffered(key)
+        if value is None or isinstance(value, _Touched):
+            get_body = getattr(self.storage, 'get_body', None)
+            if get_body is not None:
+                return get_body(key)
+            value = self.storage[key]
+        elif value is _DELETED:
+            raise KeyError(key)
+        return value[1]
+
+    #
+    # Mapping API
+    #
+
+    def __getitem__(self, key):
+        return self._current(key)
+
+    def __setitem__(self, key, value):
+        self._buffer([(key, value)])
+        return
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._buffer([(key, _DELETED)])
+        return
+
+    def __contains__(self, key):
+        value = self._buffered(key)
+        if value is None or isinstance(value, _Touched):
+            return key in self.storage
+        return value is not _DELETED
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def keys(self):
+        "Return a list of the keys, including those not written yet."
+        with self._lock:
+            buffered = dict(self._flushing)
+            buffered.update(self._pending)
+        keys = set(self.storage.keys())
+        for key, value in buffered.items():
+            if value is _DELETED:
+                keys.discard(key)
+            elif not isinstance(value, _Touched):
+                keys.add(key)
+        return list(keys)
+
+    def get_many(self, keys):
+        """Return a dictionary with the values for those keys which are
+        in the storage or the buffer.
+        """
+        values = {}
+        missing = []
+        touched = {}
+        for key in keys:
+            value = self._buffered(key)
+            if value is None:
+                missing.append(key)
+            elif isinstance(value, _Touched):
+                missing.append(key)
+                touched[key] = value.cached_time
+            elif value is not _DELETED:
+                values[key] = value
+        get_many = getattr(self.storage, 'get_many', None)
+        if get_many is not None:
+            values.update(get_many(missing))
+        else:
+            for key in missing:
+                value = self.storage.get(key)
+                if value is not None:
+                    values[key] = value
+        for key, cached_time in touched.items():
+            if key in values:
+                values[key] = (cached_time, values[key][1])
+        return values
+
+    def set_many(self, items):
+        "Store each (key, value) pair in items, or a dictionary."
+        if hasattr(items, 'items'):
+            items = items.items()
+        self._buffer(items)
+        return
+
+    def touch(self, key, cached_time):
+        "Change the time key was stored."
+        # Look up and replace the buffered value in one step, so a
+        # value buffered in between is not lost.
+        with self._lock:
+            value = self._find_pending(key)
+            if value is _DELETED or (value is None
+                                     and key not in self.storage):
+                raise KeyError(key)
+            if value is None or isinstance(value, _Touched):
+                value = _Touched(cached_time)
+            else:
+                value = (cached_time, value[1])
+            self._add_pending([(key, value)])
+        return
+
+    def delete_many(self, keys):
+        "Remove keys, ignoring any which are not there."
+        self._buffer([(key, _DELETED) for key in keys])
+        return
+
+    def _purge_before(self, cutoff, limit=None):
+        """Flush, then let the storage remove the entries stored at or
+        before cutoff.
+        """
+        self.flush()
+        return self.storage.purge_before(cutoff, limit)
+
+    def close(self):
+        "Write everything buffered, then close the storage."
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wake.notify()
+        self._writer.join()
+        self.flush()
+        close = getattr(self.storage, 'close', None)
+        if close is not None:
+            close()
+        return